@@ -0,0 +1,247 @@
+import argparse
+import json
+import random
+import re
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import tantivy
+
+import columns
+import query_cache
+import recommend
+import records
+import search_service
+import sharding
+import utils
+import vectors
+
+RANK_FIELDS = ("tmdb_popularity", "tmdb_vote_average", "females")
+
+
+def synthetic_workload(searcher, size, seed=0, skew=1.1):
+    """
+        Draw a query workload from the titles stored in the index.
+
+        Titles are picked with a Zipf-like skew so that a few titles make up
+        most of the queries, like the real traffic. Usage:
+
+            python benchmark.py --threads 1,2,4,8 --output bench_results.json
+            python benchmark.py --workload queries.txt --compare bench_results.json
+
+        Args:
+            searcher (tantivy.Searcher): The Tantivy searcher object.
+            size (int): Number of queries.
+            seed (int): Seed of the random generator.
+            skew (float): Exponent of the popularity distribution.
+
+        Returns:
+            list: Query strings.
+        """
+    rng = random.Random(seed)
+    hits = searcher.search(tantivy.Query.all_query(), min(searcher.num_docs, 2000), count=False).hits
+    # strip query syntax (quotes, colons, brackets) so every title parses
+    titles = [re.sub(r"[^\w\s]", " ", searcher.doc(address)["title"][0]).strip() for _, address in hits]
+    rng.shuffle(titles)
+    weights = [1 / (rank + 1) ** skew for rank in range(len(titles))]
+    return rng.choices(titles, weights=weights, k=size)
+
+
+def load_workload(path):
+    with open(path, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def stages(index_path, shard_dirs=()):
+    """
+        Return the benchmarked stages as name -> (setup, run).
+
+        `setup(query)` prepares the input of a stage outside the timing,
+        `run(prepared)` is the timed operation. A vector index built by
+        vectors.py adds the vector lookup of similar series. Every directory
+        of a sharded catalog (see sharding.build) adds a scatter-gather title
+        search and a popularity-ordered search, named after the number of
+        shards, so building the same catalog with 1, 2, 4, ... shards shows
+        how the search scales.
+        """
+    index = search_service.get_index(index_path)
+    searcher = search_service.get_searcher(index_path)
+    store = columns.get_columns(index_path)
+
+    def title_search(text):
+        query = index.parse_query(text, ['title'])
+        return [records.load(searcher, address) for _, address in searcher.search(query, 5).hits]
+
+    def simple_search(text):
+        cleaned = re.sub(r"[^\w\s]", " ", text).strip()
+        query = index.parse_query(cleaned, ["title", "description"])
+        return [records.load(searcher, address) for _, address in searcher.search(query, 20).hits]
+
+    def selected(text):
+        hits = searcher.search(index.parse_query(text, ['title']), 1).hits
+        if not hits:
+            return None
+        address = hits[0][1]
+        return address, records.load(searcher, address, records.SIMILARITY_FIELDS)
+
+    def similar(text):
+        target = selected(text)
+        if target is None:
+            return None
+        address, doc = target
+        return address, recommend.query_hits(index, searcher, doc)
+
+    def mlt(target):
+        address, doc = target
+        return searcher.search(recommend.similarity_query(index, searcher, doc), limit=recommend.TOP_K_SIM).hits
+
+    def rank(field_name):
+        def run(target):
+            address, hits = target
+            return utils.rank(searcher, hits, address, field_name, False, columns=store)
+        return run
+
+    def ranked(text):
+        target = similar(text)
+        if target is None:
+            return None
+        address, hits = target
+        pop_docs = utils.rank(searcher, hits, address, "tmdb_popularity", False, columns=store)
+        gender_docs = utils.rank(searcher, hits, address, "females", False, columns=store)
+        return pop_docs[:5], gender_docs[:5]
+
+    def re_rank(target):
+        pop_docs, gender_docs = target
+        return utils.re_rank(list(pop_docs), list(gender_docs), 0.5)
+
+    result = {
+        "title_search": (lambda text: text, title_search),
+        "title_search_cached": (lambda text: text,
+                                lambda text: query_cache.cached_search(text, ['title'], 5, index_path)),
+        "simple_search": (lambda text: text, simple_search),
+        "mlt": (selected, mlt),
+    }
+    for field_name in RANK_FIELDS:
+        result["rank_" + field_name] = (similar, rank(field_name))
+    result["re_rank"] = (ranked, re_rank)
+    vector_index = vectors.get_index(index_path=index_path)
+    if vector_index is not None:
+        result["vector_similar"] = (selected, lambda target: vector_index.similar(searcher, target[0],
+                                                                                  recommend.TOP_K_SIM))
+    for shard_dir in shard_dirs:
+        sharded = sharding.get_searcher(shard_dir)
+        suffix = f"@{len(sharded.paths)}"
+        result["sharded_search" + suffix] = (
+            lambda text: text,
+            lambda text, sharded=sharded: sharded.search(text, ("title",), 5, distinct=True))
+        result["sharded_rank_popularity" + suffix] = (
+            lambda text: text,
+            lambda text, sharded=sharded: sharded.search(text, ("title", "description"), 20,
+                                                         "tmdb_popularity", distinct=True))
+    return result
+
+
+def measure(run, inputs, threads):
+    """
+        Run a stage over all inputs on a thread pool.
+
+        Returns:
+            dict: Latency percentiles in milliseconds and throughput in ops/s.
+        """
+    def timed(prepared):
+        start = time.perf_counter()
+        run(prepared)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        latencies = np.fromiter(pool.map(timed, inputs), dtype=np.float64, count=len(inputs))
+    elapsed = time.perf_counter() - start
+    p50, p95, p99 = np.percentile(latencies * 1000, [50, 95, 99])
+    return {
+        "threads": threads,
+        "ops": len(inputs),
+        "p50_ms": round(float(p50), 4),
+        "p95_ms": round(float(p95), 4),
+        "p99_ms": round(float(p99), 4),
+        "mean_ms": round(float(latencies.mean() * 1000), 4),
+        "throughput": round(len(inputs) / elapsed, 2),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(index_path, workload, threads, selected_stages=None, warmup=20, shard_dirs=()):
+    results = []
+    for name, (setup, run) in stages(index_path, shard_dirs).items():
+        if selected_stages and name not in selected_stages:
+            continue
+        inputs = [prepared for prepared in map(setup, workload) if prepared is not None]
+        if not inputs:
+            continue
+        for prepared in inputs[:warmup]:
+            run(prepared)
+        for count in threads:
+            result = measure(run, inputs, count)
+            result["stage"] = name
+            results.append(result)
+            print(f"{name:28s} threads={count:<3d} p50={result['p50_ms']:8.3f}ms "
+                  f"p95={result['p95_ms']:8.3f}ms p99={result['p99_ms']:8.3f}ms "
+                  f"{result['throughput']:10.1f} ops/s")
+    return results
+
+
+def compare(results, baseline_path):
+    """Print the p50/p95 change of every stage against an earlier results file."""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {(r["stage"], r["threads"]): r for r in json.load(f)["results"]}
+    for result in results:
+        before = baseline.get((result["stage"], result["threads"]))
+        if before is None:
+            continue
+        changes = [f"{key}={result[key] / before[key] - 1:+.1%}" for key in ("p50_ms", "p95_ms")
+                   if before[key]]
+        print(f"{result['stage']:28s} threads={result['threads']:<3d} " + " ".join(changes))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Latency benchmark of the search and recommendation paths.")
+    parser.add_argument("--index", default=search_service.INDEX_PATH, help="tantivy index directory")
+    parser.add_argument("--workload", help="file with one query per line (default: synthetic from titles)")
+    parser.add_argument("--queries", type=int, default=500, help="size of the synthetic workload")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic workload")
+    parser.add_argument("--threads", default="1,2,4,8", help="comma-separated thread counts")
+    parser.add_argument("--stages", help="comma-separated subset of stages")
+    parser.add_argument("--shards", help="comma-separated directories of sharded catalogs (see sharding.py)")
+    parser.add_argument("--output", default="bench_results.json", help="JSON results file")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    args = parser.parse_args()
+
+    searcher = search_service.get_searcher(args.index)
+    if args.workload:
+        workload = load_workload(args.workload)
+    else:
+        workload = synthetic_workload(searcher, args.queries, args.seed)
+    threads = [int(count) for count in args.threads.split(",")]
+    selected_stages = set(args.stages.split(",")) if args.stages else None
+    shard_dirs = args.shards.split(",") if args.shards else ()
+    results = run_benchmark(args.index, workload, threads, selected_stages, shard_dirs=shard_dirs)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "index": args.index,
+            "num_docs": searcher.num_docs,
+            "workload": args.workload or f"synthetic:{args.queries}:{args.seed}",
+            "results": results,
+        }, f, indent=2)
+    if args.compare:
+        compare(results, args.compare)
@@ -0,0 +1,39 @@
+import numpy as np
+
+OVER_FETCH = 2
+
+
+def search_distinct(searcher, query, k, columns, over_fetch=OVER_FETCH, order_by_field=None):
+    """
+        Search and collapse the hits by series `id`, returning up to k series.
+
+        The catalog can contain several documents per series. The search
+        over-fetches `k * over_fetch` hits and doubles the limit until k
+        distinct ids are found or the query has no more matches. Each id keeps
+        its best-scoring hit, in search order.
+
+        Args:
+            searcher (tantivy.Searcher): The Tantivy searcher object.
+            query (tantivy.Query): The query to run.
+            k (int): Number of distinct series to return.
+            columns (ColumnStore): Columns of `searcher`, providing id codes.
+            over_fetch (int): Initial number of hits fetched per wanted series.
+            order_by_field (str, optional): Fast field to order the hits by
+                instead of the score; the hits then carry the raw field value.
+
+        Returns:
+            list: Search results [(score, doc_address), ...] with unique ids.
+        """
+    if k <= 0:
+        return []
+    limit = k * over_fetch
+    while True:
+        result = searcher.search(query, limit, order_by_field=order_by_field)
+        hits = result.hits
+        if not hits:
+            return []
+        codes = columns.id_codes[columns.rows([address for _, address in hits])]
+        first = np.sort(np.unique(codes, return_index=True)[1])
+        if len(first) >= k or len(hits) >= result.count:
+            return [hits[i] for i in first[:k].tolist()]
+        limit *= 2
@@ -0,0 +1,392 @@
+import threading
+
+import numpy as np
+import tantivy
+
+import search_service
+
+FAST_FIELDS = (
+    "follower",
+    "score",
+    "start",
+    "males",
+    "females",
+    "other",
+    "non_males",
+    "tmdb_popularity",
+    "tmdb_vote_average",
+    "tmdb_vote_count",
+)
+
+# Stored fields read on request paths, (field_name, multi) as in ColumnStore.stored
+REQUEST_STORED = (("id", False), ("title", False), ("tmdb_poster_path", False), ("genres", True))
+
+_HIGHEST_BIT = np.uint64(1 << 63)
+
+
+def decode(raw, field_type):
+    """
+        Decode tantivy's order-preserving u64 fast-field encoding.
+
+        Tantivy maps i64 and f64 values onto u64 so that they sort as unsigned
+        integers. Ordering a search by a fast field returns those u64 values
+        as the hit score, which lets us read whole columns without touching
+        the docstore. A raw value of 0 means the document has no value.
+
+        Args:
+            raw (np.ndarray): uint64 values as returned by the search.
+            field_type (str): Schema type of the field ('i64', 'u64', 'f64').
+
+        Returns:
+            np.ndarray: float64 values, NaN where the document has no value.
+        """
+    if field_type == "i64":
+        values = (raw ^ _HIGHEST_BIT).view(np.int64).astype(np.float64)
+    elif field_type == "f64":
+        positive = (raw & _HIGHEST_BIT) != 0
+        values = np.where(positive, raw ^ _HIGHEST_BIT, ~raw).view(np.float64)
+    else:
+        values = raw.astype(np.float64)
+    values[raw == 0] = np.nan
+    return values
+
+
+class ColumnStore:
+    """
+        Fast-field columns of one searcher as NumPy arrays.
+
+        Every column is a flat float64 array; a document lives at row
+        `offsets[segment_ord] + doc`. Deleted documents and documents without
+        a value are NaN; `alive` marks the rows of live documents.
+        """
+
+    def __init__(self, searcher, types, fields=FAST_FIELDS):
+        self.searcher = searcher
+        self.columns = {}
+        self.offsets = None
+        self.num_rows = 0
+        self.alive = None
+        self._stored = {}
+        self._id_codes = None
+        self._rows_by_id = None
+        self._lock = threading.Lock()
+        limit = max(searcher.num_docs, 1)
+        for field_name in fields:
+            hits = searcher.search(tantivy.Query.all_query(), limit, count=False,
+                                   order_by_field=field_name).hits
+            if self.offsets is None:
+                self._init_offsets(hits)
+                self.alive = np.zeros(self.num_rows, dtype=bool)
+                self.alive[self.rows([address for _, address in hits])] = True
+            raw = np.fromiter((value for value, _ in hits), dtype=np.uint64, count=len(hits))
+            column = np.full(self.num_rows, np.nan)
+            column[self.rows([address for _, address in hits])] = decode(raw, types[field_name])
+            self.columns[field_name] = column
+
+    def _init_offsets(self, hits):
+        sizes = [0] * self.searcher.num_segments
+        for _, address in hits:
+            sizes[address.segment_ord] = max(sizes[address.segment_ord], address.doc + 1)
+        self.offsets = np.concatenate(([0], np.cumsum(sizes)[:-1])).astype(np.int64)
+        self.num_rows = int(sum(sizes))
+
+    def rows(self, addresses):
+        """
+            Translate document addresses into row numbers of the columns.
+
+            Args:
+                addresses (list): tantivy.DocAddress objects.
+
+            Returns:
+                np.ndarray: int64 row numbers, one per address.
+            """
+        segments = np.fromiter((a.segment_ord for a in addresses), dtype=np.int64, count=len(addresses))
+        docs = np.fromiter((a.doc for a in addresses), dtype=np.int64, count=len(addresses))
+        return self.offsets[segments] + docs
+
+    def addresses(self, rows):
+        """
+            Translate row numbers back into document addresses.
+
+            Args:
+                rows (np.ndarray): Row numbers of the columns.
+
+            Returns:
+                list: tantivy.DocAddress objects, one per row.
+            """
+        rows = np.asarray(rows, dtype=np.int64)
+        segments = np.searchsorted(self.offsets, rows, side="right") - 1
+        docs = rows - self.offsets[segments]
+        return [tantivy.DocAddress(segment, doc) for segment, doc in zip(segments.tolist(), docs.tolist())]
+
+    def contains(self, address):
+        """True if the address is a live document of the searcher."""
+        if not 0 <= address.segment_ord < len(self.offsets):
+            return False
+        start = int(self.offsets[address.segment_ord])
+        end = int(self.offsets[address.segment_ord + 1]) if address.segment_ord + 1 < len(self.offsets) \
+            else self.num_rows
+        return 0 <= address.doc < end - start and bool(self.alive[start + address.doc])
+
+    def stored(self, field_name, multi=False):
+        """
+            Return a stored (non-fast) field of every document as an object array.
+
+            The docstore is read once per searcher on first use; afterwards the
+            values are available without fetching documents.
+
+            Args:
+                field_name (str): Stored field, e.g. 'id' or 'title'.
+                multi (bool): Keep all values as a tuple instead of the first one.
+
+            Returns:
+                np.ndarray: Object array indexed by row, None for deleted rows
+                and documents without a value.
+            """
+        key = (field_name, multi)
+        column = self._stored.get(key)
+        if column is None:
+            self.load_stored([key])
+            column = self._stored[key]
+        return column
+
+    def load_stored(self, keys):
+        """
+            Read several stored fields in one pass over the docstore.
+
+            Every live document is fetched once for all fields that are not
+            loaded yet.
+
+            Args:
+                keys (iterable): (field_name, multi) pairs, see `stored`.
+            """
+        with self._lock:
+            missing = {key: np.full(self.num_rows, None, dtype=object)
+                       for key in keys if key not in self._stored}
+            if not missing:
+                return
+            rows = np.flatnonzero(self.alive)
+            for row, address in zip(rows.tolist(), self.addresses(rows)):
+                doc = self.searcher.doc(address)
+                for (field_name, multi), column in missing.items():
+                    values = doc[field_name]
+                    if multi:
+                        column[row] = tuple(values)
+                    elif values:
+                        column[row] = values[0]
+            self._stored.update(missing)
+
+    @property
+    def id_codes(self):
+        """
+            Integer code of each row's series `id`; equal ids share a code.
+
+            Returns:
+                np.ndarray: int64 codes indexed by row, -1 for deleted rows.
+            """
+        if self._id_codes is None:
+            ids = self.stored("id")
+            rows = np.flatnonzero(self.alive)
+            codes = np.full(self.num_rows, -1, dtype=np.int64)
+            codes[rows] = np.unique(ids[rows].astype(str), return_inverse=True)[1]
+            self._id_codes = codes
+        return self._id_codes
+
+    def rows_of_ids(self, ids):
+        """
+            Row of the first document of each series id.
+
+            Args:
+                ids (iterable): Series ids, e.g. the `id` of a result list.
+
+            Returns:
+                np.ndarray: Row numbers; unknown ids are skipped.
+            """
+        if self._rows_by_id is None:
+            stored_ids = self.stored("id")
+            rows_by_id = {}
+            for row in np.flatnonzero(self.alive).tolist():
+                rows_by_id.setdefault(stored_ids[row], row)
+            self._rows_by_id = rows_by_id
+        rows_by_id = self._rows_by_id
+        return np.array([rows_by_id[i] for i in ids if i in rows_by_id], dtype=np.int64)
+
+    def representative(self, address):
+        """
+            Return the first live document of the series of an address.
+
+            Every document of a series maps to the same representative (the
+            row `rows_of_ids` returns for its id), so work done per series
+            can be keyed by it.
+
+            Args:
+                address (tantivy.DocAddress): Any live document of the series.
+
+            Returns:
+                tantivy.DocAddress: The representative document.
+            """
+        series_id = self.stored("id")[self.rows([address])[0]]
+        rows = self.rows_of_ids([series_id])
+        return self.addresses(rows)[0] if len(rows) else address
+
+    def locate(self, address, series_id):
+        """
+            Find a series again after the searcher was reloaded.
+
+            Merges renumber documents, so an address kept from an older
+            searcher may point to another document or past the end.
+
+            Args:
+                address (tantivy.DocAddress): Address from an older searcher.
+                series_id (str): `id` of the series.
+
+            Returns:
+                tantivy.DocAddress: `address` if it still holds the series,
+                otherwise the first live document of the id; None if the
+                series is gone.
+            """
+        ends = np.append(self.offsets[1:], self.num_rows)
+        if address.segment_ord < len(self.offsets):
+            row = int(self.offsets[address.segment_ord]) + address.doc
+            if row < ends[address.segment_ord] and self.alive[row] and self.stored("id")[row] == series_id:
+                return address
+        rows = self.rows_of_ids([series_id])
+        return self.addresses(rows)[0] if len(rows) else None
+
+    def values(self, field_name, addresses):
+        """
+            Gather the values of one column for the given addresses.
+
+            Args:
+                field_name (str): One of the loaded fast fields.
+                addresses (list): tantivy.DocAddress objects.
+
+            Returns:
+                np.ndarray: float64 values, NaN where missing.
+            """
+        return self.columns[field_name][self.rows(addresses)]
+
+    def rank(self, hits, field_name, exclude_address=None, sim=False, limit=None, distinct=False):
+        """
+            Order search hits by a fast field without fetching stored documents.
+
+            Args:
+                hits (list): List of search results [(score, doc_address), ...].
+                field_name (str): Name of the numeric field to sort by.
+                exclude_address (tantivy.DocAddress): Address to leave out.
+                sim (bool): Keep the search order instead of sorting by the field.
+                limit (int): Only return the first `limit` addresses.
+                distinct (bool): Keep only the best hit of each series id.
+
+            Returns:
+                list: Addresses of hits that have a value, best first.
+            """
+        return self.rank_many(hits, {field_name: (field_name, sim)}, exclude_address, limit,
+                              distinct)[field_name]
+
+    def rank_many(self, hits, orderings, exclude_address=None, limit=None, distinct=False):
+        """
+            Compute several orderings of the same hits in one pass.
+
+            The hit addresses are translated into rows once and every ordering
+            only gathers its column and sorts it.
+
+            Args:
+                hits (list): List of search results [(score, doc_address), ...].
+                orderings (dict): Ordering name -> (field_name, sim).
+                exclude_address (tantivy.DocAddress): Address to leave out.
+                limit (int): Only return the first `limit` addresses per ordering.
+                distinct (bool): Keep only the best hit of each series id and
+                    also drop duplicates of the excluded series.
+
+            Returns:
+                dict: Ordering name -> list of addresses, best first.
+            """
+        addresses = [address for _, address in hits
+                     if exclude_address is None or address != exclude_address]
+        if addresses and distinct:
+            codes = self.id_codes[self.rows(addresses)]
+            keep = np.sort(np.unique(codes, return_index=True)[1])
+            if exclude_address is not None:
+                keep = keep[codes[keep] != self.id_codes[self.rows([exclude_address])[0]]]
+            addresses = [addresses[i] for i in keep]
+        if not addresses:
+            return {name: [] for name in orderings}
+        rows = self.rows(addresses)
+        ranked = {}
+        for name, (field_name, sim) in orderings.items():
+            positions = _order(self.columns[field_name][rows], sim, limit)
+            ranked[name] = [addresses[i] for i in positions]
+        return ranked
+
+
+def _order(values, sim, limit):
+    """
+        Positions of the non-missing values, in search order or by value.
+
+        With a limit, only the values that can still reach the top `limit`
+        are sorted (np.partition instead of a full sort). Ties keep their
+        search order, as with Python's stable sorted().
+        """
+    positions = np.flatnonzero(~np.isnan(values))
+    if sim:
+        return positions[:limit]
+    keys = -values[positions]
+    if limit is not None and limit < len(positions):
+        if limit <= 0:
+            return positions[:0]
+        kth = np.partition(keys, limit - 1)[limit - 1]
+        keep = keys <= kth
+        positions, keys = positions[keep], keys[keep]
+    return positions[np.argsort(keys, kind="stable")][:limit]
+
+
+def get_columns(index_path=search_service.INDEX_PATH):
+    """
+        Return the column store for the shared searcher of an index.
+
+        The columns are loaded once per searcher snapshot and reused by every
+        session; a reload builds the columns of the new searcher before it is
+        published.
+
+        Args:
+            index_path (str): Directory of the tantivy index.
+
+        Returns:
+            ColumnStore: Columns of all fast fields in FAST_FIELDS.
+        """
+    return of(search_service.get_snapshot(index_path))
+
+
+def _build(snapshot):
+    return ColumnStore(snapshot.searcher, search_service.field_types(snapshot.index_path))
+
+
+def warm(snapshot):
+    """
+        Build the columns of a snapshot with everything requests read lazily.
+
+        The stored fields of REQUEST_STORED are read in one docstore pass,
+        followed by the id codes and the rows of every id.
+        """
+    store = of(snapshot)
+    store.load_stored(REQUEST_STORED)
+    store.id_codes
+    store.rows_of_ids(())
+
+
+def of(snapshot):
+    """
+        Return the column store of a searcher snapshot, building it once.
+
+        Args:
+            snapshot (search_service.Snapshot): The snapshot.
+
+        Returns:
+            ColumnStore: Columns of all fast fields in FAST_FIELDS.
+        """
+    return snapshot.derived("columns", _build)
+
+
+# every new searcher gets its columns before it is published
+search_service.add_warmer(warm)
@@ -0,0 +1,138 @@
+import threading
+
+import numpy as np
+from cachetools import LRUCache
+
+import columns
+import filters
+import search_service
+
+GENDER_FIELDS = ("males", "females", "other")
+CATEGORIES = ("male", "female", "non-binary")
+COLORS = ("#31356e", "#2d8bba", "#cb6ce6")
+
+_lock = threading.Lock()
+_used = False
+_specs = LRUCache(maxsize=4096)
+
+
+class Demographics:
+    """
+        Creator gender counts of every document as one (3, rows) NumPy matrix.
+
+        The counts come from the `males`, `females` and `other` fast fields,
+        so aggregating any result set is a single gather-and-sum.
+
+        Args:
+            store (columns.ColumnStore): Columns of the searcher.
+        """
+
+    def __init__(self, store):
+        self.store = store
+        self.counts = np.nan_to_num(np.vstack([store.columns[f] for f in GENDER_FIELDS])).astype(np.int64)
+        self.counts[:, ~store.alive] = 0
+        self.corpus = self.counts.sum(axis=1)
+        self._genres = None
+
+    def aggregate(self, rows):
+        """
+            Sum the creator counts of a result set.
+
+            Args:
+                rows (array-like): Row numbers of the documents.
+
+            Returns:
+                np.ndarray: Totals for (male, female, non-binary).
+            """
+        return self.counts[:, np.asarray(rows, dtype=np.int64)].sum(axis=1)
+
+    def genre_baselines(self):
+        """
+            Creator totals per genre over the whole catalog.
+
+            Computed with one bincount per category on first use and cached.
+
+            Returns:
+                dict: Genre -> totals for (male, female, non-binary).
+            """
+        if self._genres is None:
+            table = filters.genre_table(self.store)
+            totals = np.vstack([np.bincount(table.codes, weights=self.counts[i, table.rows], minlength=len(table.names))
+                                for i in range(len(GENDER_FIELDS))]).astype(np.int64)
+            self._genres = {name: totals[:, code] for code, name in enumerate(table.names)}
+        return self._genres
+
+
+def get_demographics(index_path=search_service.INDEX_PATH):
+    """
+        Return the demographics of the shared searcher, built once per snapshot.
+
+        Args:
+            index_path (str): Directory of the tantivy index.
+
+        Returns:
+            Demographics: Creator counts of the catalog.
+        """
+    global _used
+    _used = True
+    return search_service.get_snapshot(index_path).derived("demographics", _build)
+
+
+def _build(snapshot):
+    return Demographics(columns.of(snapshot))
+
+
+def warm(snapshot):
+    """Prepare the demographics of a new snapshot once they have been used."""
+    if _used:
+        snapshot.derived("demographics", _build)
+
+
+search_service.add_warmer(warm)
+
+
+def pie_spec(totals):
+    """
+        Build the creator pie chart as a Plotly figure spec.
+
+        Args:
+            totals (array-like): Totals for (male, female, non-binary).
+
+        Returns:
+            dict: Figure spec accepted by st.plotly_chart.
+        """
+    return {
+        "data": [{
+            "type": "pie",
+            "labels": list(CATEGORIES),
+            "values": [int(total) for total in totals],
+            "hole": 0.3,
+            "marker": {"colors": list(COLORS)},
+            "textposition": "inside",
+            "textinfo": "percent+label",
+        }],
+        "layout": {"height": 330, "legend": {"tracegroupgap": 0}, "margin": {"t": 60}},
+    }
+
+
+def chart_spec(ids, index_path=search_service.INDEX_PATH):
+    """
+        Return the cached pie chart spec for a result list.
+
+        Args:
+            ids (tuple): Series ids of the result list, in display order.
+            index_path (str): Directory of the tantivy index.
+
+        Returns:
+            dict: Figure spec accepted by st.plotly_chart.
+        """
+    with search_service.lease(index_path) as snapshot:
+        key = (index_path, snapshot.generation, ids)
+        with _lock:
+            spec = _specs.get(key)
+        if spec is None:
+            demographics = get_demographics(index_path)
+            spec = pie_spec(demographics.aggregate(demographics.store.rows_of_ids(ids)))
+            with _lock:
+                _specs[key] = spec
+        return spec
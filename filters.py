@@ -0,0 +1,261 @@
+import math
+import threading
+import weakref
+
+import numpy as np
+from tantivy import Occur, Query
+
+import columns
+import profiling
+import query_cache
+import records
+import search_service
+
+# Fast fields that can be restricted to a [low, high] range
+RANGE_FIELDS = ("start", "follower", "tmdb_vote_count", "tmdb_vote_average", "tmdb_popularity", "non_males")
+
+VOTE_EDGES = (5, 6, 7, 8)
+VOTE_LABELS = ("< 5", "5 - 6", "6 - 7", "7 - 8", "8+")
+
+_lock = threading.Lock()
+# ColumnStore -> GenreTable; entries go away with the searcher's columns
+_genre_tables = weakref.WeakKeyDictionary()
+# set once a genre table was used, so new snapshots get one before they are published
+_used = False
+# set once the catalog facets were used, see catalog_facets
+_catalog_used = False
+
+
+def _bound(value):
+    if value is None:
+        return "*"
+    value = float(value)
+    if not math.isfinite(value):
+        raise ValueError(f"range bound {value!r} is not finite")
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def compile_query(index, text, fields, filters):
+    """
+        Build one tantivy query from search text and filter constraints.
+
+        Every constraint becomes a MUST clause evaluated by the index:
+        ranges over fast fields are range queries, genres are phrase
+        queries on `genres` and term queries on `tmdb_genre_ids`. Several
+        values of one genre field match any of them.
+
+        Args:
+            index (tantivy.Index): The index to parse the query with.
+            text (str): Query text; empty matches all documents.
+            fields (list): Default fields of the text query.
+            filters (dict): Field name -> (low, high) for RANGE_FIELDS, with
+                None for an open bound, or a list of values for `genres` and
+                `tmdb_genre_ids`, e.g. {"start": (1990, 1999), "genres": ["Drama"]}.
+
+        Returns:
+            tantivy.Query: The combined query.
+
+        Raises:
+            ValueError: For unknown filter fields or invalid bounds.
+        """
+    text = text.strip()
+    clauses = [(Occur.Must, index.parse_query(text, list(fields)) if text else Query.all_query())]
+    for field_name, value in (filters or {}).items():
+        if field_name in RANGE_FIELDS:
+            low, high = value
+            if low is None and high is None:
+                continue
+            clauses.append((Occur.Must, index.parse_query(f"{field_name}:[{_bound(low)} TO {_bound(high)}]")))
+        elif field_name == "genres":
+            if value:
+                phrases = [index.parse_query('genres:"{}"'.format(str(genre).replace('"', " ")))
+                           for genre in value]
+                clauses.append((Occur.Must, Query.boolean_query([(Occur.Should, q) for q in phrases])))
+        elif field_name == "tmdb_genre_ids":
+            if value:
+                clauses.append((Occur.Must, Query.term_set_query(index.schema, field_name,
+                                                                 [int(v) for v in value])))
+        else:
+            raise ValueError(f"cannot filter by {field_name!r}")
+    if len(clauses) == 1:
+        return clauses[0][1]
+    return Query.boolean_query(clauses)
+
+
+class GenreTable:
+    """
+        Genres of every row as flat (row, code) pairs for counting with bincount.
+
+        Args:
+            store (columns.ColumnStore): Columns of the searcher.
+        """
+
+    def __init__(self, store):
+        self.store = store
+        genres = store.stored("genres", multi=True)
+        rows, codes, names, index = [], [], [], {}
+        for row in np.flatnonzero(store.alive).tolist():
+            for genre in genres[row] or ():
+                code = index.get(genre)
+                if code is None:
+                    code = index[genre] = len(names)
+                    names.append(genre)
+                rows.append(row)
+                codes.append(code)
+        self.rows = np.array(rows, dtype=np.int64)
+        self.codes = np.array(codes, dtype=np.int64)
+        self.names = names
+
+    def counts(self, mask):
+        """
+            Count the genres of the rows selected by a boolean mask.
+
+            Returns:
+                dict: Genre -> number of rows, most frequent first.
+            """
+        counts = np.bincount(self.codes[mask[self.rows]], minlength=len(self.names))
+        order = np.argsort(-counts, kind="stable")
+        return {self.names[i]: int(counts[i]) for i in order.tolist() if counts[i]}
+
+
+def genre_table(store):
+    """Return the genre table of a column store, built once per store."""
+    global _used
+    _used = True
+    with _lock:
+        table = _genre_tables.get(store)
+        if table is None:
+            table = _genre_tables[store] = GenreTable(store)
+    return table
+
+
+def facet_counts(rows, index_path=search_service.INDEX_PATH, store=None):
+    """
+        Facet counts of a match set from the fast-field columns.
+
+        Args:
+            rows (np.ndarray): Row numbers of the matches, one per series.
+            index_path (str): Directory of the tantivy index.
+            store (columns.ColumnStore, optional): Columns the rows refer to;
+                defaults to the columns of the shared searcher.
+
+        Returns:
+            dict: "genres", "decades" and "votes", each label -> count.
+        """
+    if store is None:
+        store = columns.get_columns(index_path)
+    mask = np.zeros(store.num_rows, dtype=bool)
+    mask[rows] = True
+    start = store.columns["start"][rows]
+    start = start[~np.isnan(start)]
+    decades, counts = np.unique((start // 10 * 10).astype(np.int64), return_counts=True)
+    votes = store.columns["tmdb_vote_average"][rows]
+    votes = np.bincount(np.digitize(votes[~np.isnan(votes)], VOTE_EDGES), minlength=len(VOTE_LABELS))
+    return {
+        "genres": genre_table(store).counts(mask),
+        "decades": {f"{decade}s": int(count) for decade, count in zip(decades.tolist(), counts.tolist())},
+        "votes": {label: int(count) for label, count in zip(VOTE_LABELS, votes.tolist())},
+    }
+
+
+def catalog_facets(index_path=search_service.INDEX_PATH):
+    """
+        Facet counts of the whole catalog, e.g. for the choices of filters.
+
+        The same counts as `filtered_search` without text and filters, but
+        computed once per searcher snapshot instead of on every request.
+
+        Args:
+            index_path (str): Directory of the tantivy index.
+
+        Returns:
+            dict: "genres", "decades" and "votes", see facet_counts.
+        """
+    global _catalog_used
+    _catalog_used = True
+    return search_service.get_snapshot(index_path).derived("catalog_facets", _build_catalog_facets)
+
+
+def _build_catalog_facets(snapshot):
+    store = columns.of(snapshot)
+    rows = np.flatnonzero(store.alive)
+    # like a browse without text: the most popular document of each series
+    rows = rows[np.argsort(-np.nan_to_num(store.columns["tmdb_popularity"][rows], nan=-np.inf), kind="stable")]
+    first = np.sort(np.unique(store.id_codes[rows], return_index=True)[1])
+    return facet_counts(rows[first], snapshot.index_path, store)
+
+
+def warm(snapshot):
+    """Build the genre table and catalog facets of a new snapshot once they have been used."""
+    if _used:
+        genre_table(columns.of(snapshot))
+    if _catalog_used:
+        snapshot.derived("catalog_facets", _build_catalog_facets)
+
+
+search_service.add_warmer(warm)
+
+
+def _key(filters):
+    return tuple(sorted((name, tuple(value)) for name, value in (filters or {}).items() if value is not None))
+
+
+def filtered_search(text, filters, fields=("title", "description"), limit=20, index_path=search_service.INDEX_PATH,
+                    facets=True, cache=query_cache.RESULT_CACHE):
+    """
+        Search with filter constraints and facet counts over all matches.
+
+        All matches are collected in one search and collapsed by series id;
+        the facets are computed from the columns of the match rows, so only
+        the stored documents of the returned page are loaded. Without text,
+        the matches are ordered by tmdb_popularity.
+
+        Args:
+            text (str): Query text; empty browses the filtered catalog.
+            filters (dict): Constraints, see compile_query.
+            fields (tuple): Default fields of the text query.
+            limit (int): Number of series to return.
+            index_path (str): Directory of the tantivy index.
+            facets (bool): Compute facet counts.
+            cache (QueryCache): Result cache, keyed by the normalized text,
+                the filters and the searcher generation.
+
+        Returns:
+            dict: "hits" [(score, doc_address, records.SeriesRecord), ...],
+            "total" number of matching series and "facets" (see
+            facet_counts, None if not requested).
+
+        Raises:
+            query_cache.InvalidQuery: If the text or the filters cannot be
+                compiled into a query.
+        """
+    index = search_service.get_index(index_path)
+    text = query_cache.normalize(text)
+    with search_service.lease(index_path) as snapshot:
+        searcher = snapshot.searcher
+
+        def compute():
+            store = columns.of(snapshot)
+            with profiling.span("parse_query"):
+                try:
+                    query = compile_query(index, text, fields, filters)
+                except (TypeError, ValueError) as e:
+                    raise query_cache.InvalidQuery(str(e)) from e
+            with profiling.span("search"):
+                hits = searcher.search(query, max(searcher.num_docs, 1)).hits
+                rows = store.rows([address for _, address in hits])
+                if not text:
+                    order = np.argsort(-np.nan_to_num(store.columns["tmdb_popularity"][rows], nan=-np.inf),
+                                       kind="stable")
+                    hits = [hits[i] for i in order.tolist()]
+                    rows = rows[order]
+                first = np.sort(np.unique(store.id_codes[rows], return_index=True)[1])
+            with profiling.span("facets"):
+                counts = facet_counts(rows[first], index_path, store) if facets else None
+            with profiling.span("doc"):
+                page = [(score, address, records.load(searcher, address))
+                        for score, address in (hits[i] for i in first[:limit].tolist())]
+            return {"hits": page, "total": len(first), "facets": counts}
+
+        key = ("filtered", text, tuple(fields), limit, facets, _key(filters))
+        return cache.get(key, snapshot.generation, compute)
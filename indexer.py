@@ -0,0 +1,239 @@
+import argparse
+import csv
+import json
+import logging
+import re
+import time
+from pathlib import Path
+
+import tantivy
+
+import records
+import search_service
+
+logger = logging.getLogger("series.indexer")
+
+BATCH_SIZE = 5000
+HEAP_SIZE = 256_000_000
+LIST_SEPARATOR = "|"
+# CSV columns whose cells hold several values
+LIST_FIELDS = tuple(field_name for field_name, multi_valued in records.FIELDS.items() if multi_valued)
+
+_TOKEN = re.compile(r"[^\W_]+")
+
+
+def build_schema():
+    """
+        Build the schema of the series index.
+
+        This is the one place the schema is defined; readers open existing
+        indexes with the schema stored in their meta.json.
+
+        Returns:
+            tantivy.Schema: The series schema.
+        """
+    schema_builder = tantivy.SchemaBuilder()
+    schema_builder.add_text_field("id", stored=True)
+    schema_builder.add_text_field("url", stored=True)
+    schema_builder.add_text_field("title", stored=True, tokenizer_name='en_stem')
+    schema_builder.add_text_field("description", stored=True, tokenizer_name='en_stem')  # Multi-valued text field
+    schema_builder.add_text_field("image", stored=True)
+    schema_builder.add_integer_field("follower", stored=True, fast=True)
+    schema_builder.add_integer_field("score", stored=True, fast=True)
+    schema_builder.add_integer_field("start", stored=True, fast=True)
+    schema_builder.add_text_field("locations", stored=True)
+    schema_builder.add_text_field("countries", stored=True)
+    schema_builder.add_text_field("genres", stored=True)
+    schema_builder.add_integer_field("males", stored=True, fast=True)
+    schema_builder.add_integer_field("females", stored=True, fast=True)
+    schema_builder.add_integer_field("other", stored=True, fast=True)
+    schema_builder.add_float_field("non_males", stored=True, fast=True)
+    schema_builder.add_text_field("tmdb_overview", stored=True, tokenizer_name='en_stem')
+    schema_builder.add_text_field("tmdb_poster_path", stored=True)
+    schema_builder.add_integer_field("tmdb_genre_ids", stored=True, indexed=True)
+    schema_builder.add_float_field("tmdb_popularity", stored=True, fast=True)
+    schema_builder.add_float_field("tmdb_vote_average", stored=True, fast=True)
+    schema_builder.add_integer_field("tmdb_vote_count", stored=True, fast=True)
+    return schema_builder.build()
+
+
+FIELD_TYPES = {
+    "id": "text", "url": "text", "title": "text", "description": "text", "image": "text",
+    "follower": "i64", "score": "i64", "start": "i64", "locations": "text", "countries": "text",
+    "genres": "text", "males": "i64", "females": "i64", "other": "i64", "non_males": "f64",
+    "tmdb_overview": "text", "tmdb_poster_path": "text", "tmdb_genre_ids": "i64",
+    "tmdb_popularity": "f64", "tmdb_vote_average": "f64", "tmdb_vote_count": "i64",
+}
+
+_CONVERTERS = {
+    "text": str,
+    "i64": lambda value: int(float(value)),
+    "f64": float,
+}
+
+
+def read_jsonl(path):
+    """Yield one record per non-empty line of a JSON Lines file."""
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def read_csv(path, list_separator=LIST_SEPARATOR, list_fields=LIST_FIELDS):
+    """
+        Yield one record per CSV row.
+
+        Multi-valued columns (`list_fields`, e.g. genres) hold their values
+        separated by `list_separator`; other cells are kept as they are, so
+        free text may contain the separator.
+        """
+    list_fields = set(list_fields)
+    with open(path, encoding="utf-8", newline="") as f:
+        for row in csv.DictReader(f):
+            yield {key: value.split(list_separator) if key in list_fields and list_separator in value else value
+                   for key, value in row.items() if key is not None and value is not None}
+
+
+def read_records(path, list_separator=LIST_SEPARATOR):
+    if Path(path).suffix.lower() == ".csv":
+        return read_csv(path, list_separator)
+    return read_jsonl(path)
+
+
+def id_term(value):
+    """
+        Return the indexed term of an `id` value.
+
+        `id` uses the default tokenizer, so a document can only be deleted by
+        id if the value is a single token; the term is its lowercase form.
+
+        Raises:
+            ValueError: If the id does not tokenize to exactly one term.
+        """
+    tokens = _TOKEN.findall(str(value).lower())
+    if len(tokens) != 1:
+        raise ValueError(f"id {value!r} is not a single token and cannot be upserted")
+    return tokens[0]
+
+
+def to_document(record, field_types=FIELD_TYPES):
+    """
+        Convert a source record into a tantivy document.
+
+        Unknown keys and empty values are skipped, scalars become
+        single-valued fields.
+
+        Args:
+            record (dict): Field name -> value or list of values.
+            field_types (dict): Field name -> schema type.
+
+        Returns:
+            tantivy.Document: The document to index.
+        """
+    doc = tantivy.Document()
+    for field_name, values in record.items():
+        field_type = field_types.get(field_name)
+        if field_type is None:
+            continue
+        if not isinstance(values, list):
+            values = [values]
+        convert = _CONVERTERS[field_type]
+        for value in values:
+            if value is None or value == "":
+                continue
+            value = convert(value)
+            if field_type == "text":
+                doc.add_text(field_name, value)
+            elif field_type == "i64":
+                doc.add_integer(field_name, value)
+            else:
+                doc.add_float(field_name, value)
+    return doc
+
+
+def index_records(records, index_path=search_service.INDEX_PATH, heap_size=HEAP_SIZE, num_threads=0,
+                  batch_size=BATCH_SIZE, rebuild=False, merge=True, upsert=True):
+    """
+        Stream records into an index, upserting by `id`.
+
+        Every record deletes the documents with the same id before it is
+        added, so re-running the import never creates duplicates. Changes are
+        committed every `batch_size` records; readers see each batch as soon
+        as it is committed. A rebuild is committed once at the end, so
+        readers never see a partly rebuilt catalog; if the stream fails, the
+        rebuild is rolled back.
+
+        Records without an id, with an id that is not a single token (when
+        upserting) or with values that do not convert to the field type are
+        skipped and logged.
+
+        Args:
+            records (iterable): Source records, see `to_document`.
+            index_path (str): Directory of the tantivy index, created if missing.
+            heap_size (int): Memory budget of the index writer in bytes.
+            num_threads (int): Indexing threads; 0 lets tantivy decide.
+            batch_size (int): Records per commit.
+            rebuild (bool): Delete all existing documents first.
+            merge (bool): Wait for segment merges and remove obsolete files
+                at the end.
+            upsert (bool): Delete existing documents with the same id; off
+                when copying an index that holds several documents per id.
+
+        Returns:
+            int: Number of indexed records.
+        """
+    Path(index_path).mkdir(parents=True, exist_ok=True)
+    index = tantivy.Index(build_schema(), path=str(index_path))
+    writer = index.writer(heap_size, num_threads)
+    count = skipped = 0
+    try:
+        if rebuild:
+            writer.delete_all_documents()
+        for record in records:
+            doc_id = record.get("id")
+            if isinstance(doc_id, list):
+                doc_id = doc_id[0] if doc_id else None
+            try:
+                if doc_id is None or doc_id == "":
+                    raise ValueError("record without id")
+                term = id_term(doc_id) if upsert else None
+                doc = to_document(record)
+            except (TypeError, ValueError) as e:
+                skipped += 1
+                logger.warning("skipped record %.200r: %s", record, e)
+                continue
+            if term is not None:
+                writer.delete_documents("id", term)
+            writer.add_document(doc)
+            count += 1
+            if count % batch_size == 0 and not rebuild:
+                writer.commit()
+    except BaseException:
+        writer.rollback()
+        raise
+    writer.commit()
+    if skipped:
+        logger.warning("skipped %s of %s records", skipped, count + skipped)
+    if merge:
+        writer.wait_merging_threads()
+        index.writer(heap_size, 1).garbage_collect_files()
+    return count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or update the series index from JSONL/CSV records.")
+    parser.add_argument("source", help="JSON Lines (.jsonl) or CSV (.csv) file")
+    parser.add_argument("--index", default=search_service.INDEX_PATH, help="tantivy index directory")
+    parser.add_argument("--heap", type=int, default=HEAP_SIZE, help="writer heap size in bytes")
+    parser.add_argument("--threads", type=int, default=0, help="indexing threads (0: automatic)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="records per commit")
+    parser.add_argument("--list-separator", default=LIST_SEPARATOR, help="separator of multi-valued CSV cells")
+    parser.add_argument("--rebuild", action="store_true", help="delete all documents before indexing")
+    parser.add_argument("--no-merge", action="store_true", help="do not wait for segment merges")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    start = time.perf_counter()
+    count = index_records(read_records(args.source, args.list_separator), args.index, args.heap,
+                          args.threads, args.batch_size, args.rebuild, not args.no_merge)
+    print(f"indexed {count} records into {args.index} in {time.perf_counter() - start:.2f}s")
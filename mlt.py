@@ -0,0 +1,171 @@
+import math
+import re
+import threading
+from collections import Counter
+from functools import lru_cache
+
+from tantivy import Occur, Query
+
+# Lucene's default English stop word set
+STOP_WORDS = frozenset((
+    "a", "an", "and", "are", "as", "at", "be", "but", "by", "for", "if", "in", "into", "is", "it",
+    "no", "not", "of", "on", "or", "such", "that", "the", "their", "then", "there", "these",
+    "they", "this", "to", "was", "will", "with",
+))
+
+_TOKEN = re.compile(r"[^\W_]+")
+
+
+@lru_cache(maxsize=None)
+def _stemmer():
+    # importing nltk takes about a second; only live similarity queries need it
+    from nltk.stem.snowball import SnowballStemmer
+
+    return SnowballStemmer("english")
+
+
+@lru_cache(maxsize=65536)
+def _stem(token):
+    return _stemmer().stem(token)
+
+
+def analyze(text, stop_words=STOP_WORDS, min_word_length=0, max_word_length=40):
+    """
+        Tokenize text the way tantivy's `en_stem` analyzer does.
+
+        en_stem splits on non-alphanumeric characters, drops tokens longer
+        than 40 bytes, lowercases and applies the Snowball English stemmer,
+        so the returned terms can be used directly in term queries.
+
+        Args:
+            text (str): Text to analyze.
+            stop_words (set): Lowercased words to drop before stemming.
+            min_word_length (int): Drop shorter tokens.
+            max_word_length (int): Drop tokens longer than this many bytes.
+
+        Returns:
+            list: Stemmed terms in text order.
+        """
+    terms = []
+    for token in _TOKEN.findall(text.lower()):
+        if len(token) < min_word_length or len(token.encode("utf-8")) > max_word_length:
+            continue
+        if token in stop_words:
+            continue
+        terms.append(_stem(token))
+    return terms
+
+
+class MoreLikeThis:
+    """
+        Build a bounded "more like this" query from the text of a document.
+
+        The text is analyzed like the target field, every term is scored by
+        term frequency times BM25 idf using the index's document frequencies,
+        and only the `max_query_terms` most discriminative terms are kept.
+        The query cost therefore depends on `max_query_terms`, not on the
+        length of the text.
+
+        Args:
+            field (str): Text field to match, analyzed with en_stem.
+            max_query_terms (int): Number of terms in the query.
+            min_term_freq (int): Ignore terms occurring less often in the text.
+            min_doc_freq (int): Ignore terms found in fewer documents.
+            max_doc_freq (int): Ignore terms found in more documents.
+            max_doc_ratio (float): Ignore terms found in more than this share
+                of all documents.
+            min_word_length (int): Ignore shorter words.
+            stop_words (set): Words that are never used.
+            boost (bool): Boost each clause by its relative term score.
+        """
+
+    def __init__(self, field="description", max_query_terms=25, min_term_freq=1, min_doc_freq=2,
+                 max_doc_freq=None, max_doc_ratio=0.5, min_word_length=2, stop_words=STOP_WORDS,
+                 boost=True):
+        self.field = field
+        self.max_query_terms = max_query_terms
+        self.min_term_freq = min_term_freq
+        self.min_doc_freq = min_doc_freq
+        self.max_doc_freq = max_doc_freq
+        self.max_doc_ratio = max_doc_ratio
+        self.min_word_length = min_word_length
+        self.stop_words = stop_words
+        self.boost = boost
+        self._lock = threading.Lock()
+        self._doc_freqs = {}
+        self._searcher = None
+
+    def doc_freq(self, searcher, schema, term):
+        """
+            Return the number of documents containing a term, cached per searcher.
+
+            Args:
+                searcher (tantivy.Searcher): The Tantivy searcher object.
+                schema (tantivy.Schema): Schema of the index.
+                term (str): Analyzed term of `self.field`.
+
+            Returns:
+                int: Document frequency of the term.
+            """
+        with self._lock:
+            if self._searcher is not searcher:
+                self._doc_freqs = {}
+                self._searcher = searcher
+            doc_freqs = self._doc_freqs
+        count = doc_freqs.get(term)
+        if count is None:
+            count = searcher.search(Query.term_query(schema, self.field, term), 1).count
+            doc_freqs[term] = count
+        return count
+
+    def terms(self, searcher, schema, text):
+        """
+            Select the most discriminative terms of a text.
+
+            Args:
+                searcher (tantivy.Searcher): The Tantivy searcher object.
+                schema (tantivy.Schema): Schema of the index.
+                text (str): Source text, e.g. overview and description.
+
+            Returns:
+                list: [(term, score), ...] best first, at most `max_query_terms`.
+            """
+        num_docs = searcher.num_docs
+        max_doc_freq = num_docs * self.max_doc_ratio if self.max_doc_ratio is not None else num_docs
+        if self.max_doc_freq is not None:
+            max_doc_freq = min(max_doc_freq, self.max_doc_freq)
+        scored = []
+        for term, term_freq in Counter(analyze(text, self.stop_words, self.min_word_length)).items():
+            if term_freq < self.min_term_freq:
+                continue
+            doc_freq = self.doc_freq(searcher, schema, term)
+            if doc_freq < self.min_doc_freq or doc_freq > max_doc_freq:
+                continue
+            idf = math.log(1 + (num_docs - doc_freq + 0.5) / (doc_freq + 0.5))
+            scored.append((term, term_freq * idf))
+        scored.sort(key=lambda x: x[1], reverse=True)
+        return scored[:self.max_query_terms]
+
+    def query(self, searcher, schema, text):
+        """
+            Build the disjunction of the selected terms.
+
+            Args:
+                searcher (tantivy.Searcher): The Tantivy searcher object.
+                schema (tantivy.Schema): Schema of the index.
+                text (str): Source text, e.g. overview and description.
+
+            Returns:
+                tantivy.Query: Boolean SHOULD query, or None if no term qualifies.
+            """
+        terms = self.terms(searcher, schema, text)
+        if not terms:
+            return None
+        top_score = terms[0][1]
+        clauses = []
+        for term, score in terms:
+            query = Query.term_query(schema, self.field, term)
+            if self.boost:
+                query = Query.boost_query(query, score / top_score)
+            clauses.append((Occur.Should, query))
+        return Query.boolean_query(clauses)
@@ -0,0 +1,214 @@
+import argparse
+import copy
+import json
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import tantivy
+
+import columns
+import records
+import search_service
+
+NEIGHBORS_PATH = "neighbors"
+
+_lock = threading.Lock()
+_tables = {}
+
+
+class NeighborTable:
+    """
+        Memory-mapped neighbor ids and scores of a static catalog.
+
+        A row is the position of a document in the concatenation of the index
+        segments at build time; meta.json records those segments, so the table
+        can be mapped onto the segment ordinals of any later searcher.
+
+        Args:
+            path (str): Directory written by `build`.
+        """
+
+    def __init__(self, path):
+        path = Path(path)
+        with open(path / "meta.json", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.k = meta["k"]
+        self.segment_ids = [segment["segment_id"] for segment in meta["segments"]]
+        sizes = [segment["max_doc"] for segment in meta["segments"]]
+        self.offsets = np.concatenate(([0], np.cumsum(sizes)[:-1])).astype(np.int64)
+        self.neighbors = np.load(path / "neighbors.npy", mmap_mode="r")
+        self.scores = np.load(path / "scores.npy", mmap_mode="r")
+
+    def bind(self, segment_ids, store):
+        """
+            Map table rows onto the segment ordinals of a searcher.
+
+            Args:
+                segment_ids (list): Segment ids of the searcher, in order.
+                store (columns.ColumnStore): Columns of the same searcher, used
+                    to skip neighbors that have been deleted since.
+
+            Returns:
+                NeighborTable: A copy bound to the searcher, sharing the
+                memory-mapped arrays.
+            """
+        bound = copy.copy(self)
+        positions = {segment_id: i for i, segment_id in enumerate(self.segment_ids)}
+        # current segment_ord -> table offset (or -1 if the segment is newer)
+        bound._table_offsets = np.array([self.offsets[positions[s]] if s in positions else -1
+                                        for s in segment_ids], dtype=np.int64)
+        # table segment -> current segment_ord (or -1 if it was merged away)
+        current = {segment_id: i for i, segment_id in enumerate(segment_ids)}
+        bound._segment_ords = np.array([current.get(s, -1) for s in self.segment_ids], dtype=np.int64)
+        bound._store = store
+        return bound
+
+    def lookup(self, address):
+        """
+            Return the precomputed neighbors of a document.
+
+            Args:
+                address (tantivy.DocAddress): Address in the bound searcher.
+
+            Returns:
+                list: [(score, doc_address), ...] like `searcher.search().hits`,
+                or None if the document was indexed after the table was built.
+            """
+        offset = self._table_offsets[address.segment_ord]
+        if offset < 0:
+            return None
+        row = offset + address.doc
+        rows = self.neighbors[row]
+        scores = self.scores[row]
+        valid = rows >= 0
+        rows, scores = rows[valid], scores[valid]
+        table_segments = np.searchsorted(self.offsets, rows, side="right") - 1
+        segment_ords = self._segment_ords[table_segments]
+        docs = rows - self.offsets[table_segments]
+        hits = []
+        for score, segment_ord, doc in zip(scores.tolist(), segment_ords.tolist(), docs.tolist()):
+            if segment_ord < 0:
+                continue
+            if not self._store.alive[self._store.offsets[segment_ord] + doc]:
+                continue
+            hits.append((score, tantivy.DocAddress(segment_ord, doc)))
+        return hits
+
+
+def get_table(path=NEIGHBORS_PATH, index_path=search_service.INDEX_PATH):
+    """
+        Return the neighbor table bound to the shared searcher, if one was built.
+
+        Args:
+            path (str): Directory written by `build`.
+            index_path (str): Directory of the tantivy index.
+
+        Returns:
+            NeighborTable: The loaded table, or None if there is none.
+        """
+    table = _tables.get(path)
+    if table is None:
+        if not (Path(path) / "meta.json").exists():
+            return None
+        with _lock:
+            table = _tables.get(path)
+            if table is None:
+                table = NeighborTable(path)
+                _tables[path] = table
+    return search_service.get_snapshot(index_path).derived(
+        ("neighbors", path), lambda snapshot: table.bind(snapshot.segment_ids, columns.of(snapshot)))
+
+
+_worker = {}
+
+
+def _init_worker(index_path):
+    _worker["index"] = search_service.get_index(index_path)
+    _worker["searcher"] = search_service.get_searcher(index_path)
+
+
+def _neighbors_of(task):
+    import recommend
+
+    k, offsets, chunk = task
+    index = _worker["index"]
+    searcher = _worker["searcher"]
+    result = []
+    for row, segment_ord, doc_id in chunk:
+        doc = records.load(searcher, tantivy.DocAddress(segment_ord, doc_id), records.SIMILARITY_FIELDS)
+        hits = recommend.query_hits(index, searcher, doc, k)
+        result.append((row, [(score, offsets[a.segment_ord] + a.doc) for score, a in hits]))
+    return result
+
+
+def build(index_path=search_service.INDEX_PATH, output=NEIGHBORS_PATH, k=None, workers=None, chunk_size=64):
+    """
+        Run the similarity query for every document and write the table.
+
+        Usage: python neighbors.py --index test --output neighbors --workers 4
+
+        Args:
+            index_path (str): Directory of the tantivy index.
+            output (str): Directory to write neighbors.npy, scores.npy and
+                meta.json to.
+            k (int): Neighbors per document; defaults to recommend.TOP_K_SIM.
+            workers (int): Worker processes; 1 runs in this process.
+            chunk_size (int): Documents per worker task.
+
+        Returns:
+            int: Number of documents processed.
+        """
+    import recommend
+
+    if k is None:
+        k = recommend.TOP_K_SIM
+    workers = workers or os.cpu_count() or 1
+    store = columns.get_columns(index_path)
+    offsets = store.offsets.tolist()
+    segment_ords = (np.searchsorted(store.offsets, np.arange(store.num_rows), side="right") - 1).tolist()
+    rows = np.flatnonzero(store.alive)
+    tasks = [(row, segment_ords[row], row - offsets[segment_ords[row]]) for row in rows.tolist()]
+    tasks = [(k, offsets, tasks[i:i + chunk_size]) for i in range(0, len(tasks), chunk_size)]
+
+    neighbor_rows = np.full((store.num_rows, k), -1, dtype=np.int32)
+    scores = np.zeros((store.num_rows, k), dtype=np.float32)
+    if workers == 1:
+        _init_worker(index_path)
+        results = map(_neighbors_of, tasks)
+    else:
+        pool = ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(index_path,))
+        results = pool.map(_neighbors_of, tasks)
+    for chunk in results:
+        for row, hits in chunk:
+            neighbor_rows[row, :len(hits)] = [neighbor for _, neighbor in hits]
+            scores[row, :len(hits)] = [score for score, _ in hits]
+    if workers != 1:
+        pool.shutdown()
+
+    segment_ids = search_service.get_segment_ids(index_path)
+    sizes = np.diff(np.append(store.offsets, store.num_rows)).tolist()
+    output = Path(output)
+    output.mkdir(parents=True, exist_ok=True)
+    np.save(output / "neighbors.npy", neighbor_rows)
+    np.save(output / "scores.npy", scores)
+    with open(output / "meta.json", "w", encoding="utf-8") as f:
+        json.dump({
+            "k": k,
+            "opstamp": search_service.read_meta(index_path)["opstamp"],
+            "segments": [{"segment_id": s, "max_doc": size} for s, size in zip(segment_ids, sizes)],
+        }, f, indent=2)
+    return len(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precompute the similar-series neighbor table.")
+    parser.add_argument("--index", default=search_service.INDEX_PATH, help="tantivy index directory")
+    parser.add_argument("--output", default=NEIGHBORS_PATH, help="output directory")
+    parser.add_argument("--k", type=int, default=None, help="neighbors per series")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    args = parser.parse_args()
+    count = build(args.index, args.output, args.k, args.workers)
+    print(f"wrote neighbors of {count} documents to {args.output}")
@@ -0,0 +1,299 @@
+import base64
+import hashlib
+import io
+import os
+import tempfile
+import threading
+import urllib.request
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import columns
+import search_service
+
+TMDB_PATH_SMALL = "https://image.tmdb.org/t/p/w200"
+CACHE_PATH = "poster_cache"
+MAX_BYTES = 200 * 1024 * 1024
+THUMBNAIL_SIZE = (200, 300)
+
+# Set SERIES_POSTER_CACHE=0 to hot-link the TMDB images as before
+ENABLED = os.environ.get("SERIES_POSTER_CACHE", "1") != "0"
+
+
+def fetch_url(url, timeout=10):
+    """Download a URL and return the body."""
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        return response.read()
+
+
+class PosterCache:
+    """
+        Disk cache of resized poster thumbnails with size-bounded LRU eviction.
+
+        Args:
+            directory (str): Where the thumbnails are stored.
+            max_bytes (int): Upper bound of the cache size on disk.
+            origin (str): Base URL the poster paths are appended to.
+            fetch (callable): url -> bytes, replaceable for tests.
+            size (tuple): Maximum (width, height) of a thumbnail.
+            workers (int): Threads of the prefetcher.
+        """
+
+    def __init__(self, directory=CACHE_PATH, max_bytes=MAX_BYTES, origin=TMDB_PATH_SMALL, fetch=fetch_url,
+                 size=THUMBNAIL_SIZE, workers=8):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.origin = origin
+        self.fetch = fetch
+        self.size = size
+        self._lock = threading.Lock()
+        self._pending = set()
+        # file name -> lock held while the poster is downloaded
+        self._downloads = {}
+        self._pool = ThreadPoolExecutor(workers, thread_name_prefix="poster")
+        # file name -> size in bytes, least recently used first
+        self._entries = OrderedDict()
+        self._bytes = 0
+        files = sorted(self.directory.glob("*.jpg"), key=lambda path: path.stat().st_mtime)
+        for path in files:
+            self._entries[path.name] = path.stat().st_size
+            self._bytes += self._entries[path.name]
+
+    @staticmethod
+    def _name(poster_path):
+        return hashlib.sha1(poster_path.encode("utf-8")).hexdigest() + ".jpg"
+
+    def url(self, poster_path):
+        return self.origin + poster_path
+
+    def path(self, poster_path):
+        """
+            Return the cached thumbnail file of a poster, or None on a miss.
+
+            A hit marks the entry as recently used.
+            """
+        name = self._name(poster_path)
+        with self._lock:
+            if name not in self._entries:
+                return None
+            self._entries.move_to_end(name)
+        return self.directory / name
+
+    def load(self, poster_path):
+        """
+            Return the thumbnail file of a poster, downloading it on a miss.
+
+            Concurrent loads of the same poster in this process download it
+            once; every download writes its own temporary file, so processes
+            sharing the directory never replace each other's files.
+
+            Args:
+                poster_path (str): TMDB poster path, e.g. '/abc.jpg'.
+
+            Returns:
+                Path: The thumbnail file.
+            """
+        path = self.path(poster_path)
+        if path is not None:
+            return path
+        name = self._name(poster_path)
+        with self._lock:
+            download = self._downloads.setdefault(name, threading.Lock())
+        try:
+            with download:
+                path = self.path(poster_path)
+                if path is not None:
+                    return path
+                return self._download(poster_path, name)
+        finally:
+            with self._lock:
+                if self._downloads.get(name) is download:
+                    del self._downloads[name]
+
+    def _download(self, poster_path, name):
+        data = self._thumbnail(self.fetch(self.url(poster_path)))
+        path = self.directory / name
+        fd, tmp = tempfile.mkstemp(suffix=".tmp", dir=self.directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            Path(tmp).unlink(missing_ok=True)
+            raise
+        with self._lock:
+            self._bytes += len(data) - self._entries.pop(name, 0)
+            self._entries[name] = len(data)
+            evicted = []
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                old_name, old_size = self._entries.popitem(last=False)
+                self._bytes -= old_size
+                evicted.append(old_name)
+        for old_name in evicted:
+            (self.directory / old_name).unlink(missing_ok=True)
+        return path
+
+    def _thumbnail(self, data):
+        from PIL import Image
+
+        image = Image.open(io.BytesIO(data))
+        image.thumbnail(self.size)
+        out = io.BytesIO()
+        image.convert("RGB").save(out, format="JPEG", quality=85, optimize=True)
+        return out.getvalue()
+
+    def data_uri(self, poster_path):
+        """
+            Return a cached poster as a data URI, or None on a miss.
+            """
+        path = self.path(poster_path)
+        if path is None:
+            return None
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            return None
+        return "data:image/jpeg;base64," + base64.b64encode(data).decode("ascii")
+
+    def prefetch(self, poster_paths):
+        """
+            Download missing posters in the background thread pool.
+
+            Args:
+                poster_paths (iterable): TMDB poster paths.
+            """
+        for poster_path in poster_paths:
+            if not poster_path or self.path(poster_path) is not None:
+                continue
+            with self._lock:
+                if poster_path in self._pending:
+                    continue
+                self._pending.add(poster_path)
+            try:
+                self._pool.submit(self._prefetch_one, poster_path)
+            except RuntimeError:
+                # the interpreter is shutting down
+                return
+
+    def _prefetch_one(self, poster_path):
+        try:
+            self.load(poster_path)
+        except Exception:
+            # a missing poster must never break a page; the card keeps the remote URL
+            pass
+        finally:
+            with self._lock:
+                self._pending.discard(poster_path)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes, "pending": len(self._pending)}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Return the process-wide poster cache."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = PosterCache()
+    return _cache
+
+
+def image_url(poster_path, cache=None):
+    """
+        Return the image source for a poster card.
+
+        A cached thumbnail is inlined as a data URI; otherwise the poster is
+        queued for prefetching and the TMDB URL is used for this render.
+
+        Args:
+            poster_path (str): TMDB poster path; empty gives ''.
+            cache (PosterCache, optional): Defaults to the shared cache.
+
+        Returns:
+            str: Data URI, remote URL or ''.
+        """
+    if not poster_path:
+        return ""
+    if not ENABLED:
+        return TMDB_PATH_SMALL + poster_path
+    cache = cache or get_cache()
+    uri = cache.data_uri(poster_path)
+    if uri is not None:
+        return uri
+    cache.prefetch([poster_path])
+    return cache.url(poster_path)
+
+
+def prefetch(poster_paths, cache=None):
+    """Prefetch posters into the shared cache unless the cache is disabled."""
+    if ENABLED:
+        (cache or get_cache()).prefetch(poster_paths)
+
+
+def prefetch_hits(hits, index_path=search_service.INDEX_PATH, cache=None):
+    """
+        Prefetch the posters of search hits without loading their documents.
+
+        The poster paths come from the stored-field column of the shared
+        searcher, so this is cheap enough to run for candidates that may
+        never be shown, e.g. the precomputed neighbors of a series.
+
+        Args:
+            hits (list): Search results [(score, doc_address), ...].
+            index_path (str): Directory of the tantivy index.
+            cache (PosterCache, optional): Defaults to the shared cache.
+        """
+    if not ENABLED or not hits:
+        return
+    store = columns.get_columns(index_path)
+    paths = store.stored("tmdb_poster_path")
+    prefetch([paths[row] for row in store.rows([address for _, address in hits]).tolist()], cache)
+
+
+def serve(port=8502, cache=None):
+    """
+        Serve cached thumbnails over HTTP at /poster/<poster_path>.
+
+        Misses are downloaded from the origin before they are served. Blocks
+        until interrupted.
+
+        Args:
+            port (int): Local port to listen on.
+            cache (PosterCache, optional): Defaults to the shared cache.
+        """
+    cache = cache or get_cache()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if not self.path.startswith("/poster/"):
+                self.send_error(404)
+                return
+            try:
+                data = cache.load(self.path[len("/poster"):]).read_bytes()
+            except Exception:
+                self.send_error(502)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "image/jpeg")
+            self.send_header("Content-Length", str(len(data)))
+            self.send_header("Cache-Control", "public, max-age=86400")
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    ThreadingHTTPServer(("127.0.0.1", port), Handler).serve_forever()
+
+
+if __name__ == "__main__":
+    serve()
@@ -0,0 +1,224 @@
+import contextvars
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import nullcontext
+
+logger = logging.getLogger("series.profile")
+
+# Set SERIES_PROFILE=1 to record every request; otherwise only requests
+# started with force=True (the ?debug=1 panel) are recorded.
+ENABLED = os.environ.get("SERIES_PROFILE") == "1"
+
+BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+_NULL = nullcontext()
+_current = contextvars.ContextVar("profiling_request", default=None)
+_lock = threading.Lock()
+_histograms = {}
+# pages that completed a first run in this process
+_started_pages = set()
+
+
+class Request:
+    """
+        Stage timings of one request (one Streamlit rerun).
+
+        Args:
+            name (str): Name of the page or endpoint.
+        """
+
+    def __init__(self, name):
+        self.name = name
+        self.start = time.perf_counter()
+        self.total = None
+        self.stages = []
+
+    def summary(self):
+        """
+            Aggregate the recorded spans by stage.
+
+            Returns:
+                dict: Stage name -> {"count": int, "ms": float}, in first-seen order.
+            """
+        result = {}
+        for name, seconds in self.stages:
+            stage = result.setdefault(name, {"count": 0, "ms": 0.0})
+            stage["count"] += 1
+            stage["ms"] += seconds * 1000
+        return result
+
+
+class _Span:
+    __slots__ = ("name", "request", "start")
+
+    def __init__(self, name, request):
+        self.name = name
+        self.request = request
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        seconds = time.perf_counter() - self.start
+        if self.request is not None:
+            self.request.stages.append((self.name, seconds))
+        _observe(self.name, seconds)
+        return False
+
+
+def _observe(name, seconds):
+    ms = seconds * 1000
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = {"count": 0, "sum_ms": 0.0, "buckets": [0] * (len(BUCKETS_MS) + 1)}
+        histogram["count"] += 1
+        histogram["sum_ms"] += ms
+        histogram["buckets"][bisect_left(BUCKETS_MS, ms)] += 1
+
+
+def span(name):
+    """
+        Time a block of code as one stage of the current request.
+
+        Returns a shared no-op context manager when profiling is off, so the
+        cost of an unused span is one context-variable lookup.
+
+        Args:
+            name (str): Stage name, e.g. 'search' or 'doc'.
+
+        Returns:
+            A context manager.
+        """
+    request = _current.get()
+    if request is None and not ENABLED:
+        return _NULL
+    return _Span(name, request)
+
+
+def timed(name):
+    """
+        Decorator version of `span`.
+
+        Args:
+            name (str): Stage name.
+        """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def start_request(name, force=False):
+    """
+        Start recording the stages of a request in the current context.
+
+        Args:
+            name (str): Name of the page or endpoint.
+            force (bool): Record even if profiling is disabled globally.
+
+        Returns:
+            Request: The recorder, or None if nothing is recorded.
+        """
+    request = Request(name) if ENABLED or force else None
+    _current.set(request)
+    return request
+
+
+def finish_request(request):
+    """
+        Stop recording and write one structured JSON log line.
+
+        Args:
+            request (Request): The recorder returned by `start_request`.
+
+        Returns:
+            dict: The stage summary, or None if nothing was recorded.
+        """
+    _current.set(None)
+    if request is None:
+        return None
+    request.total = time.perf_counter() - request.start
+    summary = request.summary()
+    logger.info(json.dumps({
+        "request": request.name,
+        "total_ms": round(request.total * 1000, 3),
+        "stages": {name: {"count": s["count"], "ms": round(s["ms"], 3)} for name, s in summary.items()},
+    }))
+    return summary
+
+
+def now():
+    """Return the clock used for all timings, e.g. for the start of a page."""
+    return time.perf_counter()
+
+
+def first_interactive(name, start, session_state):
+    """
+        Record the time until the first run of a page completed for a session.
+
+        The page is interactive once its first run finished. The first
+        session of a process is a cold start that includes the module imports
+        and index setup of the run; later sessions are warm starts. Both are
+        logged and kept in the histograms as '<name> first interactive
+        (cold)' or '(warm)'; the debug panel is not needed.
+
+        Args:
+            name (str): Name of the page.
+            start (float): `now()` at the top of the page script.
+            session_state: st.session_state, remembers the recorded session.
+
+        Returns:
+            float: Seconds until interactive, or None if this session was
+            recorded before.
+        """
+    if session_state.get("_first_interactive"):
+        return None
+    session_state["_first_interactive"] = True
+    seconds = time.perf_counter() - start
+    with _lock:
+        cold = name not in _started_pages
+        _started_pages.add(name)
+    _observe(f"{name} first interactive ({'cold' if cold else 'warm'})", seconds)
+    logger.info(json.dumps({"request": name, "first_interactive_ms": round(seconds * 1000, 3), "cold": cold}))
+    return seconds
+
+
+def histograms():
+    """
+        Return a snapshot of the aggregated stage histograms.
+
+        Returns:
+            dict: Stage name -> count, sum_ms and bucket counts; bucket i counts
+            durations up to BUCKETS_MS[i], the last bucket everything above.
+        """
+    with _lock:
+        return {name: {"count": h["count"], "sum_ms": h["sum_ms"], "buckets": list(h["buckets"])}
+                for name, h in _histograms.items()}
+
+
+def render_panel(request):
+    """
+        Show the stage breakdown of a finished request in a Streamlit expander.
+
+        Args:
+            request (Request): A finished recorder.
+        """
+    import streamlit as st
+
+    if request is None:
+        return
+    with st.expander("Profiling"):
+        total = request.total * 1000 if request.total is not None else 0.0
+        st.caption(f"{request.name}: {total:.1f} ms total")
+        st.table([{"stage": name, "count": s["count"], "ms": round(s["ms"], 2)}
+                  for name, s in request.summary().items()])
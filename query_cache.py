@@ -0,0 +1,162 @@
+import threading
+
+from cachetools import TTLCache
+
+import collapse
+import columns
+import profiling
+import records
+import search_service
+
+_OPERATORS = {"AND", "OR", "NOT", "IN", "TO"}
+
+
+class InvalidQuery(ValueError):
+    """Query text or filters the query parser rejects."""
+
+
+def parse(index, text, fields):
+    """
+        Parse query text like `index.parse_query`.
+
+        Raises:
+            InvalidQuery: If the text or the fields cannot be parsed.
+        """
+    try:
+        return index.parse_query(text, list(fields))
+    except (TypeError, ValueError) as e:
+        raise InvalidQuery(str(e)) from e
+
+
+def normalize(text):
+    """
+        Normalize query text for use in a cache key.
+
+        Whitespace is collapsed and words are lowercased, except the query
+        parser's upper-case operators, which would change the query's meaning.
+
+        Args:
+            text (str): Raw query text.
+
+        Returns:
+            str: The normalized text.
+        """
+    return " ".join(word if word in _OPERATORS else word.lower() for word in text.split())
+
+
+class QueryCache:
+    """
+        Size-bounded LRU cache with a time to live for search results.
+
+        Args:
+            maxsize (int): Maximum number of cached queries.
+            ttl (float): Seconds after which an entry expires.
+        """
+
+    def __init__(self, maxsize=1024, ttl=600):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self._generation = None
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, generation, compute):
+        """
+            Return the cached value for a key or compute and store it.
+
+            All entries are dropped as soon as a key of a newer searcher
+            generation is requested. Requests still running on an older
+            generation after a reload are computed but not cached.
+
+            Args:
+                key (tuple): Hashable cache key without the generation.
+                generation (int): Generation of the searcher the value is for.
+                compute (callable): Called without arguments on a miss.
+
+            Returns:
+                The cached or computed value.
+            """
+        key = key + (generation,)
+        with self._lock:
+            if self._generation is None or generation > self._generation:
+                self._cache.clear()
+                self._generation = generation
+            try:
+                value = self._cache[key]
+                self.hits += 1
+                return value
+            except KeyError:
+                self.misses += 1
+        value = compute()
+        with self._lock:
+            if generation == self._generation:
+                self._cache[key] = value
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self):
+        """
+            Return the hit/miss counters of the cache.
+
+            Returns:
+                dict: hits, misses, hit_rate and the current number of entries.
+            """
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "size": len(self._cache),
+            }
+
+
+RESULT_CACHE = QueryCache()
+
+
+def cached_search(text, fields, limit, index_path=search_service.INDEX_PATH, cache=RESULT_CACHE, distinct=False,
+                  projection=records.RESULT_FIELDS):
+    """
+        Search the shared index through the result cache.
+
+        The key is the normalized query text, the fields, the limit and the
+        searcher generation. The projected records of the hits are cached as
+        well, so a cache hit does not reach tantivy at all.
+
+        Args:
+            text (str): Query text for `index.parse_query`.
+            fields (list): Default fields of the query.
+            limit (int): Maximum number of hits.
+            index_path (str): Directory of the tantivy index.
+            cache (QueryCache): The cache to use.
+            distinct (bool): Collapse the hits by series id and return up to
+                `limit` distinct series (see collapse.search_distinct).
+            projection (tuple): Stored fields of the returned records.
+
+        Returns:
+            list: [(score, doc_address, records.SeriesRecord), ...] in search
+            order.
+
+        Raises:
+            InvalidQuery: If the text cannot be parsed.
+        """
+    index = search_service.get_index(index_path)
+    text = normalize(text)
+    with search_service.lease(index_path) as snapshot:
+        searcher = snapshot.searcher
+
+        def compute():
+            with profiling.span("parse_query"):
+                query = parse(index, text, fields)
+            with profiling.span("search"):
+                if distinct:
+                    hits = collapse.search_distinct(searcher, query, limit, columns.of(snapshot))
+                else:
+                    hits = searcher.search(query, limit).hits
+            with profiling.span("doc"):
+                return [(score, address, records.load(searcher, address, projection)) for score, address in hits]
+
+        return cache.get((text, tuple(fields), limit, distinct, tuple(projection)), snapshot.generation, compute)
@@ -0,0 +1,238 @@
+import os
+import re
+import threading
+
+from cachetools import LRUCache
+from tantivy import Occur, Query
+
+import columns
+import mlt
+import neighbors
+import posters
+import profiling
+import records
+import search_service
+import utils
+import vectors
+
+TOP_K_SIM = 25
+TOP_K_OUTPUT = 5
+GENDER_FACTOR = 0.5
+# "bm25" (MoreLikeThis query / neighbor table), "vectors" or "blend"
+SIMILARITY = os.environ.get("SERIES_SIMILARITY", "bm25")
+BLEND_WEIGHT = 0.5
+
+# Ordering name -> (field_name, sim), see utils.rank
+ORDERINGS = {
+    "similarity": ("tmdb_vote_average", True),
+    "popularity": ("tmdb_popularity", False),
+    "quality": ("tmdb_vote_average", False),
+    "females": ("females", False),
+}
+VIEWS = ("similarity", "popularity", "gender", "quality")
+
+# Entries (hits, orderings, views) of recently shown and precomputed series, see warmup.py
+RECOMMENDATION_CACHE = LRUCache(maxsize=4096)
+_cache_lock = threading.Lock()
+MORE_LIKE_THIS = mlt.MoreLikeThis(field="description", max_query_terms=25)
+
+
+def clean_text(doc):
+    """
+        Build the free-text part of the similarity query for a document.
+
+        Args:
+            doc (records.SeriesRecord): The selected series, at least with
+                SIMILARITY_FIELDS.
+
+        Returns:
+            str: Overview and description without punctuation and [notes].
+        """
+    description = " ".join(text for text in (doc.tmdb_overview, doc.description) if text)
+    clean_description = "\n".join(line for line in description.splitlines() if line.strip()).replace(":", "")
+    query_str = re.sub(r'[^a-zA-Z0-9\s]', '', clean_description)
+    return re.sub(r'\[[^\]]*\]', '', query_str)
+
+
+def similarity_query(index, searcher, doc, more_like_this=MORE_LIKE_THIS):
+    """
+        Build the "similar series" query for a document.
+
+        The most discriminative terms of the cleaned overview and description
+        are matched against the description field, combined with SHOULD
+        clauses for each genre and TMDB genre id of the document.
+
+        Args:
+            index (tantivy.Index): The index to parse the query with.
+            searcher (tantivy.Searcher): Searcher providing term statistics.
+            doc (records.SeriesRecord): The selected series, see clean_text.
+            more_like_this (mlt.MoreLikeThis): Term selection settings.
+
+        Returns:
+            tantivy.Query: The boolean similarity query.
+        """
+    queries = []
+    mlt_query = more_like_this.query(searcher, index.schema, clean_text(doc))
+    if mlt_query is not None:
+        queries.append((Occur.Should, mlt_query))
+    for genre in doc.genres:
+        query = index.parse_query(f'{genre}', ["genres"])
+        queries.append((Occur.Should, query))
+    for genre in doc.tmdb_genre_ids:
+        query = index.parse_query(f'{genre}', ["tmdb_genre_ids"])
+        queries.append((Occur.Should, query))
+    return Query.boolean_query(queries)
+
+
+def query_hits(index, searcher, doc, limit=TOP_K_SIM):
+    """
+        Run the similarity query for a document against the index.
+
+        Args:
+            index (tantivy.Index): The index to parse the query with.
+            searcher (tantivy.Searcher): The Tantivy searcher object.
+            doc (records.SeriesRecord): The selected series, see clean_text.
+            limit (int): Number of hits to return.
+
+        Returns:
+            list: Search results [(score, doc_address), ...].
+        """
+    with profiling.span("similarity_query"):
+        query = similarity_query(index, searcher, doc)
+    with profiling.span("search"):
+        return searcher.search(query, limit=limit).hits
+
+
+def similar_hits(index, searcher, address, doc=None, limit=TOP_K_SIM, index_path=search_service.INDEX_PATH):
+    """
+        Return the similar series of a document, precomputed if possible.
+
+        The neighbor table built by `neighbors.py` answers with a lookup;
+        documents indexed after the table was built fall back to a live query,
+        which is the only case that needs the stored fields of the series.
+        With SERIES_SIMILARITY=vectors the latent-semantic vectors built by
+        `vectors.py` are used instead, with SERIES_SIMILARITY=blend both
+        are combined (see vectors.blend).
+
+        Args:
+            index (tantivy.Index): The index to parse the query with.
+            searcher (tantivy.Searcher): The Tantivy searcher object.
+            address (tantivy.DocAddress): Address of the selected series.
+            doc (records.SeriesRecord, optional): The selected series with
+                SIMILARITY_FIELDS; loaded from the searcher if None.
+            limit (int): Number of hits to return.
+            index_path (str): Directory of the tantivy index.
+
+        Returns:
+            list: Search results [(score, doc_address), ...].
+        """
+    if SIMILARITY != "bm25":
+        vector_index = vectors.get_index(index_path=index_path)
+        if vector_index is not None:
+            with profiling.span("vectors"):
+                vector_hits = vector_index.similar(searcher, address, limit)
+            if SIMILARITY == "vectors":
+                return vector_hits
+            return vectors.blend(vector_hits, _bm25_hits(index, searcher, address, doc, limit, index_path),
+                                 BLEND_WEIGHT)[:limit]
+    return _bm25_hits(index, searcher, address, doc, limit, index_path)
+
+
+def _bm25_hits(index, searcher, address, doc, limit, index_path):
+    with profiling.span("neighbors"):
+        table = neighbors.get_table(index_path=index_path)
+        hits = table.lookup(address) if table is not None and limit <= table.k else None
+    if hits is not None:
+        return hits[:limit]
+    if doc is None:
+        doc = records.load(searcher, address, records.SIMILARITY_FIELDS)
+    return query_hits(index, searcher, doc, limit)
+
+
+def prefetch_posters(addresses, index_path=search_service.INDEX_PATH):
+    """
+        Queue the posters of the precomputed neighbors of search results.
+
+        Only the neighbor table is consulted; series without precomputed
+        neighbors are skipped rather than queried live.
+
+        Args:
+            addresses (list): Addresses of the search results.
+            index_path (str): Directory of the tantivy index.
+        """
+    table = neighbors.get_table(index_path=index_path)
+    if table is None:
+        return
+    for address in addresses:
+        hits = table.lookup(address)
+        if hits:
+            posters.prefetch_hits(hits[:TOP_K_SIM], index_path)
+
+
+def _memoized(key, compute):
+    with _cache_lock:
+        value = RECOMMENDATION_CACHE.get(key)
+    if value is None:
+        value = compute()
+        with _cache_lock:
+            RECOMMENDATION_CACHE[key] = value
+    return value
+
+
+def view(name, address, doc=None, limit=TOP_K_OUTPUT, index_path=search_service.INDEX_PATH):
+    """
+        Return the documents of one recommendation view, computed on demand.
+
+        Candidate hits, every ordering and every view are memoized per
+        selected series and searcher generation, so switching views, revisiting
+        a series or unrelated reruns reuse earlier work. A series with several
+        documents is always computed from its representative document (see
+        columns.ColumnStore.representative), so every document of it shares
+        one cache entry. The whole view is computed on one leased searcher
+        snapshot.
+
+        Args:
+            name (str): One of VIEWS ('similarity', 'popularity', 'gender',
+                'quality').
+            address (tantivy.DocAddress): Address of any document of the
+                selected series.
+            doc (records.SeriesRecord, optional): The document at `address`
+                with SIMILARITY_FIELDS; only needed without precomputed
+                neighbors and loaded on demand if None.
+            limit (int): Number of recommendations.
+            index_path (str): Directory of the tantivy index.
+
+        Returns:
+            list: Recommended records.SeriesRecord, best first.
+        """
+    index = search_service.get_index(index_path)
+    with search_service.lease(index_path) as snapshot:
+        return _view(name, address, doc, limit, index_path, index, snapshot)
+
+
+def _view(name, address, doc, limit, index_path, index, snapshot):
+    searcher = snapshot.searcher
+    representative = columns.of(snapshot).representative(address)
+    if representative != address:
+        address, doc = representative, None
+    base = (index_path, snapshot.generation, address.segment_ord, address.doc)
+
+    def candidates():
+        result = similar_hits(index, searcher, address, doc, TOP_K_SIM, index_path)
+        posters.prefetch_hits(result, index_path)
+        return result
+
+    def hits():
+        return _memoized(base + ("hits",), candidates)
+
+    def ordering(ordering_name):
+        return _memoized(base + (ordering_name, limit), lambda: utils.rank_all(
+            searcher, hits(), address, {ordering_name: ORDERINGS[ordering_name]}, limit, columns.of(snapshot),
+            distinct=True,
+        )[ordering_name])
+
+    if name == "gender":
+        return _memoized(base + (name, limit), lambda: utils.re_rank(
+            ordering("popularity"), ordering("females"), GENDER_FACTOR))
+    return ordering(name)
+
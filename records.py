@@ -0,0 +1,165 @@
+import sys
+
+# Stored field -> True if the field keeps all its values as a tuple
+FIELDS = {
+    "id": False,
+    "url": False,
+    "title": False,
+    "description": False,
+    "image": False,
+    "follower": False,
+    "score": False,
+    "start": False,
+    "locations": True,
+    "countries": True,
+    "genres": True,
+    "males": False,
+    "females": False,
+    "other": False,
+    "non_males": False,
+    "tmdb_overview": False,
+    "tmdb_poster_path": False,
+    "tmdb_genre_ids": True,
+    "tmdb_popularity": False,
+    "tmdb_vote_average": False,
+    "tmdb_vote_count": False,
+}
+
+# Values of these fields repeat across the catalog and are interned
+INTERNED = ("id", "locations", "countries", "genres")
+
+# Projections of the views
+CARD_FIELDS = ("id", "title", "url", "tmdb_poster_path")
+RESULT_FIELDS = CARD_FIELDS + ("tmdb_overview", "description")
+SIMILARITY_FIELDS = ("id", "tmdb_overview", "description", "genres", "tmdb_genre_ids")
+
+OVERVIEW_CHARS = 600
+
+
+class SeriesRecord:
+    """
+        The projected stored fields of one series document.
+
+        Only the fields of the projection are set; reading another field
+        raises AttributeError. Single-valued fields hold their first value or
+        None, multi-valued fields (see FIELDS) a tuple. Records are much
+        smaller than tantivy documents, cheap to read (plain attributes
+        instead of a list per access) and safe to keep in the session state.
+        """
+
+    __slots__ = tuple(FIELDS) + ("_summary",)
+
+    def __init__(self, **values):
+        for name, value in values.items():
+            setattr(self, name, value)
+
+    @classmethod
+    def from_doc(cls, doc, fields=RESULT_FIELDS):
+        """
+            Project a tantivy document.
+
+            Args:
+                doc (tantivy.Document): Document as returned by searcher.doc.
+                fields (tuple): Fields to keep.
+
+            Returns:
+                SeriesRecord: The record.
+            """
+        record = cls()
+        for name in fields:
+            if FIELDS[name]:
+                values = doc.get_all(name)
+                if name in INTERNED:
+                    values = [sys.intern(value) for value in values]
+                setattr(record, name, tuple(values))
+            else:
+                value = doc.get_first(name)
+                if name in INTERNED and value is not None:
+                    value = sys.intern(value)
+                setattr(record, name, value)
+        return record
+
+    @classmethod
+    def from_dict(cls, values, fields=None):
+        """
+            Rebuild a record from `to_dict` output, e.g. a search API response.
+
+            Args:
+                values (dict): Field name -> value or list of values.
+                fields (tuple, optional): Fields to keep; defaults to all given.
+
+            Returns:
+                SeriesRecord: The record.
+            """
+        record = cls()
+        for name in fields if fields is not None else values:
+            value = values.get(name)
+            if FIELDS[name]:
+                value = tuple(sys.intern(v) if name in INTERNED else v for v in value or ())
+            elif name in INTERNED and value is not None:
+                value = sys.intern(value)
+            setattr(record, name, value)
+        return record
+
+    def fields(self):
+        """Names of the projected fields."""
+        return tuple(name for name in FIELDS if hasattr(self, name))
+
+    def project(self, fields):
+        """Return a record with a subset of the fields."""
+        return SeriesRecord(**{name: getattr(self, name) for name in fields})
+
+    def to_dict(self):
+        """Projected fields as JSON-serializable values."""
+        return {name: list(value) if FIELDS[name] else value
+                for name, value in ((name, getattr(self, name)) for name in self.fields())}
+
+    def summary(self, max_chars=OVERVIEW_CHARS):
+        """
+            The overview (or description), cut after a word near max_chars.
+
+            The default-length summary is computed on first use and kept.
+
+            Returns:
+                str: The possibly truncated text, '' if there is none.
+            """
+        if max_chars == OVERVIEW_CHARS:
+            try:
+                return self._summary
+            except AttributeError:
+                pass
+        text = getattr(self, "tmdb_overview", None) or getattr(self, "description", None) or ""
+        if len(text) > max_chars:
+            cut = text.rfind(" ", 0, max_chars)
+            text = text[:cut if cut > 0 else max_chars].rstrip(" ,.;:") + "…"
+        if max_chars == OVERVIEW_CHARS:
+            self._summary = text
+        return text
+
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in self.fields()}
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    def __repr__(self):
+        return f"SeriesRecord(id={getattr(self, 'id', None)!r}, title={getattr(self, 'title', None)!r})"
+
+
+def load(searcher, address, fields=RESULT_FIELDS):
+    """
+        Load the projected record of one document.
+
+        tantivy reads a document from the docstore as a whole; the record
+        keeps only `fields`, so the rest is released right away.
+
+        Args:
+            searcher (tantivy.Searcher): The Tantivy searcher object.
+            address (tantivy.DocAddress): Address of the document.
+            fields (tuple): Fields to keep.
+
+        Returns:
+            SeriesRecord: The record.
+        """
+    return SeriesRecord.from_doc(searcher.doc(address), fields)
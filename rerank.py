@@ -0,0 +1,116 @@
+import numpy as np
+
+
+def _first_occurrences(ids):
+    """Positions of the first occurrence of every id, in input order."""
+    ids = np.asarray(ids)
+    if len(ids) == 0:
+        return np.zeros(0, dtype=np.int64)
+    return np.sort(np.unique(ids, return_index=True)[1])
+
+
+def mix(primary, secondary, factor, seed=None):
+    """
+        Replace slots of a ranking by candidates of a second ranking.
+
+        Slot i of `primary` is offered to the next candidate of `secondary`
+        with probability `factor`. The candidate takes the slot unless it is
+        already part of `primary`. Without a seed, the offered slots are
+        spread evenly (every 1/factor-th slot), so the result is
+        deterministic; with a seed, they are drawn from a seeded generator.
+        When `secondary` runs out, the remaining slots keep their primary
+        candidate.
+
+        Args:
+            primary (array-like): Candidate ids, best first.
+            secondary (array-like): Candidate ids of the second ranking.
+            factor (float): Share of slots offered to `secondary`, 0..1.
+            seed (int, optional): Seed for random slot selection.
+
+        Returns:
+            np.ndarray: The mixed list of ids, same length as `primary`.
+        """
+    primary = np.asarray(primary)
+    secondary = np.asarray(secondary)
+    n = len(primary)
+    if seed is None:
+        steps = np.floor(np.arange(n + 1) * factor + 1e-9)
+        offered = np.diff(steps) > 0
+    else:
+        offered = np.random.default_rng(seed).random(n) < factor
+    draws = np.cumsum(offered) - 1
+    available = offered & (draws < len(secondary))
+    result = primary.copy()
+    if not available.any():
+        return result
+    candidates = secondary[draws[available]]
+    accepted = ~np.isin(candidates, primary)
+    slots = np.flatnonzero(available)[accepted]
+    result[slots] = candidates[accepted]
+    return result
+
+
+def exposure_rerank(ids, relevance, attributes, targets, k=None):
+    """
+        Greedy re-ranking with minimum exposure targets for several attributes.
+
+        Candidates are taken in relevance order, except when the cumulative
+        value of an attribute in the ranking so far falls below
+        `target * position`. Then the most relevant remaining candidate with a
+        positive value of the attribute with the largest deficit is placed
+        next. Every attribute keeps a pre-sorted candidate list and a cursor,
+        and a taken mask replaces membership checks, so the cost is dominated
+        by the sorts: O(n log n) for n candidates.
+
+        Args:
+            ids (array-like): Candidate ids; only the first occurrence of an
+                id is ranked.
+            relevance (array-like): Relevance per candidate, higher is better.
+            attributes (dict): Attribute name -> values per candidate, e.g.
+                the non-male share of the creators (0..1).
+            targets (dict): Attribute name -> minimum average value of the
+                ranked prefix, e.g. {"non_males": 0.4}.
+            k (int, optional): Length of the result; defaults to all candidates.
+
+        Returns:
+            np.ndarray: Candidate positions in ranked order.
+        """
+    candidates = _first_occurrences(ids)
+    relevance = np.asarray(relevance, dtype=np.float64)[candidates]
+    n = len(candidates)
+    k = n if k is None else min(k, n)
+    order = np.argsort(-relevance, kind="stable")
+    names = [name for name in targets if name in attributes]
+    values = {name: np.nan_to_num(np.asarray(attributes[name], dtype=np.float64)[candidates]) for name in names}
+    queues = {name: order[values[name][order] > 0] for name in names}
+    cursors = dict.fromkeys(names, 0)
+    target = np.array([targets[name] for name in names], dtype=np.float64)
+    exposure = np.zeros(len(names))
+    taken = np.zeros(n, dtype=bool)
+    cursor = 0
+    ranked = np.empty(k, dtype=np.int64)
+    for position in range(k):
+        choice = -1
+        if names:
+            deficits = target * (position + 1) - exposure
+            for a in np.argsort(-deficits, kind="stable"):
+                if deficits[a] <= 0:
+                    break
+                name = names[a]
+                queue = queues[name]
+                i = cursors[name]
+                while i < len(queue) and taken[queue[i]]:
+                    i += 1
+                cursors[name] = i
+                if i < len(queue):
+                    choice = queue[i]
+                    break
+        if choice < 0:
+            while taken[order[cursor]]:
+                cursor += 1
+            choice = order[cursor]
+        taken[choice] = True
+        ranked[position] = choice
+        for a, name in enumerate(names):
+            exposure[a] += values[name][choice]
+    return candidates[ranked]
@@ -0,0 +1,432 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+
+import tantivy
+
+import columns
+import demographics
+import filters
+import profiling
+import query_cache
+import recommend
+import records
+import search_service
+import typeahead
+import utils
+import warmup
+
+logger = logging.getLogger("series.api")
+
+HOST = "127.0.0.1"
+PORT = 8600
+MAX_BODY = 1024 * 1024
+WORKERS = min(32, (os.cpu_count() or 1) + 4)
+# Attributes with exposure targets in /rank, see utils.fair_rank
+FAIR_ATTRIBUTES = ("non_males", "females", "other")
+
+
+class BadRequest(ValueError):
+    pass
+
+
+def to_address(value, store=None):
+    """
+        Convert a JSON [segment_ord, doc] pair into a tantivy.DocAddress.
+
+        Args:
+            value (list): The pair from the request.
+            store (columns.ColumnStore, optional): Columns of the leased
+                searcher; the address must be a live document of it.
+
+        Raises:
+            BadRequest: If the pair is malformed or out of range.
+        """
+    try:
+        segment_ord, doc = value
+        address = tantivy.DocAddress(int(segment_ord), int(doc))
+    except (TypeError, ValueError, OverflowError):
+        raise BadRequest(f"invalid address {value!r}")
+    if store is not None and not store.contains(address):
+        raise BadRequest(f"no document at address {value!r}")
+    return address
+
+
+def _int(payload, name, default, minimum=0):
+    value = payload.get(name, default)
+    if value is None:
+        return None
+    try:
+        value = int(value)
+    except (TypeError, ValueError, OverflowError):
+        raise BadRequest(f"'{name}' must be an integer")
+    if value < minimum:
+        raise BadRequest(f"'{name}' must be at least {minimum}")
+    return value
+
+
+def _fields(payload, default):
+    fields = payload.get("fields") or default
+    if not isinstance(fields, (list, tuple)) or not all(isinstance(name, str) for name in fields):
+        raise BadRequest("'fields' must be a list of field names")
+    return list(fields)
+
+
+def from_address(address):
+    return [address.segment_ord, address.doc]
+
+
+def _docs(docs):
+    return [doc.to_dict() for doc in docs]
+
+
+def _search(payload, fields, index_path):
+    text = payload.get("text")
+    if not isinstance(text, str):
+        raise BadRequest("'text' must be a string")
+    limit = _int(payload, "limit", 5, minimum=1)
+    hits = query_cache.cached_search(text, fields, limit, index_path, distinct=bool(payload.get("distinct", False)))
+    return {
+        "generation": search_service.get_generation(index_path),
+        "hits": [{"score": score, "address": from_address(address), "doc": doc.to_dict()}
+                 for score, address, doc in hits],
+    }
+
+
+def search_title(payload, index_path=search_service.INDEX_PATH):
+    """
+        Title search as in the sidebar of app.py.
+
+        Args:
+            payload (dict): text, limit (default 5), distinct (default False).
+            index_path (str): Directory of the tantivy index.
+
+        Returns:
+            dict: generation and hits [{score, address, doc}, ...].
+        """
+    return _search(payload, ["title"], index_path)
+
+
+def search_fields(payload, index_path=search_service.INDEX_PATH):
+    """
+        Multi-field search as in simple.py.
+
+        Punctuation is replaced by spaces before parsing, so free text never
+        fails to parse.
+
+        Args:
+            payload (dict): text, fields (default title and description),
+                limit (default 5), distinct (default False).
+            index_path (str): Directory of the tantivy index.
+
+        Returns:
+            dict: generation and hits [{score, address, doc}, ...].
+        """
+    fields = _fields(payload, ["title", "description"])
+    text = payload.get("text")
+    if not isinstance(text, str):
+        raise BadRequest("'text' must be a string")
+    return _search(dict(payload, text=re.sub(r"[^\w\s]", " ", text).strip()), fields, index_path)
+
+
+def search_filtered(payload, index_path=search_service.INDEX_PATH):
+    """
+        Filtered search with facet counts, see filters.filtered_search.
+
+        Args:
+            payload (dict): text (may be empty), filters, fields (default
+                title and description), limit (default 20), facets.
+            index_path (str): Directory of the tantivy index.
+
+        Returns:
+            dict: generation, hits [{score, address, doc}, ...], total and
+            facets.
+        """
+    text = payload.get("text", "")
+    if not isinstance(text, str):
+        raise BadRequest("'text' must be a string")
+    constraints = payload.get("filters") or {}
+    if not isinstance(constraints, dict) or not all(value is None or isinstance(value, list)
+                                                    for value in constraints.values()):
+        raise BadRequest("'filters' must map field names to lists")
+    if any(isinstance(item, (list, dict)) for value in constraints.values() for item in value or ()):
+        raise BadRequest("filter values must be numbers, strings or null")
+    result = filters.filtered_search(re.sub(r"[^\w\s]", " ", text).strip(), constraints,
+                                     tuple(_fields(payload, ["title", "description"])),
+                                     _int(payload, "limit", 20), index_path, bool(payload.get("facets", True)))
+    return {
+        "generation": search_service.get_generation(index_path),
+        "hits": [{"score": score, "address": from_address(address), "doc": doc.to_dict()}
+                 for score, address, doc in result["hits"]],
+        "total": result["total"],
+        "facets": result["facets"],
+    }
+
+
+def recommendations(payload, index_path=search_service.INDEX_PATH):
+    """
+        One recommendation view of a series as in app.py.
+
+        Args:
+            payload (dict): address, view (one of recommend.VIEWS), limit,
+                id (optional) of the series to find it again if the
+                address is from an older generation.
+            index_path (str): Directory of the tantivy index.
+
+        Returns:
+            dict: generation, address of the series in it, docs, best first,
+            and the creator pie chart spec.
+        """
+    name = payload.get("view", "similarity")
+    if name not in recommend.VIEWS:
+        raise BadRequest(f"unknown view {name!r}")
+    store = columns.get_columns(index_path)
+    series_id = payload.get("id")
+    if series_id is None:
+        address = to_address(payload.get("address"), store)
+    else:
+        if not isinstance(series_id, str):
+            raise BadRequest("'id' must be a string")
+        address = store.locate(to_address(payload.get("address")), series_id)
+        if address is None:
+            raise BadRequest(f"series {series_id!r} is no longer in the index")
+    limit = _int(payload, "limit", recommend.TOP_K_OUTPUT)
+    docs = recommend.view(name, address, None, limit, index_path)
+    return {
+        "generation": search_service.get_generation(index_path),
+        "address": from_address(address),
+        "docs": _docs(docs),
+        "chart": demographics.chart_spec(tuple(doc.id for doc in docs), index_path),
+    }
+
+
+def rank(payload, index_path=search_service.INDEX_PATH):
+    """
+        Rank hits by a fast field, see utils.rank.
+
+        With targets, the ranking keeps minimum creator-exposure shares, see
+        utils.fair_rank; sim and distinct do not apply then.
+
+        Args:
+            payload (dict): hits [[score, address], ...], field, sim, limit,
+                exclude (address, optional), distinct, targets (optional,
+                {attribute: minimum share} with the attributes of
+                FAIR_ATTRIBUTES).
+            index_path (str): Directory of the tantivy index.
+
+        Returns:
+            dict: Ranked docs.
+        """
+    store = columns.get_columns(index_path)
+    searcher = search_service.get_searcher(index_path)
+    hits = []
+    for hit in payload.get("hits") or []:
+        try:
+            score, address = hit
+            score = float(score)
+        except (TypeError, ValueError):
+            raise BadRequest(f"invalid hit {hit!r}, expected [score, address]")
+        hits.append((score, to_address(address, store)))
+    exclude = payload.get("exclude")
+    exclude = to_address(exclude, store) if exclude is not None else None
+    field_name = payload.get("field")
+    if field_name not in columns.FAST_FIELDS:
+        raise BadRequest(f"'field' must be one of {', '.join(columns.FAST_FIELDS)}")
+    limit = _int(payload, "limit", None)
+    targets = payload.get("targets")
+    if targets is not None:
+        if not isinstance(targets, dict) or not set(targets) <= set(FAIR_ATTRIBUTES):
+            raise BadRequest(f"'targets' must map {', '.join(FAIR_ATTRIBUTES)} to shares")
+        try:
+            targets = {name: float(share) for name, share in targets.items()}
+        except (TypeError, ValueError):
+            raise BadRequest("target shares must be numbers")
+        docs = utils.fair_rank(searcher, hits, exclude, field_name, targets, limit, store)
+        return {"docs": _docs(docs)}
+    docs = utils.rank(searcher, hits, exclude, field_name, bool(payload.get("sim", False)), limit, store,
+                      distinct=bool(payload.get("distinct", False)))
+    return {"docs": _docs(docs)}
+
+
+def suggest(payload, index_path=search_service.INDEX_PATH):
+    """
+        Title suggestions for typed text, see typeahead.Typeahead.suggest.
+
+        Args:
+            payload (dict): text, limit (default 5), fuzzy (default True).
+            index_path (str): Directory of the tantivy index.
+
+        Returns:
+            dict: generation and suggestions [{title, address}, ...], best
+            first.
+        """
+    text = payload.get("text")
+    if not isinstance(text, str):
+        raise BadRequest("'text' must be a string")
+    suggestions = typeahead.suggest(text, _int(payload, "limit", 5, minimum=1), bool(payload.get("fuzzy", True)),
+                                    index_path)
+    return {
+        "generation": search_service.get_generation(index_path),
+        "suggestions": [{"title": title, "address": from_address(address)} for title, address in suggestions],
+    }
+
+
+def document(payload, index_path=search_service.INDEX_PATH):
+    """Card fields of one document, e.g. a chosen suggestion."""
+    fields = tuple(_fields(payload, records.CARD_FIELDS))
+    if not set(fields) <= set(records.FIELDS):
+        raise BadRequest(f"unknown fields {fields!r}")
+    address = to_address(payload.get("address"), columns.get_columns(index_path))
+    return {"doc": records.load(search_service.get_searcher(index_path), address, fields).to_dict()}
+
+
+def facets(payload, index_path=search_service.INDEX_PATH):
+    """
+        Facet counts of the whole catalog, see filters.catalog_facets.
+
+        Returns:
+            dict: generation and facets.
+        """
+    return {"generation": search_service.get_generation(index_path), "facets": filters.catalog_facets(index_path)}
+
+
+def health(payload, index_path=search_service.INDEX_PATH):
+    return {
+        "status": "ok",
+        "generation": search_service.get_generation(index_path),
+        "num_docs": search_service.get_searcher(index_path).num_docs,
+        "result_cache": query_cache.RESULT_CACHE.stats(),
+    }
+
+
+ROUTES = {
+    ("GET", "/health"): health,
+    ("POST", "/search/title"): search_title,
+    ("POST", "/search/fields"): search_fields,
+    ("POST", "/search/filtered"): search_filtered,
+    ("GET", "/facets"): facets,
+    ("POST", "/suggest"): suggest,
+    ("POST", "/doc"): document,
+    ("POST", "/recommend"): recommendations,
+    ("POST", "/rank"): rank,
+}
+
+
+class SearchServer:
+    """
+        Minimal HTTP/1.1 JSON server around the shared index.
+
+        Connections are kept alive, and every request body is a JSON object.
+        The handlers block on tantivy and NumPy, so they run in a thread
+        pool while the event loop only parses and writes HTTP.
+
+        Args:
+            index_path (str): Directory of the tantivy index.
+            workers (int): Threads of the handler pool.
+        """
+
+    def __init__(self, index_path=search_service.INDEX_PATH, workers=WORKERS):
+        self.index_path = index_path
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix="api")
+
+    def _call(self, handler, name, payload):
+        # one snapshot per request, so a reload never splits a response
+        request = profiling.start_request("api " + name)
+        try:
+            with search_service.lease(self.index_path):
+                return handler(payload, self.index_path)
+        finally:
+            profiling.finish_request(request)
+
+    async def dispatch(self, method, path, body):
+        """
+            Run the handler of a route.
+
+            Returns:
+                tuple: (HTTPStatus, JSON-serializable response body).
+            """
+        handler = ROUTES.get((method, path))
+        if handler is None:
+            if any(route_path == path for _, route_path in ROUTES):
+                return HTTPStatus.METHOD_NOT_ALLOWED, {"error": f"{method} not allowed"}
+            return HTTPStatus.NOT_FOUND, {"error": f"no route {path}"}
+        try:
+            payload = json.loads(body) if body else {}
+            if not isinstance(payload, dict):
+                raise BadRequest("request body must be a JSON object")
+            loop = asyncio.get_running_loop()
+            return HTTPStatus.OK, await loop.run_in_executor(self.executor, self._call, handler, path, payload)
+        except (BadRequest, query_cache.InvalidQuery, json.JSONDecodeError, UnicodeDecodeError) as e:
+            # only invalid payloads are the client's fault; anything else is a server error
+            return HTTPStatus.BAD_REQUEST, {"error": str(e)}
+        except Exception:
+            logger.exception("%s %s failed", method, path)
+            return HTTPStatus.INTERNAL_SERVER_ERROR, {"error": "internal error"}
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                try:
+                    method, target, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get("content-length", 0))
+                if length > MAX_BODY:
+                    status, response = HTTPStatus.REQUEST_ENTITY_TOO_LARGE, {"error": "request body too large"}
+                    keep_alive = False
+                else:
+                    body = await reader.readexactly(length) if length else b""
+                    status, response = await self.dispatch(method, target.split("?", 1)[0], body)
+                    connection = headers.get("connection", "").lower()
+                    keep_alive = connection != "close" if version == "HTTP/1.1" else connection == "keep-alive"
+                data = json.dumps(response).encode("utf-8")
+                writer.write((
+                    f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+                    f"Content-Type: application/json\r\n"
+                    f"Content-Length: {len(data)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+                ).encode("latin-1") + data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host=HOST, port=PORT):
+        # open the index and build the columns before accepting requests
+        await asyncio.get_running_loop().run_in_executor(self.executor, health, {}, self.index_path)
+        search_service.watch(self.index_path)
+        # precompute the recommendations of popular series (SERIES_PRECOMPUTE=0 turns it off)
+        warmup.start(self.index_path)
+        server = await asyncio.start_server(self.handle, host, port)
+        logger.info("serving %s on %s:%s", self.index_path, host, port)
+        async with server:
+            await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve search and recommendations over HTTP/JSON.")
+    parser.add_argument("--index", default=search_service.INDEX_PATH, help="tantivy index directory")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--workers", type=int, default=WORKERS, help="handler threads")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(SearchServer(args.index, args.workers).serve(args.host, args.port))
@@ -0,0 +1,219 @@
+import http.client
+import json
+import os
+import queue
+import threading
+from urllib.parse import urlsplit
+
+import records
+
+# Set SERIES_API_URL (e.g. http://127.0.0.1:8600) to use search_api.py
+# instead of opening the index in the frontend process.
+API_URL = os.environ.get("SERIES_API_URL", "")
+
+
+class SearchError(RuntimeError):
+    def __init__(self, status, message):
+        super().__init__(f"{status}: {message}")
+        self.status = status
+
+
+class SearchClient:
+    """
+        Client of search_api.py with a pool of keep-alive connections.
+
+        Addresses are returned as (segment_ord, doc) tuples and documents as
+        records.SeriesRecord, so results can be used like the in-process ones
+        and stored in the session state.
+
+        Args:
+            base_url (str): URL of the search service.
+            pool_size (int): Maximum number of idle connections kept open.
+            timeout (float): Socket timeout in seconds.
+        """
+
+    def __init__(self, base_url, pool_size=8, timeout=10):
+        url = urlsplit(base_url)
+        self.host = url.hostname
+        self.port = url.port or 80
+        self.timeout = timeout
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+        # newest searcher generation seen in a response
+        self.generation = None
+        # (generation, facets) of the whole catalog
+        self._catalog = None
+
+    def _connection(self):
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def _release(self, connection):
+        try:
+            self._pool.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+    def request(self, method, path, payload=None):
+        """
+            Send one request and return the decoded JSON response.
+
+            A pooled connection the server has closed in the meantime is
+            replaced and the request is sent once more.
+
+            Raises:
+                SearchError: If the service answers with an error status.
+            """
+        body = json.dumps(payload).encode("utf-8") if payload is not None else None
+        headers = {"Content-Type": "application/json", "Connection": "keep-alive"}
+        for attempt in range(2):
+            connection = self._connection()
+            try:
+                connection.request(method, path, body, headers)
+                response = connection.getresponse()
+                data = response.read()
+            except (http.client.HTTPException, ConnectionError):
+                connection.close()
+                if attempt:
+                    raise
+                continue
+            if response.will_close:
+                connection.close()
+            else:
+                self._release(connection)
+            result = json.loads(data)
+            if response.status != 200:
+                raise SearchError(response.status, result.get("error", ""))
+            generation = result.get("generation")
+            if generation is not None and (self.generation is None or generation > self.generation):
+                self.generation = generation
+            return result
+
+    @staticmethod
+    def _hits(result):
+        return [(hit["score"], tuple(hit["address"]), records.SeriesRecord.from_dict(hit["doc"])) for hit in result["hits"]]
+
+    def search(self, text, fields, limit, distinct=False):
+        """
+            Search like query_cache.cached_search.
+
+            Title-only searches use the title endpoint; any other field list
+            uses the multi-field endpoint, which strips punctuation as
+            simple.py does.
+
+            Returns:
+                list: [(score, (segment_ord, doc), doc), ...] in search order.
+            """
+        payload = {"text": text, "limit": limit, "distinct": distinct}
+        if list(fields) == ["title"]:
+            return self._hits(self.request("POST", "/search/title", payload))
+        return self._hits(self.request("POST", "/search/fields", dict(payload, fields=list(fields))))
+
+    def filtered_search(self, text, filters, fields=("title", "description"), limit=20, facets=True):
+        """
+            Search with filter constraints, see filters.filtered_search.
+
+            Returns:
+                dict: "hits" [(score, (segment_ord, doc), doc), ...], "total"
+                and "facets".
+            """
+        result = self.request("POST", "/search/filtered", {
+            "text": text, "filters": filters, "fields": list(fields), "limit": limit, "facets": facets,
+        })
+        return {"hits": self._hits(result), "total": result["total"], "facets": result["facets"]}
+
+    def catalog_facets(self):
+        """
+            Return the facet counts of the whole catalog, see filters.catalog_facets.
+
+            The counts are fetched again only once a response reported a
+            newer searcher generation.
+            """
+        catalog = self._catalog
+        if catalog is None or catalog[0] != self.generation:
+            result = self.request("GET", "/facets")
+            catalog = self._catalog = (result["generation"], result["facets"])
+        return catalog[1]
+
+    def suggest(self, text, k=5, fuzzy=True):
+        """
+            Title suggestions, see typeahead.suggest.
+
+            Returns:
+                list: [(title, (segment_ord, doc)), ...], best first.
+            """
+        result = self.request("POST", "/suggest", {"text": text, "limit": k, "fuzzy": fuzzy})
+        return [(item["title"], tuple(item["address"])) for item in result["suggestions"]]
+
+    def document(self, address, fields=records.CARD_FIELDS):
+        """Return the projected fields of one document as a SeriesRecord."""
+        payload = {"address": list(address), "fields": list(fields)}
+        return records.SeriesRecord.from_dict(self.request("POST", "/doc", payload)["doc"])
+
+    def recommend(self, name, address, limit, series_id=None):
+        """
+            Return one recommendation view, see recommend.view.
+
+            With `series_id`, an address from an older generation is looked
+            up again by the service.
+
+            Returns:
+                tuple: (docs, chart spec for st.plotly_chart).
+            """
+        payload = {"view": name, "address": list(address), "limit": limit}
+        if series_id is not None:
+            payload["id"] = series_id
+        result = self.request("POST", "/recommend", payload)
+        return [records.SeriesRecord.from_dict(doc) for doc in result["docs"]], result["chart"]
+
+    def rank(self, hits, exclude_address, field_name, sim, limit=None, distinct=False, targets=None):
+        """
+            Rank [(score, address), ...] by a fast field, see utils.rank.
+
+            With `targets` ({attribute: minimum share}), the ranking keeps
+            minimum creator-exposure shares, see utils.fair_rank.
+            """
+        payload = {
+            "hits": [[score, list(address)] for score, address in hits],
+            "exclude": list(exclude_address) if exclude_address is not None else None,
+            "field": field_name, "sim": sim, "limit": limit, "distinct": distinct,
+        }
+        if targets is not None:
+            payload["targets"] = targets
+        docs = self.request("POST", "/rank", payload)["docs"]
+        return [records.SeriesRecord.from_dict(doc) for doc in docs]
+
+    def health(self):
+        return self.request("GET", "/health")
+
+    def close(self):
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+_clients = {}
+_lock = threading.Lock()
+
+
+def get_client(base_url=None):
+    """
+        Return the shared client of the search service.
+
+        Args:
+            base_url (str, optional): Defaults to SERIES_API_URL.
+
+        Returns:
+            SearchClient: The client, or None if no service is configured.
+        """
+    base_url = API_URL if base_url is None else base_url
+    if not base_url:
+        return None
+    client = _clients.get(base_url)
+    if client is None:
+        with _lock:
+            client = _clients.setdefault(base_url, SearchClient(base_url))
+    return client
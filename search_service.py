@@ -0,0 +1,426 @@
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import tantivy
+
+INDEX_PATH = "test"
+DRAIN_TIMEOUT = 60
+# Searchers opened before giving up on an index that keeps committing
+OPEN_ATTEMPTS = 5
+# Seconds between two checks for new commits; 0 disables hot reloading
+RELOAD_INTERVAL = float(os.environ.get("SERIES_RELOAD_INTERVAL", "2"))
+
+logger = logging.getLogger("series.reload")
+
+_lock = threading.Lock()
+_indexes = {}
+_snapshots = {}
+_generation_counter = 0
+_warmers = []
+_reload_callbacks = []
+_watchers = {}
+# index key -> Snapshot pinned by `lease` for the current request
+_pinned = contextvars.ContextVar("pinned_snapshots", default=None)
+
+
+def _key(index_path):
+    return str(Path(index_path).resolve())
+
+
+def signature(meta):
+    """
+        Identify the committed state of an index from its meta.json.
+
+        Every commit changes the opstamp; merges and deletes change the
+        segment list.
+
+        Args:
+            meta (dict): Parsed meta.json.
+
+        Returns:
+            tuple: Opstamp and (segment_id, max_doc, deletes) per segment.
+        """
+    return (meta.get("opstamp"), tuple((segment["segment_id"], segment["max_doc"], json.dumps(segment.get("deletes")))
+                                       for segment in meta["segments"]))
+
+
+class Snapshot:
+    """
+        One searcher of an index and everything derived from it.
+
+        Structures built from a searcher (columns, typeahead, neighbor
+        bindings, ...) are kept per snapshot with `derived`, so requests that
+        still run on an older snapshot never mix its document addresses with
+        data of a newer one.
+
+        Args:
+            index_path (str): Directory of the tantivy index.
+            searcher (tantivy.Searcher): The searcher.
+            meta (dict): The meta.json the searcher was opened at.
+            generation (int): Process-wide increasing number of the snapshot.
+        """
+
+    def __init__(self, index_path, searcher, meta, generation):
+        self.index_path = index_path
+        self.searcher = searcher
+        self.segment_ids = [segment["segment_id"] for segment in meta["segments"]]
+        self.signature = signature(meta)
+        self.generation = generation
+        self.leases = 0
+        self._derived = {}
+        # reentrant: a factory may use other derived structures
+        self._build_lock = threading.RLock()
+        self._lock = threading.Lock()
+        self._drained = threading.Condition(self._lock)
+
+    def derived(self, name, factory):
+        """
+            Return a structure built from this snapshot, building it once.
+
+            Args:
+                name (hashable): Name of the structure.
+                factory (callable): Called with the snapshot on first use.
+
+            Returns:
+                The structure.
+            """
+        value = self._derived.get(name)
+        if value is None:
+            with self._build_lock:
+                value = self._derived.get(name)
+                if value is None:
+                    value = self._derived[name] = factory(self)
+        return value
+
+    def acquire(self):
+        with self._lock:
+            self.leases += 1
+
+    def release(self):
+        with self._lock:
+            self.leases -= 1
+            if self.leases == 0:
+                self._drained.notify_all()
+
+    def drain(self, timeout=DRAIN_TIMEOUT):
+        """
+            Wait until no request holds a lease on this snapshot.
+
+            Returns:
+                bool: False if leases were still held after `timeout` seconds.
+            """
+        with self._lock:
+            return self._drained.wait_for(lambda: self.leases == 0, timeout)
+
+
+def get_index(index_path=INDEX_PATH):
+    """
+        Return the process-wide tantivy index for the given directory.
+
+        The index is opened once per process with `tantivy.Index.open`, so the
+        schema comes from the index's own meta.json instead of a hand-written
+        SchemaBuilder. Streamlit re-executes the page scripts on every rerun,
+        but imported modules stay loaded, so every session and rerun shares
+        the same object.
+
+        Args:
+            index_path (str): Directory of the tantivy index.
+
+        Returns:
+            tantivy.Index: The opened index.
+        """
+    key = str(Path(index_path).resolve())
+    index = _indexes.get(key)
+    if index is None:
+        with _lock:
+            index = _indexes.get(key)
+            if index is None:
+                index = tantivy.Index.open(str(index_path))
+                _indexes[key] = index
+    return index
+
+
+def _open_snapshot(index_path, reload=False):
+    """
+        Open a searcher whose meta.json did not change while it was opened.
+
+        Raises:
+            RuntimeError: If every attempt overlapped a commit; the watcher
+                tries again on its next poll.
+        """
+    global _generation_counter
+    index = get_index(index_path)
+    for _ in range(OPEN_ATTEMPTS):
+        meta = read_meta(index_path)
+        if reload:
+            index.reload()
+        searcher = index.searcher()
+        # a commit in between would make segment ids and searcher disagree
+        if signature(read_meta(index_path)) == signature(meta):
+            break
+        reload = True
+    else:
+        raise RuntimeError(f"{index_path} changed during {OPEN_ATTEMPTS} attempts to open a searcher")
+    with _lock:
+        _generation_counter += 1
+        generation = _generation_counter
+    return Snapshot(index_path, searcher, meta, generation)
+
+
+def get_snapshot(index_path=INDEX_PATH):
+    """
+        Return the snapshot requests on this index should use.
+
+        Inside `lease` this is the leased snapshot, otherwise the current one.
+        The first call opens the index.
+
+        Args:
+            index_path (str): Directory of the tantivy index.
+
+        Returns:
+            Snapshot: The searcher with its generation and derived data.
+        """
+    key = _key(index_path)
+    pinned = _pinned.get()
+    if pinned is not None and key in pinned:
+        return pinned[key]
+    snapshot = _snapshots.get(key)
+    if snapshot is None:
+        with _lock:
+            snapshot = _snapshots.get(key)
+        if snapshot is None:
+            snapshot = _open_snapshot(index_path)
+            with _lock:
+                snapshot = _snapshots.setdefault(key, snapshot)
+    return snapshot
+
+
+def get_searcher(index_path=INDEX_PATH):
+    """
+        Return the cached searcher for the given index directory.
+
+        Args:
+            index_path (str): Directory of the tantivy index.
+
+        Returns:
+            tantivy.Searcher: A searcher shared by all sessions and reruns.
+        """
+    return get_snapshot(index_path).searcher
+
+
+def get_generation(index_path=INDEX_PATH):
+    """
+        Return the generation number of the cached searcher.
+
+        The number changes whenever a new searcher is opened, so caches that
+        include it in their keys never serve results of an older searcher.
+
+        Args:
+            index_path (str): Directory of the tantivy index.
+
+        Returns:
+            int: Generation of the current searcher.
+        """
+    return get_snapshot(index_path).generation
+
+
+def get_segment_ids(index_path=INDEX_PATH):
+    """
+        Return the ids of the segments behind the cached searcher.
+
+        The position in the list is the `segment_ord` of a DocAddress, which
+        lets precomputed data refer to documents independently of a searcher.
+
+        Args:
+            index_path (str): Directory of the tantivy index.
+
+        Returns:
+            list: Segment ids in searcher order.
+        """
+    return get_snapshot(index_path).segment_ids
+
+
+@contextmanager
+def lease(index_path=INDEX_PATH):
+    """
+        Pin the current snapshot for the duration of a request.
+
+        All searcher, generation and column lookups inside the block see the
+        same snapshot, even if a reload swaps in a newer one meanwhile; the
+        reload waits for the lease before it retires the old snapshot.
+
+        Args:
+            index_path (str): Directory of the tantivy index.
+
+        Yields:
+            Snapshot: The pinned snapshot.
+        """
+    snapshot = get_snapshot(index_path)
+    snapshot.acquire()
+    pinned = dict(_pinned.get() or {})
+    pinned[_key(index_path)] = snapshot
+    token = _pinned.set(pinned)
+    try:
+        yield snapshot
+    finally:
+        _pinned.reset(token)
+        snapshot.release()
+
+
+def add_warmer(warmer):
+    """
+        Register a function that prepares a new snapshot before it is used.
+
+        Warmers run in the reload thread with the new snapshot, e.g. to build
+        its columns, so the first request after a swap is not slower.
+        """
+    _warmers.append(warmer)
+
+
+def add_reload_callback(callback):
+    """
+        Register a function called with (index_path, snapshot) after a swap.
+        """
+    _reload_callbacks.append(callback)
+
+
+def reload(index_path=INDEX_PATH, drain_timeout=DRAIN_TIMEOUT):
+    """
+        Swap in a new searcher if the index has new commits.
+
+        The new snapshot is opened and warmed up while requests keep using
+        the current one, then published with one assignment. Afterwards the
+        call waits until the requests leased on the old snapshot finished.
+
+        Args:
+            index_path (str): Directory of the tantivy index.
+            drain_timeout (float): Seconds to wait for old leases.
+
+        Returns:
+            bool: True if a new snapshot was published.
+        """
+    key = _key(index_path)
+    current = _snapshots.get(key)
+    if current is None or signature(read_meta(index_path)) == current.signature:
+        return False
+    start = time.perf_counter()
+    snapshot = _open_snapshot(index_path, reload=True)
+    for warmer in _warmers:
+        try:
+            warmer(snapshot)
+        except Exception:
+            logger.exception("warming generation %s failed", snapshot.generation)
+    with _lock:
+        old = _snapshots.get(key)
+        if old is not None and old.generation > snapshot.generation:
+            return False
+        _snapshots[key] = snapshot
+    logger.info("generation %s of %s published after %.0f ms", snapshot.generation, index_path,
+                (time.perf_counter() - start) * 1000)
+    for callback in _reload_callbacks:
+        try:
+            callback(index_path, snapshot)
+        except Exception:
+            logger.exception("reload callback %r failed", callback)
+    if old is not None and not old.drain(drain_timeout):
+        logger.warning("generation %s still has %s leases after %ss", old.generation, old.leases, drain_timeout)
+    return True
+
+
+class Watcher(threading.Thread):
+    """
+        Daemon thread that polls meta.json and reloads on changes.
+
+        Args:
+            index_path (str): Directory of the tantivy index.
+            interval (float): Seconds between two polls.
+        """
+
+    def __init__(self, index_path=INDEX_PATH, interval=RELOAD_INTERVAL):
+        super().__init__(name=f"reload-{index_path}", daemon=True)
+        self.index_path = index_path
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def run(self):
+        meta_path = Path(self.index_path) / "meta.json"
+        last = None
+        while not self._stopped.wait(self.interval):
+            try:
+                stat = meta_path.stat()
+                if (stat.st_mtime_ns, stat.st_size) != last:
+                    reload(self.index_path)
+                    last = (stat.st_mtime_ns, stat.st_size)
+            except Exception:
+                logger.exception("reloading %s failed", self.index_path)
+
+    def stop(self):
+        self._stopped.set()
+
+
+def watch(index_path=INDEX_PATH, interval=RELOAD_INTERVAL):
+    """
+        Start the process-wide reload watcher of an index once.
+
+        Args:
+            index_path (str): Directory of the tantivy index.
+            interval (float): Seconds between two polls of meta.json.
+
+        Returns:
+            Watcher: The running watcher, None if `interval` is not positive.
+        """
+    if interval <= 0:
+        return None
+    key = _key(index_path)
+    with _lock:
+        watcher = _watchers.get(key)
+        if watcher is None:
+            watcher = _watchers[key] = Watcher(index_path, interval)
+            watcher.start()
+    return watcher
+
+
+def get_schema(index_path=INDEX_PATH):
+    """
+        Return the schema stored in the index's meta.json.
+
+        Args:
+            index_path (str): Directory of the tantivy index.
+
+        Returns:
+            tantivy.Schema: The schema of the opened index.
+        """
+    return get_index(index_path).schema
+
+
+def read_meta(index_path=INDEX_PATH):
+    """
+        Read the raw meta.json of an index directory.
+
+        Args:
+            index_path (str): Directory of the tantivy index.
+
+        Returns:
+            dict: The parsed meta.json content.
+        """
+    with open(Path(index_path) / "meta.json", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def field_types(index_path=INDEX_PATH):
+    """
+        Map every schema field to its declared type ('text', 'i64', 'f64', ...).
+
+        Args:
+            index_path (str): Directory of the tantivy index.
+
+        Returns:
+            dict: Field name -> type name, in schema order.
+        """
+    return {field["name"]: field["type"] for field in read_meta(index_path)["schema"]}
@@ -0,0 +1,341 @@
+import argparse
+import heapq
+import json
+import math
+import os
+import re
+import threading
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+from cachetools import TTLCache
+from tantivy import Occur, Query
+
+import collapse
+import columns
+import indexer
+import mlt
+import records
+import search_service
+
+SHARDS_PATH = "shards"
+NUM_SHARDS = 4
+# Seconds the global document frequencies of a term are reused
+STATS_TTL = 60
+
+_TOKEN = re.compile(r"[^\W_]+")
+
+
+def shard_of(series_id, num_shards):
+    """
+        Return the shard of a series.
+
+        The shard is the CRC-32 of the indexed id term modulo the number of
+        shards, so all documents of a series land in the same shard and
+        collapsing by id works per shard.
+
+        Args:
+            series_id (str): `id` of the series.
+            num_shards (int): Number of shards.
+
+        Returns:
+            int: Shard number in [0, num_shards).
+        """
+    return zlib.crc32(indexer.id_term(series_id).encode("utf-8")) % num_shards
+
+
+def shard_paths(base_path=SHARDS_PATH):
+    """
+        Return the index directories of a sharded catalog, in shard order.
+
+        Args:
+            base_path (str): Directory written by `build`.
+
+        Returns:
+            list: One tantivy index directory per shard.
+        """
+    with open(Path(base_path) / "meta.json", encoding="utf-8") as f:
+        num_shards = json.load(f)["num_shards"]
+    return [str(Path(base_path) / f"shard-{shard:02d}") for shard in range(num_shards)]
+
+
+def records_of_index(index_path):
+    """Yield the stored fields of every live document of an index as a record."""
+    searcher = search_service.get_searcher(index_path)
+    for _, address in searcher.search(Query.all_query(), max(searcher.num_docs, 1), count=False).hits:
+        yield searcher.doc(address).to_dict()
+
+
+def _build_shard(task):
+    source, path, shard, num_shards, heap_size, rebuild = task
+    # an existing index is copied as is, including several documents per id
+    from_index = (Path(source) / "meta.json").exists()
+    source_records = records_of_index(source) if from_index else indexer.read_records(source)
+    shard_records = (record for record in source_records
+                     if shard_of(record["id"][0] if isinstance(record["id"], list) else record["id"],
+                                 num_shards) == shard)
+    return indexer.index_records(shard_records, path, heap_size, 1, rebuild=rebuild, upsert=not from_index)
+
+
+def build(source, base_path=SHARDS_PATH, num_shards=NUM_SHARDS, workers=None, heap_size=indexer.HEAP_SIZE,
+          rebuild=False):
+    """
+        Partition a catalog into index shards by id hash.
+
+        Every shard is indexed by its own process, which reads the whole
+        source and keeps its part of the records.
+
+        Usage: python sharding.py build catalog.jsonl --output shards --shards 8
+
+        Args:
+            source (str): JSON Lines or CSV file, or an existing index
+                directory to re-shard.
+            base_path (str): Output directory; shard i is base_path/shard-0i.
+            num_shards (int): Number of shards.
+            workers (int): Indexing processes; defaults to one per shard.
+            heap_size (int): Writer memory budget of each shard in bytes.
+            rebuild (bool): Delete the existing documents of the shards.
+
+        Returns:
+            list: Number of indexed records per shard.
+        """
+    base = Path(base_path)
+    base.mkdir(parents=True, exist_ok=True)
+    with open(base / "meta.json", "w", encoding="utf-8") as f:
+        json.dump({"num_shards": num_shards}, f)
+    tasks = [(str(source), path, shard, num_shards, heap_size, rebuild)
+             for shard, path in enumerate(shard_paths(base_path))]
+    with ProcessPoolExecutor(min(workers or num_shards, num_shards)) as pool:
+        return list(pool.map(_build_shard, tasks))
+
+
+def analyze(text, tokenizer):
+    """
+        Split text into the terms tantivy indexes for a field.
+
+        Args:
+            text (str): Query text.
+            tokenizer (str): 'en_stem' or 'default'.
+
+        Returns:
+            list: Terms in text order.
+        """
+    if tokenizer == "en_stem":
+        return mlt.analyze(text, stop_words=())
+    return [token for token in _TOKEN.findall(text.lower()) if len(token.encode("utf-8")) <= 40]
+
+
+def idf(num_docs, doc_freq):
+    """BM25 inverse document frequency as computed by tantivy."""
+    return math.log(1 + (num_docs - doc_freq + 0.5) / (doc_freq + 0.5))
+
+
+def _doc_freq(snapshot, schema, field_name, term):
+    doc_freqs = snapshot.derived("doc_freqs", lambda snapshot: {})
+    key = (field_name, term)
+    count = doc_freqs.get(key)
+    if count is None:
+        count = doc_freqs[key] = snapshot.searcher.search(Query.term_query(schema, field_name, term), 1).count
+    return count
+
+
+def _shard_stats(task):
+    """Number of documents and document frequency of each (field, term) in one shard."""
+    path, terms = task
+    schema = search_service.get_schema(path)
+    with search_service.lease(path) as snapshot:
+        return snapshot.searcher.num_docs, [_doc_freq(snapshot, schema, field_name, term)
+                                            for field_name, term in terms]
+
+
+def _shard_search(task):
+    """
+        Search one shard with the global idf of every term.
+
+        Each term query is boosted by global idf / shard idf, which turns the
+        shard's BM25 score into the score the term would have in the whole
+        catalog (up to the shard's average field length).
+        """
+    shard, path, terms, global_idfs, limit, order_by, distinct, projection = task
+    schema = search_service.get_schema(path)
+    with search_service.lease(path) as snapshot:
+        searcher = snapshot.searcher
+        if terms:
+            clauses = []
+            for (field_name, term), global_idf in zip(terms, global_idfs):
+                doc_freq = _doc_freq(snapshot, schema, field_name, term)
+                if doc_freq:
+                    query = Query.term_query(schema, field_name, term)
+                    clauses.append((Occur.Should, Query.boost_query(
+                        query, global_idf / idf(searcher.num_docs, doc_freq))))
+            if not clauses:
+                return []
+            query = Query.boolean_query(clauses)
+        else:
+            query = Query.all_query()
+        if distinct:
+            hits = collapse.search_distinct(searcher, query, limit, columns.of(snapshot), order_by_field=order_by)
+        else:
+            hits = searcher.search(query, limit, order_by_field=order_by).hits
+        if order_by is not None and hits:
+            field_type = search_service.field_types(path)[order_by]
+            raw = np.fromiter((value for value, _ in hits), dtype=np.uint64, count=len(hits))
+            hits = list(zip(columns.decode(raw, field_type).tolist(), (address for _, address in hits)))
+        return [(key, shard, (address.segment_ord, address.doc), records.load(searcher, address, projection))
+                for key, address in hits]
+
+
+class ShardedSearcher:
+    """
+        Scatter-gather search over the shards of a catalog.
+
+        A query is analyzed once, sent to every shard in parallel on a
+        process pool, and the per-shard top-K lists are merged by score or
+        by a fast-field sort key. Scores use the document frequencies of the
+        whole catalog: they are gathered from the shards in a first round and
+        cached for `stats_ttl` seconds, so repeated terms need one round.
+
+        Text is matched term by term on every field (the disjunction that
+        index.parse_query builds for free text); query syntax is not
+        supported.
+
+        Args:
+            base_path (str): Directory written by `build`.
+            workers (int): Worker processes; 1 searches the shards one after
+                another in this process.
+            stats_ttl (float): Seconds global term statistics are reused.
+        """
+
+    def __init__(self, base_path=SHARDS_PATH, workers=None, stats_ttl=STATS_TTL):
+        self.paths = shard_paths(base_path)
+        self.tokenizers = {field["name"]: field["options"].get("indexing", {}).get("tokenizer")
+                           for field in search_service.read_meta(self.paths[0])["schema"]
+                           if field["type"] == "text"}
+        self.workers = workers or min(len(self.paths), os.cpu_count() or 1)
+        self._pool = ProcessPoolExecutor(self.workers) if self.workers > 1 else None
+        self._stats = TTLCache(maxsize=65536, ttl=stats_ttl)
+        self._lock = threading.Lock()
+
+    def _map(self, function, tasks):
+        if self._pool is None:
+            return list(map(function, tasks))
+        return list(self._pool.map(function, tasks))
+
+    def terms(self, text, fields):
+        """
+            Analyze query text for the given fields.
+
+            Returns:
+                list: [(field, term), ...] in query order.
+            """
+        terms = []
+        for token in _TOKEN.findall(text):
+            for field_name in fields:
+                terms.extend((field_name, term) for term in analyze(token, self.tokenizers[field_name]))
+        return terms
+
+    def global_idfs(self, terms):
+        """
+            BM25 idf of each term over all shards.
+
+            Returns:
+                list: One idf per (field, term).
+            """
+        with self._lock:
+            cached = {term: self._stats.get(term) for term in set(terms) | {None}}
+        missing = sorted(term for term, value in cached.items() if value is None and term is not None)
+        if missing or cached[None] is None:
+            results = self._map(_shard_stats, [(path, missing) for path in self.paths])
+            cached[None] = sum(num_docs for num_docs, _ in results)
+            for i, term in enumerate(missing):
+                cached[term] = sum(doc_freqs[i] for _, doc_freqs in results)
+            with self._lock:
+                self._stats.update(cached)
+        return [idf(cached[None], cached[term]) for term in terms]
+
+    def search(self, text, fields=("title",), limit=5, order_by=None, distinct=False,
+               projection=records.RESULT_FIELDS):
+        """
+            Search all shards and merge the results.
+
+            Args:
+                text (str): Free-text query; empty matches all documents.
+                fields (tuple): Text fields to match.
+                limit (int): Number of results.
+                order_by (str, optional): Fast field to sort by, highest first,
+                    instead of the BM25 score.
+                distinct (bool): Keep one document per series id.
+                projection (tuple): Fields of the returned records.
+
+            Returns:
+                list: [(score or field value, (shard, segment_ord, doc),
+                records.SeriesRecord), ...] best first.
+            """
+        terms = self.terms(text, fields)
+        global_idfs = self.global_idfs(terms) if terms else []
+        tasks = [(shard, path, terms, global_idfs, limit, order_by, distinct, tuple(projection))
+                 for shard, path in enumerate(self.paths)]
+        merged = heapq.merge(*self._map(_shard_search, tasks), key=lambda hit: hit[0], reverse=True)
+        return [(key, (shard,) + address, record) for key, shard, address, record in
+                (hit for _, hit in zip(range(limit), merged))]
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+
+
+_searchers = {}
+_lock = threading.Lock()
+
+
+def get_searcher(base_path=SHARDS_PATH, workers=None):
+    """
+        Return the process-wide sharded searcher of a shard directory.
+
+        Args:
+            base_path (str): Directory written by `build`.
+            workers (int): Worker processes of a new searcher.
+
+        Returns:
+            ShardedSearcher: The searcher with its worker pool.
+        """
+    key = str(Path(base_path).resolve())
+    with _lock:
+        searcher = _searchers.get(key)
+        if searcher is None:
+            searcher = _searchers[key] = ShardedSearcher(base_path, workers)
+    return searcher
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build and query a sharded series catalog.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build_parser = commands.add_parser("build", help="partition a catalog into shards by id hash")
+    build_parser.add_argument("source", help="JSONL/CSV file or index directory to re-shard")
+    build_parser.add_argument("--output", default=SHARDS_PATH, help="shard directory")
+    build_parser.add_argument("--shards", type=int, default=NUM_SHARDS, help="number of shards")
+    build_parser.add_argument("--workers", type=int, default=None, help="indexing processes")
+    build_parser.add_argument("--heap", type=int, default=indexer.HEAP_SIZE, help="writer heap size per shard")
+    build_parser.add_argument("--rebuild", action="store_true", help="delete existing documents first")
+    search_parser = commands.add_parser("search", help="run one query over all shards")
+    search_parser.add_argument("text")
+    search_parser.add_argument("--shards-path", default=SHARDS_PATH, help="shard directory")
+    search_parser.add_argument("--fields", default="title", help="comma-separated text fields")
+    search_parser.add_argument("--limit", type=int, default=5)
+    search_parser.add_argument("--order-by", default=None, help="fast field to sort by")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.command == "build":
+        counts = build(args.source, args.output, args.shards, args.workers, args.heap, args.rebuild)
+        print(f"indexed {sum(counts)} records into {len(counts)} shards ({counts}) "
+              f"in {time.perf_counter() - start:.2f}s")
+    else:
+        sharded = get_searcher(args.shards_path)
+        for key, address, record in sharded.search(args.text, tuple(args.fields.split(",")), args.limit,
+                                                   args.order_by, distinct=True):
+            print(f"{key:12.4f}  {address}  {record.title}")
+        sharded.close()
@@ -1,9 +1,20 @@
+import profiling
+
+# vor den übrigen Imports, damit der erste Lauf eines Prozesses sie mitmisst
+page_start = profiling.now()
+
 import streamlit as st
-import tantivy
-import toml
 import re
 from pathlib import Path
 
+import filters
+import posters
+import query_cache
+import search_client
+import search_service
+import styles
+import warmup
+
 # --- Konstanten -------------------------------------------------------------
 TMDB_PATH = "https://image.tmdb.org/t/p/original"
 TMDB_PATH_SMALL = "https://image.tmdb.org/t/p/w200"
@@ -13,10 +24,13 @@ TOP_K = 20           # wie viele Ergebnisse angezeigt werden sollen
 # --- Seiteneinstellungen ----------------------------------------------------
 st.set_page_config(page_title="Empfehlungsstudie — Einfache Suche", page_icon="🔎", layout="wide")
 
+# Zeitmessung je Verarbeitungsschritt; mit ?debug=1 wird sie unten angezeigt
+debug = st.query_params.get("debug") == "1"
+profile = profiling.start_request("simple", force=debug)
+
 # Themenfarben (optional; Standardwerte, falls keine Konfiguration vorhanden)
 try:
-    config = toml.load(".streamlit/config.toml")
-    primary_color = config.get("theme", {}).get("primaryColor", "#31356e")
+    primary_color = styles.theme().get("primaryColor", "#31356e")
 except Exception:
     primary_color = "#31356e"
 
@@ -46,87 +60,115 @@ st.markdown(
     unsafe_allow_html=True,
 )
 
-# --- Tantivy-Schema (entspricht dem bestehenden Index) ---------------------
-schema_builder = tantivy.SchemaBuilder()
-schema_builder.add_text_field("id", stored=True)
-schema_builder.add_text_field("url", stored=True)
-schema_builder.add_text_field("title", stored=True, tokenizer_name="en_stem")
-schema_builder.add_text_field("description", stored=True, tokenizer_name="en_stem")
-schema_builder.add_text_field("image", stored=True)
-schema_builder.add_integer_field("follower", stored=True, fast=True)
-schema_builder.add_integer_field("score", stored=True, fast=True)
-schema_builder.add_integer_field("start", stored=True, fast=True)
-schema_builder.add_text_field("locations", stored=True)
-schema_builder.add_text_field("countries", stored=True)
-schema_builder.add_text_field("genres", stored=True)
-schema_builder.add_integer_field("males", stored=True, fast=True)
-schema_builder.add_integer_field("females", stored=True, fast=True)
-schema_builder.add_integer_field("other", stored=True, fast=True)
-schema_builder.add_float_field("non_males", stored=True, fast=True)
-schema_builder.add_text_field("tmdb_overview", stored=True, tokenizer_name="en_stem")
-schema_builder.add_text_field("tmdb_poster_path", stored=True)
-schema_builder.add_integer_field("tmdb_genre_ids", stored=True, indexed=True)
-schema_builder.add_float_field("tmdb_popularity", stored=True, fast=True)
-schema_builder.add_float_field("tmdb_vote_average", stored=True, fast=True)
-schema_builder.add_integer_field("tmdb_vote_count", stored=True, fast=True)
-schema = schema_builder.build()
-
-# Öffne bestehenden Index
-index = tantivy.Index(schema, path=str(INDEX_PATH))
-searcher = index.searcher()
-
 # --- Benutzeroberfläche ----------------------------------------------------
 st.title("Suche nach TV-Serien")
 query_text = st.text_input("Suchbegriff eingeben", placeholder="z. B. Breaking Bad, Detektiv, Weltraumoper…")
 
+# --- Filter ------------------------------------------------------------------
+# Mit SERIES_API_URL wird der gemeinsame Suchdienst (search_api.py) verwendet.
+client = search_client.get_client()
+if client is None:
+    # Neue Commits im Index werden ohne Neustart übernommen.
+    search_service.watch(INDEX_PATH)
+    # Optional (SERIES_WARMUP=1): Indexdateien und Caches im Hintergrund laden;
+    # die Seite zeigt keine Empfehlungen, daher wird nichts vorberechnet
+    warmup.start(INDEX_PATH, top_n=0)
+
+
+def filtered_search(text, constraints, limit):
+    if client is not None:
+        return client.filtered_search(text, constraints, limit=limit)
+    return filters.filtered_search(text, constraints, limit=limit, index_path=INDEX_PATH)
+
+
+# Facetten des gesamten Katalogs liefern die Auswahlmöglichkeiten (einmal pro Index-Generation berechnet)
+if client is not None:
+    catalog = client.catalog_facets()
+else:
+    catalog = filters.catalog_facets(INDEX_PATH)
+decades = sorted(int(decade[:-1]) for decade in catalog["decades"]) or [2000]
+with st.sidebar:
+    st.header("Filter")
+    years = st.slider("Startjahr", decades[0], decades[-1] + 9, (decades[0], decades[-1] + 9))
+    min_votes = st.number_input("Mindestanzahl Bewertungen", min_value=0, value=0, step=50)
+    min_rating = st.slider("Mindestbewertung (TMDB)", 0.0, 10.0, 0.0, 0.5)
+    genres = st.multiselect("Genres", list(catalog["genres"]))
+    min_non_males = st.slider("Mindestanteil nicht-männlicher Beteiligter", 0.0, 1.0, 0.0, 0.05)
+
+# Nur aktive Einschränkungen werden an den Index weitergegeben
+constraints = {}
+if years != (decades[0], decades[-1] + 9):
+    constraints["start"] = years
+if min_votes:
+    constraints["tmdb_vote_count"] = (min_votes, None)
+if min_rating:
+    constraints["tmdb_vote_average"] = (min_rating, None)
+if genres:
+    constraints["genres"] = genres
+if min_non_males:
+    constraints["non_males"] = (min_non_males, None)
+
 if st.button("Suchen", type="primary"):
-    if not query_text.strip():
+    if not query_text.strip() and not constraints:
         st.info("Bitte gib einen Suchbegriff ein.")
     else:
         # Einfache, fehlertolerante Suche über Titel und Beschreibung
         # Verwende einen RAW STRING, damit Regex-Zeichen wie \w oder \s nicht interpretiert werden
         cleaned = re.sub(r"[^\w\s]", " ", query_text).strip()
-        q = index.parse_query(cleaned, ["title", "description"])  # Suche in beiden Feldern
-        hits = searcher.search(q, TOP_K).hits
+        # Suche in beiden Feldern; identische Anfragen kommen aus dem Ergebnis-Cache.
+        # Die Treffer sind bereits nach Serien-ID zusammengefasst (TOP_K verschiedene Serien).
+        facets = None
+        if constraints:
+            # Filter werden im Index ausgewertet; die Facetten zählen alle Treffer
+            result = filtered_search(cleaned, constraints, TOP_K)
+            hits, facets = result["hits"], result["facets"]
+            st.caption(f"{result['total']} Serien gefunden")
+        elif client is not None:
+            hits = client.search(cleaned, ["title", "description"], TOP_K, distinct=True)
+        else:
+            hits = query_cache.cached_search(cleaned, ["title", "description"], TOP_K, INDEX_PATH, distinct=True)
+
+        if facets:
+            with st.sidebar.expander("Facetten", expanded=True):
+                for name, label in (("genres", "Genres"), ("decades", "Jahrzehnte"), ("votes", "Bewertungen")):
+                    counts = ", ".join(f"{key} ({count})" for key, count in facets[name].items() if count)
+                    st.markdown(f"**{label}:** {counts or '–'}")
 
         if not hits:
             st.warning("Keine Ergebnisse gefunden.")
         else:
             st.subheader("Ergebnisse")
 
-            seen_ids = set()
-            for score, addr in hits:
-                doc = searcher.doc(addr)
-                doc_id = doc["id"][0]
-                if doc_id in seen_ids:
-                    continue
-                seen_ids.add(doc_id)
-
-                title = doc["title"][0]
-                url = doc["url"][0]
-                poster = doc["tmdb_poster_path"]
-                poster_url = (TMDB_PATH_SMALL + poster[0]) if poster else ""
+            for score, addr, doc in hits:
+                title = doc.title
+                url = doc.url
+                poster_url = posters.image_url(doc.tmdb_poster_path)
 
-                overview = doc["tmdb_overview"] or doc["description"]
-                overview = overview[0] if overview else ""
+                # Übersicht (oder Beschreibung), bei Bedarf gekürzt
+                overview = doc.summary()
 
                 # HTML ohne Backslash-Escapes erstellen (einfach Anführungszeichen in Attributen verwenden)
                 img_html = f"<img src='{poster_url}' alt='poster'>" if poster_url else ""
-                st.markdown(
-                    f'''
-                    <div class='result-card'>
-                        <div>{img_html}</div>
-                        <div>
-                            <div class='result-title'><a href='{url}' target='_blank'>{title}</a></div>
-                            <div class='muted'>{overview}</div>
+                with profiling.span("cards"):
+                    st.markdown(
+                        f'''
+                        <div class='result-card'>
+                            <div>{img_html}</div>
+                            <div>
+                                <div class='result-title'><a href='{url}' target='_blank'>{title}</a></div>
+                                <div class='muted'>{overview}</div>
+                            </div>
                         </div>
-                    </div>
-                    ''',
-                    unsafe_allow_html=True,
-                )
+                        ''',
+                        unsafe_allow_html=True,
+                    )
 
 # Tipp beim ersten Öffnen der App
 if not st.session_state.get("_shown_tip", False):
     st.caption("Gib oben ein Stichwort oder einen Serientitel ein und klicke auf **Suchen**, um passende Serien anzuzeigen.")
     st.session_state["_shown_tip"] = True
 
+profiling.first_interactive("simple", page_start, st.session_state)
+profiling.finish_request(profile)
+if debug:
+    profiling.render_panel(profile)
@@ -0,0 +1,173 @@
+import functools
+
+import toml
+
+CONFIG_PATH = ".streamlit/config.toml"
+
+
+@functools.lru_cache(maxsize=None)
+def load_config(path=CONFIG_PATH):
+    """
+        Parse the Streamlit config file once per process.
+
+        The pages are re-executed on every rerun; the parsed config is shared
+        by all of them, so the file is read only on first use.
+
+        Args:
+            path (str): Path of config.toml.
+
+        Returns:
+            dict: The parsed config. Do not modify it.
+        """
+    return toml.load(path)
+
+
+def theme(path=CONFIG_PATH):
+    """Return the [theme] table of the config."""
+    return load_config(path)["theme"]
+
+
+@functools.lru_cache(maxsize=None)
+def app_css():
+    """The <style> block of app.py, built once from the theme colors."""
+    primary_color = theme()["primaryColor"]
+    secondary_button = theme()["secondaryButton"]
+    return f"""
+    <style>
+
+    [data-testid="stSidebar"]  {{
+        background-color: rgb(240, 240, 242);
+        width: 25%;
+        float: left
+    }}
+
+     [data-testid="stAppViewBlockContainer"] {{
+        margin: 0 auto;
+    }}
+
+    .item > a {{
+        color: {primary_color};
+        font-weight: bold;
+    }}
+
+    [data-testid="stSidebar"] [data-testid="stExpander"] {{
+        background-color:  white;
+        max-height: 400px !important;  /* Set the maximum height */
+        overflow-y: auto !important;  /* Enable vertical scrolling */
+        box-shadow: 2.5px 2.5px 5px rgba(0, 0, 0, 0.2);
+    }}
+
+    [data-testid="stExpander"] > details {{
+        border-width: 0;
+        border-style: none;
+        border: none !important;
+
+    }}
+
+    [data-testid="stSidebar"] [data-testid="stExpander"] > details > summary  {{
+        height: 120px;
+    }}
+
+     [data-testid="stSidebar"] [data-testid="stExpander"] > details > summary > span > div > p  {{
+        font-size: 1rem;
+        font-weight: bold;
+        color: {primary_color};
+        margin-bottom: 1em;
+        text-align: left;
+    }}
+
+    [data-testid="stSidebar"] [data-testid="stExpander"] > details > summary > span > div > p:hover  {{
+        text-decoration: underline;
+    }}
+
+
+    [data-testid="baseButton-primary"] {{
+        background-color: {secondary_button};
+        color: white ;
+        border: none;
+        margin-bottom: 1px;
+    }}
+
+    [data-testid="baseButton-primary"]:hover {{
+        background-color: {secondary_button};
+    }}
+
+     [data-testid="baseButton-secondary"]  {{
+        background-color: {secondary_button};
+        color: white;
+        margin-top: 0px;
+
+    }}
+
+    [data-testid="baseButton-secondary"]:hover  {{
+        background-color: rgb(240, 240, 242);
+    }}
+
+    [data-testid="baseButton-secondary"]:focus  {{
+        background-color: rgb(240, 240, 242);
+    }}
+
+    [data-testid="baseButton-secondary"]:active  {{
+        background-color: rgb(240, 240, 242);
+    }}
+
+    </style>
+
+    """
+
+
+@functools.lru_cache(maxsize=None)
+def container_css():
+    """The styles of a recommendation container, see utils.print_recommendations."""
+    primary_button = theme()["primaryButton"]
+    return f"""
+                 {{
+
+                    box-shadow: 2.5px 2.5px 5px rgba(0, 0, 0, 0.2);
+                    #border: 1px solid ; 
+                    #background-color: rgb(240, 240, 242);
+                }}
+
+                .rec {{
+                    background-color: white;
+                    height: 250px;
+                    overflow-y: auto !important;  /* Enable vertical scrolling */
+                    background: linear-gradient(to bottom, transparent, white 90%);
+                    z-index: 0;
+
+                }}
+
+                .rec > p {{
+                    margin: 10px;
+                }}
+
+
+
+                .rec > .title > a {{
+                    color: {primary_button} !important;
+                }}
+
+                .rec > div {{
+                    padding-left: 5px;
+                }}
+
+                .rec  > img {{
+                    padding-left: 10px;
+                }}
+
+
+                .rec:after {{
+                    content: '⇩';
+                    position: absolute;
+                    bottom: 5px;
+                    right: 10px;
+                    pointer-events: none; /* Ensure it doesn't interfere with scrolling */
+                }}
+
+                .title {{
+                    font-weight: bold;
+                    color: {primary_button};
+                    text-align: left;
+                }}
+
+                """
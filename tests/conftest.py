@@ -0,0 +1,37 @@
+import sys
+from pathlib import Path
+
+import pytest
+import tantivy
+
+# the modules live at the top level of the repository
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import columns
+import indexer
+import search_service
+
+# Several documents per series; "s3" has no popularity
+RECORDS = [
+    {"id": "s1", "title": "Dark", "tmdb_popularity": 5.0, "start": 2017},
+    {"id": "s2", "title": "Dark Matter", "tmdb_popularity": 9.0, "start": 2015},
+    {"id": "s1", "title": "Dark Season", "tmdb_popularity": 2.0, "start": 2019},
+    {"id": "s3", "title": "Darkwing", "start": -1991},
+    {"id": "s4", "title": "Dark Angel", "tmdb_popularity": -1.5, "start": 2000},
+    {"id": "s2", "title": "Dark Matter Again", "tmdb_popularity": 1.0, "start": 2016},
+]
+
+
+@pytest.fixture(scope="session")
+def series_index_path(tmp_path_factory):
+    """Directory of a small index with RECORDS in one segment."""
+    path = tmp_path_factory.mktemp("index")
+    indexer.index_records(RECORDS, path, heap_size=15_000_000, num_threads=1, upsert=False)
+    return path
+
+
+@pytest.fixture(scope="session")
+def series_index(series_index_path):
+    """The searcher and ColumnStore of the series_index_path index."""
+    searcher = tantivy.Index.open(str(series_index_path)).searcher()
+    return searcher, columns.ColumnStore(searcher, search_service.field_types(series_index_path))
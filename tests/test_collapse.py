@@ -0,0 +1,71 @@
+import pytest
+import tantivy
+
+from collapse import search_distinct
+from conftest import RECORDS
+
+
+class CountingSearcher:
+    """Wraps a searcher and records the limit of every search."""
+
+    def __init__(self, searcher):
+        self.searcher = searcher
+        self.limits = []
+
+    def search(self, query, limit, **kwargs):
+        self.limits.append(limit)
+        return self.searcher.search(query, limit, **kwargs)
+
+
+def _ids(searcher, hits):
+    return [searcher.doc(address).to_dict()["id"][0] for _, address in hits]
+
+
+def _expected(searcher, query, k):
+    # collapse the full result by hand: first hit of each id, in search order
+    seen = []
+    for _, address in searcher.search(query, len(RECORDS)).hits:
+        series_id = searcher.doc(address).to_dict()["id"][0]
+        if series_id not in seen:
+            seen.append(series_id)
+    return seen[:k]
+
+
+@pytest.mark.parametrize("k", [1, 2, 3, 4])
+def test_collapses_documents_of_a_series(series_index, series_index_path, k):
+    searcher, store = series_index
+    query = tantivy.Index.open(str(series_index_path)).parse_query("dark", ["title"])
+    ids = _ids(searcher, search_distinct(searcher, query, k, store))
+    assert ids == _expected(searcher, query, k)
+    assert len(set(ids)) == len(ids)
+
+
+def test_doubles_limit_until_k_distinct(series_index):
+    searcher, store = series_index
+    counting = CountingSearcher(searcher)
+    hits = search_distinct(counting, tantivy.Query.all_query(), 4, store, over_fetch=1)
+    assert len(set(_ids(searcher, hits))) == 4
+    # the first four documents hold only three series
+    assert counting.limits == [4, 8]
+
+
+def test_fewer_matches_than_k(series_index):
+    searcher, store = series_index
+    counting = CountingSearcher(searcher)
+    hits = search_distinct(counting, tantivy.Query.all_query(), 10, store, over_fetch=1)
+    assert sorted(_ids(searcher, hits)) == ["s1", "s2", "s3", "s4"]
+    assert len(counting.limits) == 1
+
+
+def test_no_matches(series_index, series_index_path):
+    searcher, store = series_index
+    query = tantivy.Index.open(str(series_index_path)).parse_query("nothing", ["title"])
+    assert search_distinct(searcher, query, 3, store) == []
+
+
+@pytest.mark.parametrize("k", [0, -1])
+def test_k_not_positive(series_index, k):
+    searcher, store = series_index
+    counting = CountingSearcher(searcher)
+    assert search_distinct(counting, tantivy.Query.all_query(), k, store) == []
+    assert counting.limits == []
@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+import tantivy
+
+from columns import _HIGHEST_BIT, _order, decode
+from conftest import RECORDS
+
+
+def _encode_i64(values):
+    return np.array(values, dtype=np.int64).view(np.uint64) ^ _HIGHEST_BIT
+
+
+def _encode_f64(values):
+    bits = np.array(values, dtype=np.float64).view(np.uint64)
+    return np.where(np.array(values) >= 0, bits ^ _HIGHEST_BIT, ~bits)
+
+
+def test_decode_i64():
+    values = [-5, 0, 1, 2017, np.iinfo(np.int64).max]
+    assert decode(_encode_i64(values), "i64").tolist() == [float(v) for v in values]
+
+
+def test_decode_f64():
+    values = [-2.5, -0.0001, 0.0, 3.25, 1e300]
+    assert decode(_encode_f64(values), "f64").tolist() == values
+
+
+def test_decode_u64_and_missing():
+    decoded = decode(np.array([0, 7, 0], dtype=np.uint64), "u64")
+    assert np.isnan(decoded[0]) and np.isnan(decoded[2])
+    assert decoded[1] == 7.0
+
+
+def test_columns_match_stored_values(series_index):
+    searcher, store = series_index
+    for _, address in searcher.search(tantivy.Query.all_query(), 10).hits:
+        doc = searcher.doc(address).to_dict()
+        row = store.rows([address])[0]
+        for field_name in ("tmdb_popularity", "start"):
+            expected = doc.get(field_name, [np.nan])[0]
+            assert store.columns[field_name][row] == pytest.approx(expected, nan_ok=True)
+
+
+def test_id_codes_group_documents_of_a_series(series_index):
+    _, store = series_index
+    ids = store.stored("id")
+    codes = store.id_codes
+    assert len(set(codes.tolist())) == len({record["id"] for record in RECORDS})
+    for a in range(store.num_rows):
+        for b in range(store.num_rows):
+            assert (codes[a] == codes[b]) == (ids[a] == ids[b])
+
+
+VALUES = np.array([3.0, np.nan, 5.0, 1.0, 5.0, np.nan, 2.0])
+
+
+def test_order_by_value_skips_missing_and_keeps_ties_in_order():
+    assert _order(VALUES, False, None).tolist() == [2, 4, 0, 6, 3]
+
+
+def test_order_sim_keeps_search_order():
+    assert _order(VALUES, True, None).tolist() == [0, 2, 3, 4, 6]
+    assert _order(VALUES, True, 2).tolist() == [0, 2]
+
+
+@pytest.mark.parametrize("limit", [1, 2, 3, 5, 10])
+def test_order_limit_matches_full_sort(limit):
+    assert _order(VALUES, False, limit).tolist() == _order(VALUES, False, None).tolist()[:limit]
+
+
+def test_order_limit_zero():
+    assert _order(VALUES, False, 0).tolist() == []
+    assert _order(VALUES, True, 0).tolist() == []
+
+
+def test_order_all_missing():
+    assert _order(np.full(3, np.nan), False, 2).tolist() == []
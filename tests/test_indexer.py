@@ -0,0 +1,79 @@
+import tantivy
+
+import indexer
+
+
+def _write(tmp_path, text):
+    path = tmp_path / "series.csv"
+    path.write_text(text, encoding="utf-8")
+    return path
+
+
+def test_read_csv_splits_only_multi_valued_columns(tmp_path):
+    path = _write(tmp_path, "id,title,description,genres,tmdb_genre_ids,countries\n"
+                            "s1,Foo | Bar,A|B story,Drama|Crime,18|80,US\n")
+    (record,) = indexer.read_csv(path)
+    assert record["title"] == "Foo | Bar"
+    assert record["description"] == "A|B story"
+    assert record["genres"] == ["Drama", "Crime"]
+    assert record["tmdb_genre_ids"] == ["18", "80"]
+    # a single value of a multi-valued column stays a scalar
+    assert record["countries"] == "US"
+
+
+def test_read_csv_custom_separator_and_fields(tmp_path):
+    path = _write(tmp_path, "id,title,genres\ns1,A;B,Drama;Crime\n")
+    (record,) = indexer.read_csv(path, list_separator=";", list_fields=("title",))
+    assert record["title"] == ["A", "B"]
+    assert record["genres"] == "Drama;Crime"
+
+
+def test_read_csv_skips_missing_cells(tmp_path):
+    path = _write(tmp_path, "id,title,genres\ns1,Only title\n")
+    (record,) = indexer.read_csv(path)
+    assert record == {"id": "s1", "title": "Only title"}
+
+
+def test_to_document_lists_and_scalars():
+    doc = indexer.to_document({
+        "id": "s1",
+        "title": "Dark",
+        "genres": ["Drama", "Mystery"],
+        "tmdb_genre_ids": ["18", 9648],
+        "follower": "1200.0",
+        "tmdb_popularity": "3.5",
+    })
+    values = doc.to_dict()
+    assert values["title"] == ["Dark"]
+    assert values["genres"] == ["Drama", "Mystery"]
+    assert values["tmdb_genre_ids"] == [18, 9648]
+    assert values["follower"] == [1200]
+    assert values["tmdb_popularity"] == [3.5]
+
+
+def test_to_document_skips_unknown_and_empty_values():
+    values = indexer.to_document({"id": "s1", "unknown": "x", "title": "", "genres": ["", None, "Drama"]}).to_dict()
+    assert "unknown" not in values
+    assert "title" not in values
+    assert values["genres"] == ["Drama"]
+
+
+def test_id_term():
+    assert indexer.id_term("Show42") == "show42"
+
+
+def test_index_records_skips_bad_records(tmp_path):
+    records = [
+        {"id": "a1", "title": "One"},
+        {"id": "two tokens", "title": "Bad id"},
+        {"title": "No id"},
+        {"id": "b1", "follower": "many"},
+        {"id": "a1", "title": "One again"},
+    ]
+    assert indexer.index_records(records, tmp_path / "index", heap_size=15_000_000, batch_size=1) == 2
+    index = tantivy.Index.open(str(tmp_path / "index"))
+    searcher = index.searcher()
+    # the second a1 replaced the first
+    assert searcher.num_docs == 1
+    (_, address), = searcher.search(tantivy.Query.all_query(), 10).hits
+    assert searcher.doc(address)["title"] == ["One again"]
@@ -0,0 +1,27 @@
+import pytest
+
+from query_cache import normalize
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("Breaking  Bad", "breaking bad"),
+    ("  The\tWire\n", "the wire"),
+    ("crime AND Berlin", "crime AND berlin"),
+    ("crime OR drama NOT comedy", "crime OR drama NOT comedy"),
+    ("genres: IN [Drama Crime]", "genres: IN [drama crime]"),
+    ("start:[2000 TO 2010]", "start:[2000 TO 2010]"),
+    ('"Breaking Bad" AND Season', '"breaking bad" AND season'),
+])
+def test_normalize(text, expected):
+    assert normalize(text) == expected
+
+
+def test_normalize_lowercases_operators_typed_in_lowercase():
+    # the parser only treats upper-case words as operators
+    assert normalize("rock and roll") == "rock and roll"
+    assert normalize("And Or") == "and or"
+
+
+def test_normalize_is_idempotent():
+    text = 'Dark  "Time Travel" AND start:[2017 TO *]'
+    assert normalize(normalize(text)) == normalize(text)
@@ -0,0 +1,63 @@
+import numpy as np
+
+from rerank import exposure_rerank, mix
+
+
+def test_mix_spreads_offered_slots_evenly():
+    assert mix([0, 1, 2, 3], [10, 11], 0.5).tolist() == [0, 10, 2, 11]
+
+
+def test_mix_keeps_primary_when_candidate_already_ranked():
+    assert mix([0, 1, 2, 3], [2, 11], 0.5).tolist() == [0, 1, 2, 11]
+
+
+def test_mix_factor_bounds():
+    assert mix([0, 1, 2], [10, 11, 12], 0.0).tolist() == [0, 1, 2]
+    assert mix([0, 1, 2], [10, 11, 12], 1.0).tolist() == [10, 11, 12]
+
+
+def test_mix_runs_out_of_secondary():
+    assert mix([0, 1, 2, 3], [10], 1.0).tolist() == [10, 1, 2, 3]
+
+
+def test_mix_is_deterministic():
+    primary, secondary = np.arange(20), np.arange(100, 120)
+    assert np.array_equal(mix(primary, secondary, 0.3), mix(primary, secondary, 0.3))
+    assert np.array_equal(mix(primary, secondary, 0.3, seed=7), mix(primary, secondary, 0.3, seed=7))
+
+
+def test_mix_empty():
+    assert mix([], [1, 2], 0.5).tolist() == []
+
+
+def test_exposure_rerank_without_targets_is_relevance_order():
+    ranked = exposure_rerank(["a", "b", "c"], [1.0, 3.0, 2.0], {}, {})
+    assert ranked.tolist() == [1, 2, 0]
+
+
+def test_exposure_rerank_ties_keep_input_order():
+    ranked = exposure_rerank(["a", "b", "c", "d"], [1.0, 2.0, 2.0, 2.0], {}, {})
+    assert ranked.tolist() == [1, 2, 3, 0]
+
+
+def test_exposure_rerank_meets_target():
+    ids = ["a", "b", "c", "d"]
+    relevance = [4.0, 3.0, 2.0, 1.0]
+    attributes = {"non_males": [0.0, 0.0, 0.0, 1.0]}
+    assert exposure_rerank(ids, relevance, attributes, {"non_males": 0.5}, k=2).tolist() == [3, 0]
+    # the target is met after the first position, so relevance decides again
+    assert exposure_rerank(ids, relevance, attributes, {"non_males": 0.5}).tolist() == [3, 0, 1, 2]
+
+
+def test_exposure_rerank_target_without_candidates_falls_back_to_relevance():
+    ranked = exposure_rerank(["a", "b"], [1.0, 2.0], {"females": [0.0, np.nan]}, {"females": 0.5})
+    assert ranked.tolist() == [1, 0]
+
+
+def test_exposure_rerank_ranks_first_occurrence_of_each_id():
+    ranked = exposure_rerank(["a", "b", "a"], [1.0, 2.0, 5.0], {}, {})
+    assert ranked.tolist() == [1, 0]
+
+
+def test_exposure_rerank_k_larger_than_candidates():
+    assert exposure_rerank(["a", "b"], [1.0, 2.0], {}, {}, k=10).tolist() == [1, 0]
@@ -0,0 +1,232 @@
+import re
+import threading
+import unicodedata
+
+import numpy as np
+from cachetools import LRUCache
+
+import columns
+import search_service
+
+WEIGHT_FIELDS = ("tmdb_popularity", "follower")
+MIN_FUZZY_LENGTH = 3
+# Prefixes up to this length match large parts of the catalog; their best
+# SHORT_K entries are precomputed instead of ranked per keystroke.
+SHORT_PREFIX = 2
+SHORT_K = 10
+
+_NON_WORD = re.compile(r"[\W_]+")
+# Sorts after every character a normalized title can contain
+_MAX_CHAR = "\U0010ffff"
+
+_used = False
+
+
+def normalize(text):
+    """
+        Fold a title or a typed prefix for matching.
+
+        Accents are removed, case is folded and runs of punctuation and
+        whitespace become one space, so 'Borgen – Power & Glory' and
+        'borgen power' share a prefix.
+
+        Args:
+            text (str): Title or user input.
+
+        Returns:
+            str: The folded text.
+        """
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return _NON_WORD.sub(" ", text.casefold()).strip()
+
+
+def edits(prefix, alphabet):
+    """
+        All strings one deletion, transposition, substitution or insertion
+        away from a prefix.
+
+        An insertion at the end is left out: every completion of the prefix
+        is matched exactly anyway.
+
+        Args:
+            prefix (str): Normalized prefix.
+            alphabet (str): Characters to substitute and insert.
+
+        Returns:
+            set: The variants, without the prefix itself.
+        """
+    splits = [(prefix[:i], prefix[i:]) for i in range(len(prefix) + 1)]
+    variants = {a + b[1:] for a, b in splits if b}
+    variants |= {a + b[1] + b[0] + b[2:] for a, b in splits if len(b) > 1}
+    variants |= {a + c + b[1:] for a, b in splits if b for c in alphabet}
+    variants |= {a + c + b for a, b in splits if b for c in alphabet}
+    variants.discard(prefix)
+    variants.discard("")
+    return variants
+
+
+class Typeahead:
+    """
+        Prefix index over the titles of all series for autocompletion.
+
+        Every series (the most popular document of each `id`) contributes one
+        key per word of its normalized title: the rest of the title from that
+        word on, so 'office' completes 'The Office'. The keys live in one
+        sorted NumPy string array; a prefix is the range between two binary
+        searches, and all fuzzy variants of a prefix are looked up with one
+        vectorized searchsorted. The best entries of one- and two-character
+        prefixes, which span large ranges, are precomputed. Suggestions are
+        ordered by
+        log(1 + tmdb_popularity) + log(1 + follower), exact matches first.
+
+        Args:
+            store (columns.ColumnStore): Columns of the searcher.
+            weight_fields (tuple): Fast fields whose log values are summed
+                into the popularity weight.
+            cache_size (int): Number of cached suggestion lists; short
+                prefixes span large key ranges and repeat often.
+        """
+
+    def __init__(self, store, weight_fields=WEIGHT_FIELDS, cache_size=4096):
+        self.store = store
+        weights = np.zeros(store.num_rows)
+        for field_name in weight_fields:
+            weights += np.nan_to_num(np.log1p(np.clip(store.columns[field_name], 0, None)))
+        titles = store.stored("title")
+        codes = store.id_codes
+        candidates = np.flatnonzero(store.alive & (codes >= 0) & np.not_equal(titles, None))
+        candidates = candidates[np.lexsort((-weights[candidates], codes[candidates]))]
+        rows = candidates[np.unique(codes[candidates], return_index=True)[1]]
+        self.rows = rows
+        self.titles = titles[rows].tolist()
+        self.weights = weights[rows]
+        keys, owners = [], []
+        for entry, title in enumerate(self.titles):
+            folded = normalize(title)
+            for match in re.finditer(r"\S+", folded):
+                keys.append(folded[match.start():])
+                owners.append(entry)
+        keys = np.array(keys, dtype=str)
+        order = np.argsort(keys, kind="stable")
+        self.keys = keys[order]
+        self.owners = np.array(owners, dtype=np.int64)[order]
+        self.alphabet = "".join(sorted(set("".join(self.keys.tolist())) - {" "}))
+        self._short = {}
+        for length in range(1, SHORT_PREFIX + 1):
+            self._short.update(self._top_by_prefix(length, SHORT_K))
+        self._cache = LRUCache(maxsize=cache_size)
+        self._cache_lock = threading.Lock()
+
+    def _top_by_prefix(self, length, k):
+        """Best k entries of every key prefix of the given length."""
+        if len(self.keys) == 0:
+            return {}
+        truncated = self.keys.astype(f"U{length}")
+        prefixes, starts = np.unique(truncated, return_index=True)
+        groups = np.repeat(np.arange(len(prefixes)), np.diff(np.append(starts, len(truncated))))
+        order = np.lexsort((-self.weights[self.owners], groups))
+        groups, owners = groups[order], self.owners[order]
+        # an entry can have several keys with the same prefix
+        first = np.sort(np.unique(groups * len(self.titles) + owners, return_index=True)[1])
+        groups, owners = groups[first], owners[first]
+        ranks = np.arange(len(groups)) - np.searchsorted(groups, groups)
+        keep = ranks < k
+        groups, owners = groups[keep], owners[keep]
+        tops = np.split(owners, np.searchsorted(groups, np.arange(1, len(prefixes))))
+        return {prefix: top for prefix, top in zip(prefixes.tolist(), tops) if len(prefix) == length}
+
+    def _matches(self, prefixes):
+        """Entries with a key starting with any of the prefixes."""
+        prefixes = np.array(prefixes, dtype=str)
+        lo = np.searchsorted(self.keys, prefixes, side="left")
+        hi = np.searchsorted(self.keys, np.char.add(prefixes, _MAX_CHAR), side="left")
+        slices = [self.owners[a:b] for a, b in zip(lo.tolist(), hi.tolist()) if b > a]
+        if not slices:
+            return np.zeros(0, dtype=np.int64)
+        return np.unique(np.concatenate(slices))
+
+    def _best(self, entries, k):
+        if len(entries) > k:
+            entries = entries[np.argpartition(-self.weights[entries], k - 1)[:k]]
+        return entries[np.argsort(-self.weights[entries], kind="stable")]
+
+    def entries(self, text, k=5, fuzzy=True):
+        """
+            Return the best matching entries for typed text.
+
+            Args:
+                text (str): What the user typed so far.
+                k (int): Maximum number of suggestions.
+                fuzzy (bool): Fill up with titles one edit away from the
+                    prefix (from MIN_FUZZY_LENGTH characters on).
+
+            Returns:
+                np.ndarray: Entry numbers, best first.
+            """
+        prefix = normalize(text)
+        if not prefix or k <= 0:
+            return np.zeros(0, dtype=np.int64)
+        key = (prefix, k, fuzzy)
+        with self._cache_lock:
+            result = self._cache.get(key)
+        if result is None and len(prefix) <= SHORT_PREFIX and k <= SHORT_K:
+            result = self._short.get(prefix, np.zeros(0, dtype=np.int64))[:k]
+        if result is None:
+            exact = self._matches([prefix])
+            result = self._best(exact, k)
+            if fuzzy and len(result) < k and len(prefix) >= MIN_FUZZY_LENGTH:
+                close = np.setdiff1d(self._matches(sorted(edits(prefix, self.alphabet))), exact,
+                                     assume_unique=True)
+                result = np.concatenate((result, self._best(close, k - len(result))))
+            with self._cache_lock:
+                self._cache[key] = result
+        return result
+
+    def suggest(self, text, k=5, fuzzy=True):
+        """
+            Return title suggestions for typed text.
+
+            Args:
+                text (str): What the user typed so far.
+                k (int): Maximum number of suggestions.
+                fuzzy (bool): Also suggest titles one edit away.
+
+            Returns:
+                list: [(title, tantivy.DocAddress), ...], best first.
+            """
+        entries = self.entries(text, k, fuzzy)
+        return list(zip([self.titles[i] for i in entries.tolist()], self.store.addresses(self.rows[entries])))
+
+
+def get_typeahead(index_path=search_service.INDEX_PATH):
+    """
+        Return the typeahead index of the shared searcher, built once per snapshot.
+
+        Args:
+            index_path (str): Directory of the tantivy index.
+
+        Returns:
+            Typeahead: The prefix index.
+        """
+    global _used
+    _used = True
+    return search_service.get_snapshot(index_path).derived("typeahead", _build)
+
+
+def _build(snapshot):
+    return Typeahead(columns.of(snapshot))
+
+
+def warm(snapshot):
+    """Build the typeahead index of a new snapshot once it has been used."""
+    if _used:
+        snapshot.derived("typeahead", _build)
+
+
+search_service.add_warmer(warm)
+
+
+def suggest(text, k=5, fuzzy=True, index_path=search_service.INDEX_PATH):
+    """Title suggestions from the shared index, see Typeahead.suggest."""
+    return get_typeahead(index_path).suggest(text, k, fuzzy)
@@ -1,233 +1,244 @@
-import random
 import streamlit as st
-import tantivy
-import toml
-from streamlit_extras.stylable_container import stylable_container
-import plotly.express as px
-import pandas as pd
-from streamlit_card import card
+import numpy as np
+
+import demographics
+import posters
+import profiling
+import records
+import rerank
+import styles
+from columns import get_columns
 
 TMDB_PATH = "https://image.tmdb.org/t/p/original"
 TMDB_PATH_SMALL = "https://image.tmdb.org/t/p/w200"
-config = toml.load('.streamlit/config.toml')
-primary_color = config['theme']['primaryColor']
-primary_button = config['theme']['primaryButton']
-secondary_button = config['theme']['secondaryButton']
-container_style = f"""
-                 {{
-
-                    box-shadow: 2.5px 2.5px 5px rgba(0, 0, 0, 0.2);
-                    #border: 1px solid ; 
-                    #background-color: rgb(240, 240, 242);
-                }}
-
-                .rec {{
-                    background-color: white;
-                    height: 250px;
-                    overflow-y: auto !important;  /* Enable vertical scrolling */
-                    background: linear-gradient(to bottom, transparent, white 90%);
-                    z-index: 0;
 
-                }}
 
-                .rec > p {{
-                    margin: 10px;
-                }}
+def rank(searcher, hits, exclude_address, field_name, sim, limit=None, columns=None, distinct=False):
+    """
+        Rank documents by a given numeric field (e.g., 'tmdb_popularity').
 
+        The field values are read from the fast-field column store, so stored
+        documents are only fetched for the ranked hits that are returned.
 
+        Args:
+            searcher (tantivy.Searcher): The Tantivy searcher object.
+            hits (list): List of search results [(score, doc_address), ...].
+            exclude_address (int): Document address to exclude from ranking.
+            field_name (str): Name of the numeric field to sort by.
+            sim (bool): Keep the search order instead of sorting by the field.
+            limit (int, optional): Only fetch and return the top `limit` documents.
+            columns (ColumnStore, optional): Columns of `searcher`; defaults to
+                the shared store of the default index.
+            distinct (bool, optional): Keep only one document per series id.
 
-                .rec > .title > a {{
-                    color: {primary_button} !important;
-                }}
+        Returns:
+            list: Sorted list of records.SeriesRecord (RESULT_FIELDS) based on
+                the numeric field.
+        """
+    if columns is None:
+        columns = get_columns()
+    with profiling.span("rank"):
+        addresses = columns.rank(hits, field_name, exclude_address, sim, limit, distinct)
+    with profiling.span("doc"):
+        return [records.load(searcher, address) for address in addresses]
 
-                .rec > div {{
-                    padding-left: 5px;
-                }}
 
-                .rec  > img {{
-                    padding-left: 10px;
-                }}
+def rank_all(searcher, hits, exclude_address, orderings, limit=None, columns=None, distinct=False):
+    """
+        Rank the same hits by several fields at once.
 
+        Each candidate is looked up in the column store once, and every stored
+        document is fetched at most once even if it appears in several
+        orderings.
 
-                .rec:after {{
-                    content: '⇩';
-                    position: absolute;
-                    bottom: 5px;
-                    right: 10px;
-                    pointer-events: none; /* Ensure it doesn't interfere with scrolling */
-                }}
+        Args:
+            searcher (tantivy.Searcher): The Tantivy searcher object.
+            hits (list): List of search results [(score, doc_address), ...].
+            exclude_address (int): Document address to exclude from ranking.
+            orderings (dict): Ordering name -> (field_name, sim), see `rank`.
+            limit (int, optional): Only fetch and return the top `limit`
+                documents per ordering.
+            columns (ColumnStore, optional): Columns of `searcher`; defaults to
+                the shared store of the default index.
+            distinct (bool, optional): Keep only one document per series id.
 
-                .title {{
-                    font-weight: bold;
-                    color: {primary_button};
-                    text-align: left;
-                }}
+        Returns:
+            dict: Ordering name -> sorted list of records.SeriesRecord.
+        """
+    if columns is None:
+        columns = get_columns()
+    with profiling.span("rank"):
+        ranked = columns.rank_many(hits, orderings, exclude_address, limit, distinct)
+    docs = {}
+    result = {}
+    with profiling.span("doc"):
+        for name, addresses in ranked.items():
+            result[name] = []
+            for address in addresses:
+                key = (address.segment_ord, address.doc)
+                if key not in docs:
+                    docs[key] = records.load(searcher, address)
+                result[name].append(docs[key])
+    return result
+
+
+@profiling.timed("re_rank")
+def re_rank(ranked_docs_1, ranked_docs_2, factor, seed=None):
+    """
+        Mix a second ranking into the first one (see rerank.mix).
 
-                """
+        Each slot of `ranked_docs_1` is offered to the next document of
+        `ranked_docs_2` with probability `factor`; the document takes the slot
+        unless its series is already in `ranked_docs_1`.
 
+        Args:
+            ranked_docs_1 (list): Documents of the primary ranking.
+            ranked_docs_2 (list): Documents of the secondary ranking.
+            factor (float): Share of slots offered to the secondary ranking.
+            seed (int, optional): Seed for random slots; without one the
+                offered slots are spread evenly and the result is deterministic.
 
-def rank(searcher, hits, exclude_address, field_name, sim):
+        Returns:
+            list: The re-ranked documents.
+        """
+    codes = {}
+    for doc in ranked_docs_1 + ranked_docs_2:
+        codes.setdefault(doc.id, len(codes))
+    docs = {codes[doc.id]: doc for doc in reversed(ranked_docs_2)}
+    primary = [codes[doc.id] for doc in ranked_docs_1]
+    secondary = [codes[doc.id] for doc in ranked_docs_2]
+    mixed = rerank.mix(np.array(primary, dtype=np.int64), np.array(secondary, dtype=np.int64), factor, seed)
+    return [doc if code == original else docs[code]
+            for doc, code, original in zip(ranked_docs_1, mixed.tolist(), primary)]
+
+
+def fair_rank(searcher, hits, exclude_address, field_name, targets, limit=None, columns=None):
     """
-        Rank documents by a given numeric field (e.g., 'tmdb_popularity').
+        Rank hits by a numeric field under minimum creator-exposure targets.
+
+        Works on all candidate hits at once (see rerank.exposure_rerank) and
+        only fetches the stored documents of the returned ranking.
 
         Args:
             searcher (tantivy.Searcher): The Tantivy searcher object.
             hits (list): List of search results [(score, doc_address), ...].
             exclude_address (int): Document address to exclude from ranking.
-            field_name (str): Name of the numeric field to sort by.
+            field_name (str): Numeric field giving the relevance order.
+            targets (dict): Attribute -> minimum average share of the ranked
+                prefix. Attributes are 'non_males' and the creator shares
+                'females' and 'other'.
+            limit (int, optional): Length of the ranking.
+            columns (ColumnStore, optional): Columns of `searcher`; defaults to
+                the shared store of the default index.
 
         Returns:
-            list: Sorted list of documents based on the numeric field.
+            list: The ranked records.SeriesRecord.
         """
-    # List to store valid documents with their field value
-    docs_with_field = []
-
-    for score, doc_address in hits:
-        # Exclude the specified address
-        if doc_address == exclude_address:
-            continue
-
-        # Retrieve the document from the searcher
-        doc = searcher.doc(doc_address)
-
-        # Safely extract the numeric field value
-        try:
-            # Get the field values (list) and convert the first value to a float
-            field_values = doc[field_name]
-            if field_values:  # Ensure the field is not empty or missing
-                field_value = float(field_values[0])
-                docs_with_field.append((doc, field_value))
-        except (KeyError, ValueError, TypeError):
-            # Skip documents without the field or with invalid data
-            continue
-
-    # Sort the documents by the extracted field value in descending order
-    sorted_docs = sorted(docs_with_field, key=lambda x: x[1], reverse=True)
-    # Return only the sorted documents (exclude the numeric values)
-    if sim:
-        return [doc for doc, _ in docs_with_field]
-    else:
-        return [doc for doc, _ in sorted_docs]
-
-
-def re_rank(ranked_docs_1, ranked_docs_2, factor):
-    reranked_list = []
-    outcomes = [True, False]
-    weights = [factor, 1 - factor]
-
-    # Generate a single random boolean value
-    #replace = random.choices(outcomes, weights=weights, k=1)[0]
-
-    for doc in ranked_docs_1:
-        if random.random() < factor:
-            candidate = ranked_docs_2.pop(0)
-            # if candidate not in reranked_list:
-            if candidate not in ranked_docs_1:
-                reranked_list.append(candidate)
-            else:
-                reranked_list.append(doc)
-        else:
-            reranked_list.append(doc)
-
-    return reranked_list
-
-
-def print_recommendations(sort_docs, selected, gender_flag):
-    males = []
-    females = []
-    other = []
-    for doc in sort_docs:
-        males.append(doc["males"][0])
-        females.append(doc["females"][0])
-        other.append(doc["other"][0])
-    data = {
-        'Category': ['male', 'female', 'non-binary'],
-        'Creators': [sum(males), sum(females), sum(other)]
-    }
-    df = pd.DataFrame(data)
-    fig = px.pie(
-        df,
-        values='Creators',
-        names='Category',
-        title='',
-        hole=0.3,  # Optional: creates a donut chart effect
-        color_discrete_sequence=["#31356e", "#2d8bba", "#cb6ce6"]
-    )
-    # Customize layout
-    fig.update_traces(
-        textposition='inside',
-        textinfo='percent+label',
-    )
-    fig.update_layout(
-        height=330,
-    )
-
-    selected_image = ""
-    if len(selected["tmdb_poster_path"]) > 0:
-        selected_image = TMDB_PATH_SMALL + selected["tmdb_poster_path"][0]
-    col1, col2 = st.columns([1, 1])
-    with col1:
-        hasClicked = card(
-            key=str(gender_flag) + selected["id"][0],
-            title=selected["title"],
-            text="",
-            image=selected_image,
-            url=selected["url"],
-            styles={
-                "card": {
-                    "margin-top": "20px",
-                    #"height": "150px",
-                    "border-radius": "0px",
-                    "color": "rgb(240, 240, 242)",  # Set background color
-                    "box-shadow": "0 0 5px rgba(0,0,0,0.5)",
-                    "width": "200px"
+    if columns is None:
+        columns = get_columns()
+    with profiling.span("re_rank"):
+        addresses = [address for _, address in hits if address != exclude_address]
+        if not addresses:
+            return []
+        rows = columns.rows(addresses)
+        creators = (columns.columns["males"][rows] + columns.columns["females"][rows]
+                    + columns.columns["other"][rows])
+        with np.errstate(invalid="ignore", divide="ignore"):
+            attributes = {
+                "non_males": columns.columns["non_males"][rows],
+                "females": columns.columns["females"][rows] / creators,
+                "other": columns.columns["other"][rows] / creators,
+            }
+        relevance = np.nan_to_num(columns.columns[field_name][rows], nan=-np.inf)
+        positions = rerank.exposure_rerank(columns.id_codes[rows], relevance, attributes, targets, limit)
+    with profiling.span("doc"):
+        return [records.load(searcher, addresses[i]) for i in positions.tolist()]
 
+
+@profiling.timed("chart")
+def gender_chart(sort_docs):
+    """
+        Return the creator-gender pie chart of a result list as a figure spec.
+
+        The totals are gathered from the fast-field columns and the finished
+        spec is cached by the tuple of result ids (see demographics.chart_spec).
+
+        Args:
+            sort_docs (list): Documents of the result list.
+
+        Returns:
+            dict: Plotly figure spec for st.plotly_chart.
+        """
+    return demographics.chart_spec(tuple(doc.id for doc in sort_docs))
+
+
+def print_recommendations(sort_docs, selected, gender_flag, fig=None):
+    # the component packages are only needed once recommendations are shown
+    from streamlit_card import card
+    from streamlit_extras.stylable_container import stylable_container
+
+    if fig is None:
+        fig = gender_chart(sort_docs)
+
+    with profiling.span("cards"):
+        selected_image = posters.image_url(selected.tmdb_poster_path)
+        col1, col2 = st.columns([1, 1])
+        with col1:
+            hasClicked = card(
+                key=str(gender_flag) + selected.id,
+                title=selected.title,
+                text="",
+                image=selected_image,
+                url=selected.url,
+                styles={
+                    "card": {
+                        "margin-top": "20px",
+                        #"height": "150px",
+                        "border-radius": "0px",
+                        "color": "rgb(240, 240, 242)",  # Set background color
+                        "box-shadow": "0 0 5px rgba(0,0,0,0.5)",
+                        "width": "200px"
+
+                    }
                 }
-            }
-        )
-    with col2:
-        st.plotly_chart(fig, key=gender_flag)
-
-    st.markdown("**You might also like...**")
-    # Iterate through the results to extract documents and scores
-    ids = []
-    for doc in sort_docs:
-        if doc["id"][0] not in ids:
-            ids.append(doc["id"][0])
-            url = doc["url"][0]
-            title = doc["title"][0]
-            if len(doc["tmdb_poster_path"]) > 0:
-                image = TMDB_PATH_SMALL + doc["tmdb_poster_path"][0]
-            else:
-                image = ""
-            if len(doc["tmdb_overview"]) > 0:
-                desc = doc["tmdb_overview"][0]
-            else:
-                desc = doc["description"][0]
-
-            with stylable_container(key="dark_blue", css_styles=container_style):
-                column1, column2 = st.columns([2, 1])
-                with column1:
-                    html = (f'<div class="rec" id="scrollableContent">'
-                            f'<p class="title"><a href="{url}">{title}</a></p>'
-                            f'<p>{desc}</p>'
-                            f'</div>')
-                    st.markdown(html, unsafe_allow_html=True)
-                with column2:
-                    hasClicked = card(
-                        key=str(gender_flag) + doc["id"][0],
-                        title=title,
-                        text="",
-                        image=image,
-                        url=url,
-                        styles={
-                            "card": {
-                                "border-radius": "0px",
-                                "box-shadow": "0 0 5px rgba(0,0,0,0.5)",
-                                "margin": "0px",
-                                "width": "200px"
+            )
+        with col2:
+            st.plotly_chart(fig, key=gender_flag)
+
+        st.markdown("**You might also like...**")
+        # Iterate through the results to extract documents and scores
+        ids = set()
+        for doc in sort_docs:
+            if doc.id not in ids:
+                ids.add(doc.id)
+                url = doc.url
+                title = doc.title
+                image = posters.image_url(doc.tmdb_poster_path)
+                desc = doc.summary()
+
+                with stylable_container(key="dark_blue", css_styles=styles.container_css()):
+                    column1, column2 = st.columns([2, 1])
+                    with column1:
+                        html = (f'<div class="rec" id="scrollableContent">'
+                                f'<p class="title"><a href="{url}">{title}</a></p>'
+                                f'<p>{desc}</p>'
+                                f'</div>')
+                        st.markdown(html, unsafe_allow_html=True)
+                    with column2:
+                        hasClicked = card(
+                            key=str(gender_flag) + doc.id,
+                            title=title,
+                            text="",
+                            image=image,
+                            url=url,
+                            styles={
+                                "card": {
+                                    "border-radius": "0px",
+                                    "box-shadow": "0 0 5px rgba(0,0,0,0.5)",
+                                    "margin": "0px",
+                                    "width": "200px"
+                                }
                             }
-                        }
-                    )
+                        )
 
-                st.write("")
+                    st.write("")
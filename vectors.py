@@ -0,0 +1,338 @@
+import argparse
+import copy
+import json
+import math
+import threading
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+import tantivy
+
+import columns
+import mlt
+import records
+import search_service
+
+VECTORS_PATH = "vectors"
+TEXT_FIELDS = ("title", "description", "tmdb_overview")
+DIMS = 128
+# Random-projection LSH: TABLES hash tables of BITS hyperplanes each
+BITS = 12
+TABLES = 8
+
+_lock = threading.Lock()
+_indexes = {}
+
+
+def _text(values):
+    return " ".join(value for value in values if value)
+
+
+def _terms(text):
+    return mlt.analyze(text, min_word_length=2)
+
+
+def _tfidf(term_lists, vocabulary, idf):
+    """Sublinear TF-IDF rows, L2-normalized, as a CSR matrix."""
+    from scipy import sparse
+
+    indptr, indices, data = [0], [], []
+    for terms in term_lists:
+        counts = Counter(vocabulary[term] for term in terms if term in vocabulary)
+        row = sorted(counts.items())
+        indices.extend(column for column, _ in row)
+        values = [(1 + math.log(count)) * idf[column] for column, count in row]
+        norm = math.sqrt(sum(value * value for value in values)) or 1.0
+        data.extend(value / norm for value in values)
+        indptr.append(len(indices))
+    return sparse.csr_matrix((np.array(data, dtype=np.float32), np.array(indices, dtype=np.int64), indptr),
+                             shape=(len(term_lists), len(idf)))
+
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return (matrix / np.where(norms > 0, norms, 1)).astype(np.float32)
+
+
+def _hash(vectors, planes):
+    """LSH code of every vector in every table, shape (tables, rows)."""
+    bits = (np.einsum("tbd,nd->tnb", planes, vectors) > 0).astype(np.uint32)
+    return (bits << np.arange(planes.shape[1], dtype=np.uint32)).sum(axis=-1, dtype=np.uint32)
+
+
+class VectorIndex:
+    """
+        Memory-mapped latent-semantic vectors with a random-projection LSH index.
+
+        Rows are laid out like the neighbor table (see neighbors.NeighborTable):
+        the position of a document in the concatenation of the index segments
+        at build time. Every table of the LSH index keeps the rows sorted by
+        their code, so a bucket is a range found with two binary searches.
+
+        Args:
+            path (str): Directory written by `build`.
+        """
+
+    def __init__(self, path):
+        path = Path(path)
+        with open(path / "meta.json", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.dims = meta["dims"]
+        self.segment_ids = [segment["segment_id"] for segment in meta["segments"]]
+        sizes = [segment["max_doc"] for segment in meta["segments"]]
+        self.offsets = np.concatenate(([0], np.cumsum(sizes)[:-1])).astype(np.int64)
+        with open(path / "vocabulary.json", encoding="utf-8") as f:
+            self.vocabulary = {term: column for column, term in enumerate(json.load(f))}
+        self.idf = np.load(path / "idf.npy")
+        self.components = np.load(path / "components.npy")
+        self.vectors = np.load(path / "vectors.npy", mmap_mode="r")
+        self.planes = np.load(path / "planes.npy")
+        self.codes = np.load(path / "codes.npy", mmap_mode="r")
+        self.order = np.load(path / "order.npy", mmap_mode="r")
+
+    def bind(self, segment_ids, store):
+        """
+            Map rows onto the segment ordinals of a searcher.
+
+            Args:
+                segment_ids (list): Segment ids of the searcher, in order.
+                store (columns.ColumnStore): Columns of the same searcher, used
+                    to skip documents deleted since the build.
+
+            Returns:
+                VectorIndex: A copy bound to the searcher, sharing the
+                memory-mapped arrays.
+            """
+        bound = copy.copy(self)
+        positions = {segment_id: i for i, segment_id in enumerate(self.segment_ids)}
+        bound._table_offsets = np.array([self.offsets[positions[s]] if s in positions else -1
+                                        for s in segment_ids], dtype=np.int64)
+        current = {segment_id: i for i, segment_id in enumerate(segment_ids)}
+        bound._segment_ords = np.array([current.get(s, -1) for s in self.segment_ids], dtype=np.int64)
+        bound._store = store
+        return bound
+
+    def row(self, address):
+        """Row of a document of the bound searcher, None if it is newer than the build."""
+        offset = self._table_offsets[address.segment_ord]
+        return None if offset < 0 else int(offset + address.doc)
+
+    def embed(self, text):
+        """
+            Fold free text into the latent space.
+
+            Args:
+                text (str): Any text, e.g. the description of a series indexed
+                    after the build.
+
+            Returns:
+                np.ndarray: Normalized float32 vector, all zeros if no term of
+                the text is in the vocabulary.
+            """
+        return _normalize(_tfidf([_terms(text)], self.vocabulary, self.idf) @ self.components.T)[0]
+
+    def candidates(self, vector):
+        """Rows sharing an LSH bucket with the vector, or one bit away, in any table."""
+        bits = self.planes.shape[1]
+        codes = _hash(vector[None, :], self.planes)[:, 0]
+        flips = np.concatenate(([0], np.uint32(1) << np.arange(bits, dtype=np.uint32))).astype(np.uint32)
+        slices = []
+        for table, code in enumerate(codes.tolist()):
+            probes = np.bitwise_xor(np.uint32(code), flips)
+            lo = np.searchsorted(self.codes[table], probes, side="left")
+            hi = np.searchsorted(self.codes[table], probes, side="right")
+            slices.extend(self.order[table][a:b] for a, b in zip(lo.tolist(), hi.tolist()) if b > a)
+        if not slices:
+            return np.zeros(0, dtype=np.int64)
+        return np.unique(np.concatenate(slices))
+
+    def search(self, vector, k, exact=False):
+        """
+            Approximate nearest neighbors of a vector by cosine similarity.
+
+            The LSH candidates are scored exactly; if they are fewer than k,
+            all rows are scored.
+
+            Args:
+                vector (np.ndarray): Normalized query vector.
+                k (int): Number of neighbors.
+                exact (bool): Score all rows.
+
+            Returns:
+                list: [(score, doc_address), ...] like `searcher.search().hits`,
+                live documents of the bound searcher only.
+            """
+        rows = None if exact else self.candidates(vector)
+        if rows is None or len(rows) < k:
+            rows = np.arange(len(self.vectors))
+        table_segments = np.searchsorted(self.offsets, rows, side="right") - 1
+        segment_ords = self._segment_ords[table_segments]
+        docs = rows - self.offsets[table_segments]
+        live = segment_ords >= 0
+        live[live] = self._store.alive[self._store.offsets[segment_ords[live]] + docs[live]]
+        rows, segment_ords, docs = rows[live], segment_ords[live], docs[live]
+        scores = self.vectors[rows] @ vector
+        if len(scores) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(len(scores))
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(score, tantivy.DocAddress(segment_ord, doc)) for score, segment_ord, doc in
+                zip(scores[top].tolist(), segment_ords[top].tolist(), docs[top].tolist())]
+
+    def similar(self, searcher, address, k):
+        """
+            Nearest neighbors of a document, the document itself included.
+
+            Documents indexed after the build are folded in from their text.
+
+            Args:
+                searcher (tantivy.Searcher): The bound searcher.
+                address (tantivy.DocAddress): Address of the series.
+                k (int): Number of neighbors.
+
+            Returns:
+                list: [(score, doc_address), ...] best first.
+            """
+        row = self.row(address)
+        if row is not None:
+            vector = np.asarray(self.vectors[row])
+        else:
+            doc = records.load(searcher, address, TEXT_FIELDS)
+            vector = self.embed(_text(getattr(doc, name) for name in TEXT_FIELDS))
+        if not vector.any():
+            return []
+        return self.search(vector, k)
+
+
+def blend(vector_hits, bm25_hits, weight=0.5):
+    """
+        Combine vector and BM25 hits into one ranking.
+
+        BM25 scores are divided by the best BM25 score, so both parts are in
+        [0, 1]; a hit missing from one list gets 0 for that part.
+
+        Args:
+            vector_hits (list): [(cosine, doc_address), ...].
+            bm25_hits (list): [(bm25 score, doc_address), ...].
+            weight (float): Share of the vector similarity.
+
+        Returns:
+            list: [(score, doc_address), ...] best first.
+        """
+    top = max((score for score, _ in bm25_hits), default=0) or 1.0
+    combined = {}
+    for score, address in vector_hits:
+        combined[(address.segment_ord, address.doc)] = [weight * max(score, 0.0), address]
+    for score, address in bm25_hits:
+        entry = combined.setdefault((address.segment_ord, address.doc), [0.0, address])
+        entry[0] += (1 - weight) * score / top
+    return sorted(((score, address) for score, address in combined.values()), key=lambda hit: -hit[0])
+
+
+def get_index(path=VECTORS_PATH, index_path=search_service.INDEX_PATH):
+    """
+        Return the vector index bound to the shared searcher, if one was built.
+
+        Args:
+            path (str): Directory written by `build`.
+            index_path (str): Directory of the tantivy index.
+
+        Returns:
+            VectorIndex: The loaded index, or None if there is none.
+        """
+    index = _indexes.get(path)
+    if index is None:
+        if not (Path(path) / "meta.json").exists():
+            return None
+        with _lock:
+            index = _indexes.get(path)
+            if index is None:
+                index = VectorIndex(path)
+                _indexes[path] = index
+    return search_service.get_snapshot(index_path).derived(
+        ("vectors", path), lambda snapshot: index.bind(snapshot.segment_ids, columns.of(snapshot)))
+
+
+def build(index_path=search_service.INDEX_PATH, output=VECTORS_PATH, dims=DIMS, bits=BITS, tables=TABLES,
+          min_df=2, max_df_ratio=0.5, max_terms=50000, seed=0):
+    """
+        Build the TF-IDF matrix, reduce it with truncated SVD and hash the vectors.
+
+        Usage: python vectors.py --index test --output vectors --dims 128
+
+        Args:
+            index_path (str): Directory of the tantivy index.
+            output (str): Directory to write the arrays and meta.json to.
+            dims (int): Dimensions of the latent space.
+            bits (int): Hyperplanes per LSH table (at most 32).
+            tables (int): Number of LSH tables.
+            min_df (int): Ignore terms found in fewer documents.
+            max_df_ratio (float): Ignore terms found in more than this share
+                of the documents.
+            max_terms (int): Keep the most frequent terms only.
+            seed (int): Seed of the SVD start vector and the hyperplanes.
+
+        Returns:
+            int: Number of documents with a vector.
+        """
+    from scipy.sparse.linalg import svds
+
+    store = columns.get_columns(index_path)
+    texts = zip(*(store.stored(name) for name in TEXT_FIELDS))
+    term_lists = [_terms(_text(values)) if alive else [] for values, alive in zip(texts, store.alive.tolist())]
+    num_docs = int(store.alive.sum())
+    doc_freqs = Counter(term for terms in term_lists for term in set(terms))
+    kept = [term for term, count in doc_freqs.items() if min_df <= count <= max_df_ratio * num_docs]
+    kept = sorted(sorted(kept), key=lambda term: -doc_freqs[term])[:max_terms]
+    vocabulary = {term: column for column, term in enumerate(kept)}
+    idf = np.array([math.log((1 + num_docs) / (1 + doc_freqs[term])) + 1 for term in kept], dtype=np.float32)
+    matrix = _tfidf(term_lists, vocabulary, idf)
+
+    rng = np.random.default_rng(seed)
+    dims = min(dims, min(matrix.shape) - 1)
+    _, _, components = svds(matrix, k=dims, v0=rng.uniform(-1, 1, min(matrix.shape)))
+    # svds returns the singular vectors by ascending singular value
+    components = components[::-1].astype(np.float32)
+    vectors = _normalize(matrix @ components.T)
+    planes = rng.standard_normal((tables, bits, dims)).astype(np.float32)
+    codes = _hash(vectors, planes)
+    order = np.argsort(codes, axis=1, kind="stable")
+
+    output = Path(output)
+    output.mkdir(parents=True, exist_ok=True)
+    np.save(output / "vectors.npy", vectors)
+    np.save(output / "components.npy", components)
+    np.save(output / "idf.npy", idf)
+    np.save(output / "planes.npy", planes)
+    np.save(output / "codes.npy", np.take_along_axis(codes, order, axis=1))
+    np.save(output / "order.npy", order)
+    with open(output / "vocabulary.json", "w", encoding="utf-8") as f:
+        json.dump(kept, f)
+    segment_ids = search_service.get_segment_ids(index_path)
+    sizes = np.diff(np.append(store.offsets, store.num_rows)).tolist()
+    with open(output / "meta.json", "w", encoding="utf-8") as f:
+        json.dump({
+            "dims": dims,
+            "bits": bits,
+            "tables": tables,
+            "terms": len(kept),
+            "opstamp": search_service.read_meta(index_path)["opstamp"],
+            "segments": [{"segment_id": s, "max_doc": size} for s, size in zip(segment_ids, sizes)],
+        }, f, indent=2)
+    return int(np.count_nonzero(vectors.any(axis=1)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the latent-semantic vectors and their LSH index.")
+    parser.add_argument("--index", default=search_service.INDEX_PATH, help="tantivy index directory")
+    parser.add_argument("--output", default=VECTORS_PATH, help="output directory")
+    parser.add_argument("--dims", type=int, default=DIMS, help="dimensions of the latent space")
+    parser.add_argument("--bits", type=int, default=BITS, help="hyperplanes per LSH table")
+    parser.add_argument("--tables", type=int, default=TABLES, help="number of LSH tables")
+    parser.add_argument("--min-df", type=int, default=2, help="minimum document frequency of a term")
+    parser.add_argument("--max-df", type=float, default=0.5, help="maximum share of documents with a term")
+    args = parser.parse_args()
+    count = build(args.index, args.output, args.dims, args.bits, args.tables, args.min_df, args.max_df)
+    print(f"wrote vectors of {count} documents to {args.output}")
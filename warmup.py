@@ -0,0 +1,252 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+import columns
+import demographics
+import neighbors
+import recommend
+import search_service
+import styles
+import typeahead
+import vectors
+
+logger = logging.getLogger("series.warmup")
+
+# Set SERIES_WARMUP=1 to load index files and caches in the background at startup
+ENABLED = os.environ.get("SERIES_WARMUP") == "1"
+CHUNK_SIZE = 1 << 20
+# Number of most popular series whose recommendations are precomputed; SERIES_PRECOMPUTE=0 turns it off
+TOP_N = int(os.environ.get("SERIES_PRECOMPUTE", "100"))
+PRECOMPUTE_WORKERS = 2
+WEIGHT_FIELDS = ("follower", "tmdb_popularity")
+# Cache entries per series: candidate hits, four orderings and the gender view
+ENTRIES_PER_SERIES = 6
+
+_lock = threading.Lock()
+_threads = {}
+# index key -> number of series precomputed after every reload
+_precomputed = {}
+_executor = None
+
+
+def touch_files(index_path=search_service.INDEX_PATH, chunk_size=CHUNK_SIZE):
+    """
+        Read every file of an index once, so the OS page cache holds it.
+
+        tantivy maps the files into memory; without this the first queries
+        pay for the page faults.
+
+        Args:
+            index_path (str): Directory of the tantivy index.
+            chunk_size (int): Bytes per read.
+
+        Returns:
+            int: Number of bytes read.
+        """
+    total = 0
+    for path in Path(index_path).iterdir():
+        if not path.is_file():
+            continue
+        with open(path, "rb") as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                total += len(chunk)
+    return total
+
+
+def warm_caches(index_path=search_service.INDEX_PATH):
+    """
+        Build the per-process structures the first requests would build.
+
+        Opens the searcher and builds its columns, typeahead and
+        demographics, maps the neighbor table and vector index if they were
+        built, and parses the theme config and CSS.
+
+        Args:
+            index_path (str): Directory of the tantivy index.
+        """
+    snapshot = search_service.get_snapshot(index_path)
+    columns.warm(snapshot)
+    typeahead.get_typeahead(index_path)
+    demographics.get_demographics(index_path)
+    neighbors.get_table(index_path=index_path)
+    vectors.get_index(index_path=index_path)
+    styles.app_css()
+    styles.container_css()
+
+
+def warm_up(index_path=search_service.INDEX_PATH):
+    """Touch the index files and build the caches, logging the time taken."""
+    start = time.perf_counter()
+    size = touch_files(index_path)
+    touched = time.perf_counter()
+    warm_caches(index_path)
+    logger.info("warmed up %s: %.1f MB read in %.0f ms, caches built in %.0f ms", index_path, size / 1e6,
+                (touched - start) * 1000, (time.perf_counter() - touched) * 1000)
+
+
+def top_series(store, n, weight_fields=WEIGHT_FIELDS):
+    """
+        Pick the most popular series from the fast-field columns.
+
+        Series are ordered by log(1 + follower) + log(1 + tmdb_popularity)
+        of their most popular document. Each series is returned with its
+        representative document (see columns.ColumnStore.representative),
+        the one recommend.view computes and caches the series with.
+
+        Args:
+            store (columns.ColumnStore): Columns of the searcher.
+            n (int): Number of series.
+            weight_fields (tuple): Fast fields whose log values are summed.
+
+        Returns:
+            list: tantivy.DocAddress of the series, most popular first.
+        """
+    weights = np.zeros(store.num_rows)
+    for field_name in weight_fields:
+        weights += np.nan_to_num(np.log1p(np.clip(store.columns[field_name], 0, None)))
+    codes = store.id_codes
+    candidates = np.flatnonzero(store.alive & (codes >= 0))
+    if not len(candidates):
+        return []
+    series_weights = np.full(codes.max() + 1, -np.inf)
+    np.maximum.at(series_weights, codes[candidates], weights[candidates])
+    # candidates are in row order, so this is the first row of each series
+    first = candidates[np.unique(codes[candidates], return_index=True)[1]]
+    return store.addresses(first[np.argsort(-series_weights[codes[first]], kind="stable")[:n]])
+
+
+def _precompute_series(index_path, generation, address):
+    with search_service.lease(index_path) as snapshot:
+        # a reload in the meantime starts a new round for the new generation
+        if snapshot.generation != generation:
+            return False
+        for name in recommend.VIEWS:
+            docs = recommend.view(name, address, limit=recommend.TOP_K_OUTPUT, index_path=index_path)
+            demographics.chart_spec(tuple(doc.id for doc in docs), index_path)
+    return True
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(PRECOMPUTE_WORKERS, thread_name_prefix="precompute")
+    return _executor
+
+
+def precompute(index_path=search_service.INDEX_PATH, n=TOP_N):
+    """
+        Fill the shared caches with the recommendations of the top n series.
+
+        Every view of recommend.VIEWS is computed with the limit the pages
+        use, together with its creator chart, on the worker pool. n is
+        capped so the precomputed entries take at most half of
+        recommend.RECOMMENDATION_CACHE; the cache stays an LRU, so series
+        nobody opens make room again.
+
+        Args:
+            index_path (str): Directory of the tantivy index.
+            n (int): Number of series.
+
+        Returns:
+            int: Number of series precomputed on the current snapshot.
+        """
+    n = min(n, recommend.RECOMMENDATION_CACHE.maxsize // (2 * ENTRIES_PER_SERIES))
+    if n <= 0:
+        return 0
+    start = time.perf_counter()
+    with search_service.lease(index_path) as snapshot:
+        addresses = top_series(columns.of(snapshot), n)
+        generation = snapshot.generation
+    futures = []
+    for address in addresses:
+        try:
+            futures.append((address, _get_executor().submit(_precompute_series, index_path, generation, address)))
+        except RuntimeError:
+            # the interpreter is shutting down
+            break
+    count = failed = 0
+    for address, future in futures:
+        try:
+            count += future.result()
+        except Exception:
+            # one broken series must not cost the rest of the round
+            failed += 1
+            logger.exception("precomputing series at %s failed", (address.segment_ord, address.doc))
+    logger.info("precomputed the recommendations of %s series of generation %s in %.0f ms (%s failed)", count,
+                generation, (time.perf_counter() - start) * 1000, failed)
+    return count
+
+
+def _run(index_path, enabled, top_n):
+    try:
+        if enabled:
+            warm_up(index_path)
+        if top_n > 0:
+            precompute(index_path, top_n)
+    except Exception:
+        logger.exception("warming up %s failed", index_path)
+
+
+def _on_reload(index_path, snapshot):
+    # only indexes started with precomputation are precomputed again
+    key = str(Path(index_path).resolve())
+    with _lock:
+        if key not in _precomputed:
+            return
+        thread = _threads[key] = threading.Thread(target=_precompute_after_reload, args=(index_path, _precomputed[key]),
+                                                  name="warmup", daemon=True)
+    thread.start()
+
+
+def _precompute_after_reload(index_path, top_n):
+    try:
+        precompute(index_path, top_n)
+    except Exception:
+        logger.exception("precomputing %s after a reload failed", index_path)
+
+
+def start(index_path=search_service.INDEX_PATH, enabled=ENABLED, top_n=TOP_N):
+    """
+        Start the warm-up in a daemon thread, once per process and index.
+
+        The page does not wait for it; requests arriving meanwhile build what
+        they need themselves, and every structure is built only once. With
+        `enabled`, the index files and caches are loaded first. Then the
+        recommendations of the top_n most popular series are precomputed,
+        again after every reload of the index.
+
+        Args:
+            index_path (str): Directory of the tantivy index.
+            enabled (bool): Load files and caches; defaults to SERIES_WARMUP=1.
+            top_n (int): Series to precompute, 0 for none; defaults to
+                SERIES_PRECOMPUTE or 100.
+
+        Returns:
+            threading.Thread: The warm-up thread, None if there is nothing
+            to do.
+        """
+    if not enabled and top_n <= 0:
+        return None
+    key = str(Path(index_path).resolve())
+    with _lock:
+        thread = _threads.get(key)
+        if thread is None:
+            if top_n > 0:
+                _precomputed[key] = top_n
+            thread = _threads[key] = threading.Thread(target=_run, args=(index_path, enabled, top_n),
+                                                      name="warmup", daemon=True)
+            thread.start()
+    return thread
+
+
+search_service.add_reload_callback(_on_reload)